@@ -14,11 +14,17 @@ import warnings
 import streamlit.components.v1 as components
 import matplotlib.pyplot as plt
 import concurrent.futures
+import contextlib
 from functools import lru_cache
 import time
-import asyncio
-import aiohttp
 import re
+import http.cookiejar
+import json
+import os
+import sqlite3
+import threading
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from urllib3.util.retry import Retry
 
 warnings.filterwarnings('ignore')
 
@@ -390,15 +396,523 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# --- Limitador de tasa y concurrencia adaptativa por familia de endpoints ---
+FAMILIAS_ENDPOINTS_IOL = [
+    ('series', re.compile(r'/seriehistorica/', re.IGNORECASE)),
+    ('cotizaciones', re.compile(r'/cotizacion', re.IGNORECASE)),
+    ('operaciones', re.compile(r'/operaciones', re.IGNORECASE)),
+    ('portafolio', re.compile(r'/(portafolio|estadocuenta)', re.IGNORECASE)),
+]
+
+# familia: (requests por segundo, ráfaga, concurrencia inicial, concurrencia máxima)
+LIMITES_IOL = {
+    'series': (8.0, 16, 4, 16),
+    'cotizaciones': (10.0, 20, 4, 16),
+    'portafolio': (4.0, 8, 2, 6),
+    'operaciones': (2.0, 4, 1, 4),
+    'general': (5.0, 10, 2, 8),
+}
+
+def familia_endpoint(url):
+    """Clasifica una URL de la API de IOL en su familia de endpoints"""
+    for familia, patron in FAMILIAS_ENDPOINTS_IOL:
+        if patron.search(url):
+            return familia
+    return 'general'
+
+class LimitadorEndpoint:
+    """
+    Limitador de una familia de endpoints: token bucket para la tasa de requests y
+    ventana de concurrencia AIMD (aumento aditivo mientras las respuestas son sanas,
+    reducción multiplicativa ante 429/5xx, errores de conexión o latencia en aumento).
+    """
+    VENTANA_REDUCCION = 1.0  # Como máximo una reducción por segundo
+
+    def __init__(self, tasa, rafaga, concurrencia_inicial, concurrencia_maxima):
+        self.tasa = tasa
+        self.rafaga = rafaga
+        self.fichas = float(rafaga)
+        self.ultima_recarga = time.monotonic()
+        self.limite = float(concurrencia_inicial)
+        self.maximo = concurrencia_maxima
+        self.en_vuelo = 0
+        self.pausa_hasta = 0.0
+        self.latencia_rapida = None  # EWMA de reacción rápida
+        self.latencia_lenta = None   # EWMA de referencia
+        self.ultima_reduccion = 0.0
+        self._condicion = threading.Condition()
+
+    def adquirir(self):
+        """Bloquea hasta que haya lugar en la ventana de concurrencia y una ficha disponible"""
+        with self._condicion:
+            while self.en_vuelo >= int(self.limite):
+                self._condicion.wait()
+            self.en_vuelo += 1
+        while True:
+            with self._condicion:
+                ahora = time.monotonic()
+                if ahora < self.pausa_hasta:
+                    espera = self.pausa_hasta - ahora
+                else:
+                    self.fichas = min(self.rafaga, self.fichas + (ahora - self.ultima_recarga) * self.tasa)
+                    self.ultima_recarga = ahora
+                    if self.fichas >= 1:
+                        self.fichas -= 1
+                        return
+                    espera = (1 - self.fichas) / self.tasa
+            time.sleep(espera)
+
+    def liberar(self, latencia, estado, retry_after=None):
+        """
+        Libera el lugar ocupado y ajusta la ventana según el resultado del request.
+
+        Args:
+            latencia (float): Duración del request en segundos
+            estado (int): Código HTTP, o None si hubo error de conexión
+            retry_after (float, optional): Pausa pedida por el servidor
+        """
+        with self._condicion:
+            self.en_vuelo -= 1
+            ahora = time.monotonic()
+            congestion = estado is None or estado == 429 or estado >= 500
+            if estado is not None and estado < 500:
+                if self.latencia_rapida is None:
+                    self.latencia_rapida = self.latencia_lenta = latencia
+                else:
+                    self.latencia_rapida += 0.3 * (latencia - self.latencia_rapida)
+                    self.latencia_lenta += 0.05 * (latencia - self.latencia_lenta)
+                if self.latencia_rapida > 2 * self.latencia_lenta:
+                    congestion = True
+            if retry_after:
+                self.pausa_hasta = max(self.pausa_hasta, ahora + retry_after)
+            if congestion:
+                if ahora - self.ultima_reduccion >= self.VENTANA_REDUCCION:
+                    self.limite = max(1.0, self.limite / 2)
+                    self.ultima_reduccion = ahora
+            else:
+                self.limite = min(float(self.maximo), self.limite + 1 / self.limite)
+            self._condicion.notify_all()
+
+# --- Coalescencia de llamadas idénticas en curso ---
+class SolicitudesEnCurso:
+    """
+    Coalescencia "single-flight": la primera llamada con una clave ejecuta la función
+    y las llamadas idénticas que llegan mientras está en curso esperan su futuro y
+    comparten el resultado (o la excepción) en lugar de repetir el request.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._en_curso = {}
+
+    def ejecutar(self, clave, funcion, *args, **kwargs):
+        with self._lock:
+            futuro = self._en_curso.get(clave)
+            propietario = futuro is None
+            if propietario:
+                futuro = concurrent.futures.Future()
+                self._en_curso[clave] = futuro
+        if not propietario:
+            return futuro.result()
+        try:
+            resultado = funcion(*args, **kwargs)
+        except BaseException as e:
+            futuro.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._en_curso.pop(clave, None)
+        futuro.set_result(resultado)
+        return resultado
+
+# --- Cliente HTTP compartido para la API de IOL ---
+IOL_BASE_URL = 'https://api.invertironline.com'
+MAX_REINTENTOS_SATURACION = 3  # Reintentos ante 429/503
+# Sólo se reintentan solos los métodos idempotentes: repetir un POST (p. ej. una orden)
+# tras un 503 que llegó después de aceptarlo duplicaría la operación
+METODOS_REINTENTABLES = ('GET', 'HEAD')
+
+class ClienteIOL:
+    """
+    Cliente HTTP de proceso para la API de IOL.
+
+    Mantiene una única requests.Session con pool de conexiones keep-alive, de modo
+    que las llamadas sucesivas reutilizan la conexión TCP+TLS con api.invertironline.com
+    en lugar de negociar un handshake nuevo por cada request.
+    """
+    def __init__(self, pool_maxsize=16, timeout=(5, 30)):
+        self.timeout = timeout  # (conexión, lectura) por defecto
+        self.session = requests.Session()
+        # La API es stateless (Bearer token): no persistir cookies entre hilos
+        self.session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=2,
+            pool_maxsize=pool_maxsize,
+            pool_block=True,  # Acota las conexiones simultáneas al tamaño del pool
+            max_retries=Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.3)
+        )
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+            'Accept': 'application/json'
+        })
+        # Token de acceso vigente (o reemplazado y todavía no vencido) -> GestorTokens que lo emitió
+        self.gestores_tokens = {}
+        # Token reemplazado por un refresco -> instante en que vence
+        self.tokens_reemplazados = {}
+        self.limitadores = {familia: LimitadorEndpoint(*limites) for familia, limites in LIMITES_IOL.items()}
+        self.en_curso = SolicitudesEnCurso()
+        # (usuario, id_cliente) -> (endpoint de portafolio EEUU que funcionó, instante)
+        self.rutas_portafolio_eeuu = {}
+
+    @contextlib.contextmanager
+    def permiso(self, url):
+        """
+        Reserva un lugar en el limitador de la familia de `url` durante un request.
+        El llamador informa el código HTTP en permiso['estado'].
+        """
+        limitador = self.limitadores[familia_endpoint(url)]
+        limitador.adquirir()
+        registro = {'estado': None, 'retry_after': None}
+        inicio = time.monotonic()
+        try:
+            yield registro
+        finally:
+            limitador.liberar(time.monotonic() - inicio, registro['estado'], registro['retry_after'])
+
+    def _enviar(self, metodo, url, timeout, **kwargs):
+        """
+        Envía el request a través del limitador. Los GET/HEAD se reintentan si la API
+        está saturada; el resto devuelve el 429/503 al llamador (el limitador igual frena).
+        """
+        reintentos = MAX_REINTENTOS_SATURACION if metodo.upper() in METODOS_REINTENTABLES else 0
+        for intento in range(reintentos + 1):
+            with self.permiso(url) as registro:
+                respuesta = self.session.request(metodo, url, timeout=timeout or self.timeout, **kwargs)
+                registro['estado'] = respuesta.status_code
+                if respuesta.status_code in (429, 503):
+                    registro['retry_after'] = segundos_retry_after(respuesta)
+            if respuesta.status_code not in (429, 503) or intento == reintentos:
+                return respuesta
+            time.sleep(registro['retry_after'] or (0.5 * 2 ** intento + random.uniform(0, 0.25)))
+        return respuesta
+
+    def registrar_token(self, token_acceso, gestor, reemplazado=None, vence_reemplazado=None):
+        """
+        Asocia un token de acceso con el gestor capaz de refrescarlo. El token que éste
+        reemplaza sigue asociado hasta su propio vencimiento, para que quien todavía lo
+        tenga (descargas en curso, hilos de precarga, caches) pueda refrescar ante un 401.
+        """
+        ahora = time.time()
+        for token, vence in list(self.tokens_reemplazados.items()):
+            if vence <= ahora:
+                self.olvidar_token(token)
+        self.gestores_tokens[token_acceso] = gestor
+        if reemplazado is not None and reemplazado != token_acceso:
+            if vence_reemplazado is not None and vence_reemplazado > ahora:
+                self.tokens_reemplazados[reemplazado] = vence_reemplazado
+            else:
+                self.olvidar_token(reemplazado)
+
+    def olvidar_token(self, token_acceso):
+        """Quita un token del registro (reemplazado o sesión cerrada)"""
+        self.gestores_tokens.pop(token_acceso, None)
+        self.tokens_reemplazados.pop(token_acceso, None)
+
+    def olvidar_gestor(self, gestor):
+        """Quita del registro todos los tokens emitidos por un gestor (cierre de sesión)"""
+        for token, emisor in list(self.gestores_tokens.items()):
+            if emisor is gestor:
+                self.olvidar_token(token)
+
+    def usuario_de_token(self, token_acceso):
+        """Devuelve el usuario de la sesión que emitió el token, o None si no se conoce"""
+        gestor = self.gestores_tokens.get(token_acceso)
+        return getattr(gestor, 'usuario', None)
+
+    def request(self, metodo, url, timeout=None, **kwargs):
+        """
+        Ejecuta un request usando el pool compartido y el timeout por defecto.
+        Los GET idénticos (misma URL, parámetros y encabezados) simultáneos se
+        coalescen en un único request cuya respuesta comparten.
+        """
+        if metodo.upper() != 'GET':
+            return self._request_autenticado(metodo, url, timeout, **kwargs)
+        clave = (
+            url,
+            repr(sorted((kwargs.get('params') or {}).items())),
+            tuple(sorted((kwargs.get('headers') or {}).items())),
+        )
+        return self.en_curso.ejecutar(clave, self._request_autenticado, metodo, url, timeout, **kwargs)
+
+    def _request_autenticado(self, metodo, url, timeout=None, **kwargs):
+        """
+        Si la API responde 401 a un token emitido por un GestorTokens, se refresca
+        el token y se reintenta el request una única vez.
+        """
+        respuesta = self._enviar(metodo, url, timeout, **kwargs)
+        if respuesta.status_code == 401:
+            headers = kwargs.get('headers') or {}
+            autorizacion = headers.get('Authorization', '')
+            token = autorizacion[len('Bearer '):] if autorizacion.startswith('Bearer ') else None
+            gestor = self.gestores_tokens.get(token) if token else None
+            if gestor is not None:
+                nuevo_token = gestor.refrescar(token_rechazado=token)
+                if nuevo_token and nuevo_token != token:
+                    kwargs['headers'] = {**headers, 'Authorization': f'Bearer {nuevo_token}'}
+                    respuesta = self._enviar(metodo, url, timeout, **kwargs)
+        return respuesta
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+def segundos_retry_after(respuesta, maximo=30):
+    """Lee el encabezado Retry-After (en segundos) de una respuesta, acotado a `maximo`"""
+    try:
+        return min(float(respuesta.headers.get('Retry-After')), maximo)
+    except (TypeError, ValueError):
+        return None
+
+@st.cache_resource
+def obtener_cliente_iol():
+    """
+    Devuelve el ClienteIOL único del proceso (compartido entre sesiones y reruns)
+    """
+    return ClienteIOL()
+
+# --- Motor de descargas concurrentes ---
+# Tope de hilos; la concurrencia real contra IOL la regula el limitador del cliente
+MAX_DESCARGAS_SIMULTANEAS = 16
+
+def descargar_en_paralelo(funcion, elementos, max_en_vuelo=MAX_DESCARGAS_SIMULTANEAS, al_completar=None):
+    """
+    Ejecuta funcion(elemento) para cada elemento con concurrencia acotada.
+
+    Los hilos trabajadores heredan el contexto de Streamlit de la sesión que los lanza,
+    por lo que pueden usar st.cache_data y mostrar mensajes. El callback al_completar
+    se invoca desde el hilo principal a medida que termina cada elemento.
+
+    Args:
+        funcion (callable): Función a ejecutar por elemento
+        elementos (list): Elementos a procesar (deben ser hashables)
+        max_en_vuelo (int): Máximo de ejecuciones simultáneas
+        al_completar (callable, optional): al_completar(elemento, resultado, completados, total)
+
+    Returns:
+        dict: elemento -> resultado (None si la función lanzó una excepción)
+    """
+    elementos = list(dict.fromkeys(elementos))
+    resultados = {}
+    if not elementos:
+        return resultados
+
+    ctx = get_script_run_ctx()
+
+    def _ejecutar(elemento):
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        return funcion(elemento)
+
+    max_workers = max(1, min(max_en_vuelo, len(elementos)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='iol-fetch') as executor:
+        futuros = {executor.submit(_ejecutar, elemento): elemento for elemento in elementos}
+        for completados, futuro in enumerate(concurrent.futures.as_completed(futuros), start=1):
+            elemento = futuros[futuro]
+            try:
+                resultados[elemento] = futuro.result()
+            except Exception as e:
+                print(f"Error en descarga concurrente de {elemento}: {str(e)}")
+                resultados[elemento] = None
+            if al_completar is not None:
+                al_completar(elemento, resultados[elemento], completados, len(elementos))
+    return resultados
+
+def ejecutar_concurrentemente(tareas, timeout=None):
+    """
+    Ejecuta a la vez llamadas independientes con un presupuesto de tiempo total.
+
+    Las llamadas heredan el contexto de Streamlit de la sesión que las lanza. Las que
+    fallan o no terminan dentro del presupuesto devuelven None, sin afectar al resto.
+
+    Args:
+        tareas (dict): nombre -> callable sin argumentos
+        timeout (float, optional): Segundos máximos para el conjunto de llamadas
+
+    Returns:
+        tuple: (dict nombre -> resultado, set de nombres que no terminaron a tiempo)
+    """
+    resultados = {nombre: None for nombre in tareas}
+    if not tareas:
+        return resultados, set()
+
+    ctx = get_script_run_ctx()
+
+    def _ejecutar(funcion):
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        return funcion()
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(tareas), thread_name_prefix='iol-carga')
+    try:
+        futuros = {executor.submit(_ejecutar, funcion): nombre for nombre, funcion in tareas.items()}
+        terminados, pendientes = concurrent.futures.wait(futuros, timeout=timeout)
+        for futuro in terminados:
+            nombre = futuros[futuro]
+            try:
+                resultados[nombre] = futuro.result()
+            except Exception as e:
+                print(f"Error en carga concurrente de {nombre}: {str(e)}")
+        vencidos = {futuros[futuro] for futuro in pendientes}
+        for nombre in vencidos:
+            print(f"Carga de {nombre} excedió el presupuesto de {timeout}s")
+    finally:
+        # No esperar a las llamadas vencidas: terminan en segundo plano
+        executor.shutdown(wait=False, cancel_futures=True)
+    return resultados, vencidos
+
+# Tiempo máximo para la carga inicial de los datos de un cliente
+PRESUPUESTO_CARGA_CLIENTE = 45
+
 def obtener_encabezado_autorizacion(token_portador):
     return {
         'Authorization': f'Bearer {token_portador}',
         'Content-Type': 'application/json'
     }
 
+# --- Gestión de tokens con vencimiento ---
+MARGEN_REFRESCO_TOKEN = 90  # Refrescar 90 segundos antes del vencimiento
+DURACION_TOKEN_POR_DEFECTO = 900  # IOL emite tokens de 15 minutos
+
+class GestorTokens:
+    """
+    Mantiene el par de tokens de una sesión junto con su vencimiento.
+
+    El vencimiento se toma de `expires_in` en la respuesta de /token, por lo que no
+    hace falta ninguna llamada a la API para saber si el token sigue siendo válido.
+    Mientras la sesión esté activa, un timer en segundo plano refresca el token poco
+    antes de que venza; si la sesión queda inactiva el timer se detiene y el token se
+    refresca de forma sincrónica en el próximo uso.
+    """
+    def __init__(self, respuesta_token, emitido=None, usuario=None):
+        self.usuario = usuario  # Usuario que inició la sesión (identidad del token)
+        self._lock = threading.Lock()
+        self._timer = None
+        self._usado = True
+        self.valido = True
+        self._actualizar(respuesta_token, emitido or time.time())
+
+    def _actualizar(self, respuesta_token, emitido):
+        reemplazado = getattr(self, 'token_acceso', None)
+        vence_reemplazado = getattr(self, 'expira', None)
+        self.token_acceso = respuesta_token['access_token']
+        self.refresh_token = respuesta_token['refresh_token']
+        try:
+            duracion = float(respuesta_token.get('expires_in') or DURACION_TOKEN_POR_DEFECTO)
+        except (TypeError, ValueError):
+            duracion = DURACION_TOKEN_POR_DEFECTO
+        self.expira = emitido + duracion
+        obtener_cliente_iol().registrar_token(
+            self.token_acceso, self, reemplazado=reemplazado, vence_reemplazado=vence_reemplazado
+        )
+        self._programar_refresco(self.expira - MARGEN_REFRESCO_TOKEN - time.time())
+
+    def _programar_refresco(self, demora):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(max(demora, 5), self._refresco_programado)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _refresco_programado(self):
+        if not self.valido:
+            return
+        if not self._usado:
+            # Sesión inactiva: no mantener el token vivo indefinidamente
+            self._timer = None
+            return
+        self.refrescar()
+
+    def refrescar(self, token_rechazado=None):
+        """
+        Refresca el token de acceso con el refresh token.
+
+        Args:
+            token_rechazado (str, optional): Token que recibió un 401. Si ya fue
+                reemplazado por otro hilo, se devuelve el vigente sin volver a refrescar.
+
+        Returns:
+            str: Token de acceso vigente, o None si la sesión ya no puede renovarse
+        """
+        with self._lock:
+            if not self.valido:
+                return None
+            if token_rechazado is not None and token_rechazado != self.token_acceso:
+                return self.token_acceso
+
+            datos_refresh = {
+                'grant_type': 'refresh_token',
+                'refresh_token': self.refresh_token
+            }
+            headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+            emitido = time.time()
+            try:
+                respuesta = obtener_cliente_iol().post(
+                    'https://api.invertironline.com/token', data=datos_refresh, headers=headers, timeout=30
+                )
+            except requests.exceptions.RequestException as e:
+                print(f"Error de conexión al refrescar token: {e}")
+                self._programar_refresco(30)
+                return self.token_acceso
+
+            if respuesta.status_code == 200:
+                try:
+                    respuesta_json = respuesta.json()
+                    if 'access_token' in respuesta_json and 'refresh_token' in respuesta_json:
+                        self._usado = False
+                        self._actualizar(respuesta_json, emitido)
+                        return self.token_acceso
+                except ValueError:
+                    pass
+                print("Respuesta de refresh inválida")
+                self._programar_refresco(30)
+                return self.token_acceso
+            if respuesta.status_code in (400, 401):
+                # Refresh token vencido o revocado: hay que volver a iniciar sesión
+                print(f"Refresh token rechazado: {respuesta.status_code}")
+                self.valido = False
+                return None
+            print(f"Error HTTP {respuesta.status_code} al refrescar token")
+            self._programar_refresco(30)
+            return self.token_acceso
+
+    def token_vigente(self):
+        """
+        Devuelve el token de acceso vigente sin consultar la API, refrescándolo
+        sólo si ya venció (por ejemplo, tras un período de inactividad).
+        """
+        self._usado = True
+        if self.valido and time.time() >= self.expira - MARGEN_REFRESCO_TOKEN / 3:
+            return self.refrescar(token_rechazado=self.token_acceso)
+        if self.valido and self._timer is None:
+            self._programar_refresco(self.expira - MARGEN_REFRESCO_TOKEN - time.time())
+        return self.token_acceso if self.valido else None
+
+    def cerrar(self):
+        """Detiene el refresco en segundo plano y quita el token del registro (cierre de sesión)"""
+        self.valido = False
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        obtener_cliente_iol().olvidar_gestor(self)
+
 def obtener_tokens(usuario, contraseña):
     """
     Obtiene tokens de autenticación de IOL con manejo mejorado de errores y reintentos
+
+    Returns:
+        GestorTokens: Gestor de la sesión autenticada, o None si falló la autenticación
     """
     url_login = 'https://api.invertironline.com/token'
     datos = {
@@ -407,13 +921,8 @@ def obtener_tokens(usuario, contraseña):
         'grant_type': 'password'
     }
     
-    # Configuración de sesión con reintentos
-    session = requests.Session()
-    session.mount('https://', requests.adapters.HTTPAdapter(
-        max_retries=3,
-        pool_connections=10,
-        pool_maxsize=10
-    ))
+    # Sesión compartida con pool de conexiones y reintentos de conexión
+    session = obtener_cliente_iol()
     
     # Headers adicionales para mejorar la conexión
     headers = {
@@ -430,6 +939,7 @@ def obtener_tokens(usuario, contraseña):
             # Timeout más largo para la primera conexión
             timeout = 30 if attempt == 0 else 15
             
+            emitido = time.time()
             respuesta = session.post(
                 url_login, 
                 data=datos, 
@@ -444,24 +954,24 @@ def obtener_tokens(usuario, contraseña):
                     respuesta_json = respuesta.json()
                     if 'access_token' in respuesta_json and 'refresh_token' in respuesta_json:
                         st.success("✅ Autenticación exitosa con IOL")
-                        return respuesta_json['access_token'], respuesta_json['refresh_token']
+                        return GestorTokens(respuesta_json, emitido, usuario=usuario.strip().lower())
                     else:
                         st.error("❌ Respuesta de IOL incompleta - faltan tokens")
-                        return None, None
+                        return None
                 except ValueError as json_err:
                     st.error(f"❌ Error al procesar respuesta JSON: {json_err}")
-                    return None, None
+                    return None
             
             # Manejar códigos de error específicos
             elif respuesta.status_code == 400:
                 st.error("❌ Error 400: Verifique sus credenciales (usuario/contraseña)")
-                return None, None
+                return None
             elif respuesta.status_code == 401:
                 st.error("❌ Error 401: Credenciales inválidas o cuenta bloqueada")
-                return None, None
+                return None
             elif respuesta.status_code == 403:
                 st.error("❌ Error 403: Acceso denegado - verifique permisos de su cuenta")
-                return None, None
+                return None
             elif respuesta.status_code == 429:
                 st.warning("⚠️ Demasiadas solicitudes. Esperando antes de reintentar...")
                 if attempt < max_attempts - 1:
@@ -469,7 +979,7 @@ def obtener_tokens(usuario, contraseña):
                     continue
                 else:
                     st.error("❌ Límite de solicitudes excedido")
-                    return None, None
+                    return None
             elif respuesta.status_code >= 500:
                 st.warning(f"⚠️ Error del servidor ({respuesta.status_code}). Reintentando...")
                 if attempt < max_attempts - 1:
@@ -477,10 +987,10 @@ def obtener_tokens(usuario, contraseña):
                     continue
                 else:
                     st.error(f"❌ Error persistente del servidor: {respuesta.status_code}")
-                    return None, None
+                    return None
             else:
                 st.error(f"❌ Error HTTP {respuesta.status_code}: {respuesta.text[:200]}")
-                return None, None
+                return None
                 
         except requests.exceptions.Timeout:
             st.warning(f"⏱️ Timeout en intento {attempt + 1}. Reintentando...")
@@ -493,7 +1003,7 @@ def obtener_tokens(usuario, contraseña):
                 st.info("• Verifique su conexión a internet")
                 st.info("• Intente nuevamente en unos minutos")
                 st.info("• Contacte a IOL si el problema persiste")
-                return None, None
+                return None
                 
         except requests.exceptions.ConnectionError:
             st.warning(f"🔌 Error de conexión en intento {attempt + 1}. Reintentando...")
@@ -506,12 +1016,12 @@ def obtener_tokens(usuario, contraseña):
                 st.info("• Su conexión a internet")
                 st.info("• Que no haya firewall bloqueando la conexión")
                 st.info("• Que el servidor de IOL esté disponible")
-                return None, None
+                return None
                 
         except requests.exceptions.SSLError:
             st.error("❌ Error de certificado SSL")
             st.info("💡 Esto puede indicar problemas de seguridad de red")
-            return None, None
+            return None
             
         except Exception as e:
             st.error(f"❌ Error inesperado: {str(e)}")
@@ -520,78 +1030,10 @@ def obtener_tokens(usuario, contraseña):
                 time.sleep(2 ** attempt)
                 continue
             else:
-                return None, None
+                return None
     
     st.error("❌ No se pudo establecer conexión después de múltiples intentos")
-    return None, None
-
-def refrescar_token(refresh_token):
-    """
-    Refresca el token de acceso usando el refresh token
-    """
-    url_refresh = 'https://api.invertironline.com/token'
-    datos_refresh = {
-        'grant_type': 'refresh_token',
-        'refresh_token': refresh_token
-    }
-    
-    headers = {
-        'Content-Type': 'application/x-www-form-urlencoded',
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-    }
-    
-    try:
-        respuesta = requests.post(url_refresh, data=datos_refresh, headers=headers, timeout=30)
-        
-        if respuesta.status_code == 200:
-            respuesta_json = respuesta.json()
-            if 'access_token' in respuesta_json and 'refresh_token' in respuesta_json:
-                st.success("✅ Token refrescado exitosamente")
-                return respuesta_json['access_token'], respuesta_json['refresh_token']
-            else:
-                st.error("❌ Respuesta de refresh inválida")
-                return None, None
-        elif respuesta.status_code == 400:
-            st.error("❌ Error 400: Refresh token inválido")
-            return None, None
-        elif respuesta.status_code == 401:
-            st.error("❌ Error 401: Refresh token expirado")
-            return None, None
-        else:
-            st.error(f"❌ Error HTTP {respuesta.status_code}: {respuesta.text[:200]}")
-            return None, None
-            
-    except Exception as e:
-        st.error(f"❌ Error al refrescar token: {str(e)}")
-        return None, None
-
-def verificar_y_refrescar_token(token_acceso, refresh_token):
-    """
-    Verifica si el token está válido y lo refresca si es necesario
-    """
-    if not token_acceso or not refresh_token:
-        return None, None
-    
-    # Probar el token con una llamada simple
-    url_test = 'https://api.invertironline.com/api/v2/estadocuenta'
-    headers = obtener_encabezado_autorizacion(token_acceso)
-    
-    try:
-        respuesta = requests.get(url_test, headers=headers, timeout=10)
-        if respuesta.status_code == 200:
-            return token_acceso, refresh_token  # Token válido
-        elif respuesta.status_code == 401:
-            st.warning("⚠️ Token expirado, intentando refrescar...")
-            nuevo_token, nuevo_refresh = refrescar_token(refresh_token)
-            if nuevo_token:
-                return nuevo_token, nuevo_refresh
-            else:
-                st.error("❌ No se pudo refrescar el token")
-                return None, None
-        else:
-            return token_acceso, refresh_token  # Otro error, mantener token actual
-    except Exception:
-        return token_acceso, refresh_token  # Error de conexión, mantener token actual
+    return None
 
 def obtener_lista_clientes(token_portador):
     """
@@ -606,7 +1048,7 @@ def obtener_lista_clientes(token_portador):
     url_clientes = 'https://api.invertironline.com/api/v2/Asesores/Clientes'
     encabezados = obtener_encabezado_autorizacion(token_portador)
     try:
-        respuesta = requests.get(url_clientes, headers=encabezados, timeout=30)
+        respuesta = obtener_cliente_iol().get(url_clientes, headers=encabezados, timeout=30)
         if respuesta.status_code == 200:
             clientes_data = respuesta.json()
             if isinstance(clientes_data, list):
@@ -632,6 +1074,25 @@ def obtener_lista_clientes(token_portador):
         st.error(f'Error de conexión al obtener clientes: {str(e)}')
         return []
 
+@st.cache_data(ttl=60)  # Cache por 1 minuto: instantánea compartida por las vistas general y EEUU
+def obtener_estado_cuenta_crudo(token_portador, id_cliente=None):
+    """
+    Descarga el estado de cuenta completo del cliente (o del usuario autenticado).
+    Es la instantánea de la que se derivan tanto la vista general como la de EEUU.
+    
+    Raises:
+        requests.HTTPError: Si la API responde con error (los errores no se cachean)
+    """
+    if id_cliente:
+        url_estado_cuenta = f'https://api.invertironline.com/api/v2/Asesores/EstadoDeCuenta/{id_cliente}'
+    else:
+        url_estado_cuenta = 'https://api.invertironline.com/api/v2/estadocuenta'
+    
+    encabezados = obtener_encabezado_autorizacion(token_portador)
+    respuesta = obtener_cliente_iol().get(url_estado_cuenta, headers=encabezados, timeout=30)
+    respuesta.raise_for_status()
+    return respuesta.json()
+
 def obtener_estado_cuenta(token_portador, id_cliente=None):
     """
     Obtiene el estado de cuenta del cliente o del usuario autenticado
@@ -655,19 +1116,13 @@ def obtener_estado_cuenta(token_portador, id_cliente=None):
         obtener_estado_cuenta._recursion_depth = 0
         return None
     
-    if id_cliente:
-        url_estado_cuenta = f'https://api.invertironline.com/api/v2/Asesores/EstadoDeCuenta/{id_cliente}'
-    else:
-        url_estado_cuenta = 'https://api.invertironline.com/api/v2/estadocuenta'
-    
-    encabezados = obtener_encabezado_autorizacion(token_portador)
     try:
-        respuesta = requests.get(url_estado_cuenta, headers=encabezados, timeout=30)
-        if respuesta.status_code == 200:
-            # Resetear contador de recursión en caso de éxito
-            obtener_estado_cuenta._recursion_depth = 0
-            return respuesta.json()
-        elif respuesta.status_code == 401:
+        estado_cuenta = obtener_estado_cuenta_crudo(token_portador, id_cliente)
+        # Resetear contador de recursión en caso de éxito
+        obtener_estado_cuenta._recursion_depth = 0
+        return estado_cuenta
+    except requests.HTTPError as e:
+        if e.response.status_code == 401:
             # Solo intentar una vez más sin ID de cliente
             if obtener_estado_cuenta._recursion_depth == 1:
                 st.warning("Error de autenticación. Intentando obtener estado de cuenta general...")
@@ -677,7 +1132,7 @@ def obtener_estado_cuenta(token_portador, id_cliente=None):
                 obtener_estado_cuenta._recursion_depth = 0
                 return None
         else:
-            st.error(f"Error HTTP {respuesta.status_code} al obtener estado de cuenta")
+            st.error(f"Error HTTP {e.response.status_code} al obtener estado de cuenta")
             obtener_estado_cuenta._recursion_depth = 0
             return None
     except requests.exceptions.Timeout:
@@ -690,6 +1145,20 @@ def obtener_estado_cuenta(token_portador, id_cliente=None):
         return None
 
 @st.cache_data(ttl=900)  # Cache por 15 minutos para mejor rendimiento
+def obtener_portafolio_crudo(token_portador, id_cliente, pais='Argentina'):
+    """
+    Descarga el portafolio de un cliente desde el endpoint de Asesores, sin mensajes.
+    Lo comparten la vista de un cliente y la carga de la cartera completa del asesor.
+    
+    Raises:
+        requests.HTTPError: Si la API responde con error (los errores no se cachean)
+    """
+    url_portafolio = f'https://api.invertironline.com/api/v2/Asesores/Portafolio/{id_cliente}/{pais}'
+    encabezados = obtener_encabezado_autorizacion(token_portador)
+    respuesta = obtener_cliente_iol().get(url_portafolio, headers=encabezados, timeout=15)  # Reducido de 30 a 15 segundos
+    respuesta.raise_for_status()
+    return respuesta.json()
+
 def obtener_portafolio(token_portador, id_cliente, pais='Argentina'):
     """
     Obtiene el portafolio de un cliente específico
@@ -702,32 +1171,27 @@ def obtener_portafolio(token_portador, id_cliente, pais='Argentina'):
     Returns:
         dict: Portafolio del cliente o None en caso de error
     """
-    url_portafolio = f'https://api.invertironline.com/api/v2/Asesores/Portafolio/{id_cliente}/{pais}'
-    encabezados = obtener_encabezado_autorizacion(token_portador)
     try:
-        respuesta = requests.get(url_portafolio, headers=encabezados, timeout=15)  # Reducido de 30 a 15 segundos
-        if respuesta.status_code == 200:
-            portafolio = respuesta.json()
-            
-            # Validar que el portafolio corresponde al cliente correcto
-            if portafolio and id_cliente:
-                # Verificar que el portafolio tiene el cliente correcto
-                portafolio_cliente = portafolio.get('numeroCliente', portafolio.get('id', portafolio.get('cliente')))
-                if portafolio_cliente and str(portafolio_cliente) != str(id_cliente):
-                    st.warning(f"⚠️ Portafolio obtenido para cliente {portafolio_cliente}, pero se solicitó {id_cliente}")
-                else:
-                    st.info(f"✅ Portafolio validado para cliente {id_cliente}")
-            
-            return portafolio
-        elif respuesta.status_code == 401:
+        portafolio = obtener_portafolio_crudo(token_portador, id_cliente, pais)
+        
+        # Validar que el portafolio corresponde al cliente correcto
+        if portafolio and id_cliente:
+            # Verificar que el portafolio tiene el cliente correcto
+            portafolio_cliente = portafolio.get('numeroCliente', portafolio.get('id', portafolio.get('cliente')))
+            if portafolio_cliente and str(portafolio_cliente) != str(id_cliente):
+                st.warning(f"⚠️ Portafolio obtenido para cliente {portafolio_cliente}, pero se solicitó {id_cliente}")
+            else:
+                st.info(f"✅ Portafolio validado para cliente {id_cliente}")
+        
+        return portafolio
+    except requests.HTTPError as e:
+        if e.response.status_code == 401:
             st.error("Error de autenticación al obtener portafolio")
-            return None
-        elif respuesta.status_code == 404:
+        elif e.response.status_code == 404:
             st.warning(f"No se encontró portafolio para el cliente {id_cliente}")
-            return None
         else:
-            st.error(f"Error HTTP {respuesta.status_code} al obtener portafolio")
-            return None
+            st.error(f"Error HTTP {e.response.status_code} al obtener portafolio")
+        return None
     except requests.exceptions.Timeout:
         st.error("Timeout al obtener portafolio")
         return None
@@ -735,6 +1199,9 @@ def obtener_portafolio(token_portador, id_cliente, pais='Argentina'):
         st.error(f'Error al obtener portafolio: {str(e)}')
         return None
 
+# Segundos durante los cuales se reutiliza el endpoint de portafolio EEUU que funcionó
+TTL_RUTA_PORTAFOLIO_EEUU = 600
+
 @st.cache_data(ttl=900)  # Cache por 15 minutos para mejor rendimiento
 def obtener_portafolio_eeuu(token_portador, id_cliente):
     """
@@ -752,48 +1219,69 @@ def obtener_portafolio_eeuu(token_portador, id_cliente):
     encabezados = obtener_encabezado_autorizacion(token_portador)
     
     
+    # Endpoint que ya funcionó para esta cuenta y este usuario (evita redescubrir el 404
+    # en cada carga); vence a los TTL_RUTA_PORTAFOLIO_EEUU segundos para volver a probar Asesores
+    cliente = obtener_cliente_iol()
+    rutas = cliente.rutas_portafolio_eeuu
+    usuario = cliente.usuario_de_token(token_portador)
+    clave_ruta = (usuario, str(id_cliente))
+    ruta, instante = rutas.get(clave_ruta, (None, float('-inf')))
+    if usuario is None or time.monotonic() - instante > TTL_RUTA_PORTAFOLIO_EEUU:
+        ruta = None
+    
+    def recordar_ruta(ruta):
+        if usuario is None:
+            return
+        ahora = time.monotonic()
+        for clave, (_, visto) in list(rutas.items()):
+            if ahora - visto > TTL_RUTA_PORTAFOLIO_EEUU:
+                rutas.pop(clave, None)
+        rutas[clave_ruta] = (ruta, ahora)
+    
     try:
-        # Primer intento: endpoint de Asesores
-        respuesta = requests.get(url_portafolio_asesores, headers=encabezados, timeout=30)
-        
-        if respuesta.status_code == 200:
-            data = respuesta.json()
-            return data
-        elif respuesta.status_code == 404:
-            st.info("ℹ️ No se encontró portafolio EEUU vía Asesores, intentando endpoint directo...")
-            
-            # Segundo intento: endpoint directo
-            url_portafolio_directo = f'https://api.invertironline.com/api/v2/portafolio/estados_Unidos'
-            respuesta_directo = requests.get(url_portafolio_directo, headers=encabezados, timeout=30)
+        if ruta != 'directo':
+            # Primer intento: endpoint de Asesores
+            respuesta = cliente.get(url_portafolio_asesores, headers=encabezados, timeout=30)
             
-            if respuesta_directo.status_code == 200:
-                data_directo = respuesta_directo.json()
-                st.success(f"✅ Portafolio EEUU obtenido vía endpoint directo: {len(data_directo.get('activos', []))} activos")
-                return data_directo
-            elif respuesta_directo.status_code == 401:
+            if respuesta.status_code == 200:
+                recordar_ruta('asesores')
+                data = respuesta.json()
+                return data
+            elif respuesta.status_code == 401:
                 st.error("❌ Error 401: Token de autenticación inválido o expirado")
                 st.info("💡 Intente refrescar el token o inicie sesión nuevamente")
                 return None
-            elif respuesta_directo.status_code == 403:
+            elif respuesta.status_code == 403:
                 st.error("❌ Error 403: Acceso denegado al portafolio de EEUU")
                 st.info("💡 Verifique que su cuenta tenga permisos para acceder a portafolios de EEUU")
                 return None
-            else:
-                st.error(f"❌ Error HTTP {respuesta_directo.status_code} en endpoint directo")
-                st.info(f"📄 Respuesta: {respuesta_directo.text[:500]}")
+            elif respuesta.status_code != 404:
+                st.error(f"❌ Error HTTP {respuesta.status_code} en endpoint de Asesores")
+                st.info(f"📄 Respuesta: {respuesta.text[:500]}")
                 return None
-                
-        elif respuesta.status_code == 401:
+            
+            st.info("ℹ️ No se encontró portafolio EEUU vía Asesores, intentando endpoint directo...")
+        
+        # Segundo intento (o ruta ya conocida): endpoint directo
+        url_portafolio_directo = f'https://api.invertironline.com/api/v2/portafolio/estados_Unidos'
+        respuesta_directo = cliente.get(url_portafolio_directo, headers=encabezados, timeout=30)
+        
+        if respuesta_directo.status_code == 200:
+            recordar_ruta('directo')
+            data_directo = respuesta_directo.json()
+            st.success(f"✅ Portafolio EEUU obtenido vía endpoint directo: {len(data_directo.get('activos', []))} activos")
+            return data_directo
+        elif respuesta_directo.status_code == 401:
             st.error("❌ Error 401: Token de autenticación inválido o expirado")
             st.info("💡 Intente refrescar el token o inicie sesión nuevamente")
             return None
-        elif respuesta.status_code == 403:
+        elif respuesta_directo.status_code == 403:
             st.error("❌ Error 403: Acceso denegado al portafolio de EEUU")
             st.info("💡 Verifique que su cuenta tenga permisos para acceder a portafolios de EEUU")
             return None
         else:
-            st.error(f"❌ Error HTTP {respuesta.status_code} en endpoint de Asesores")
-            st.info(f"📄 Respuesta: {respuesta.text[:500]}")
+            st.error(f"❌ Error HTTP {respuesta_directo.status_code} en endpoint directo")
+            st.info(f"📄 Respuesta: {respuesta_directo.text[:500]}")
             return None
             
     except requests.exceptions.Timeout:
@@ -806,477 +1294,344 @@ def obtener_portafolio_eeuu(token_portador, id_cliente):
         st.error(f'❌ Error inesperado al obtener portafolio de EEUU: {str(e)}')
         return None
 
-# --- FUNCIONES ASÍNCRONAS ---
-async def obtener_portafolio_async(token_portador, id_cliente, pais='Argentina'):
+def es_cuenta_eeuu(cuenta):
+    """Determina si una cuenta del estado de cuenta corresponde a EEUU (misma lógica que la vista consolidada)"""
+    numero = cuenta.get('numero', 'N/A')
+    descripcion = cuenta.get('descripcion', 'N/A')
+    moneda = cuenta.get('moneda', 'N/A')
+    return any([
+        'eeuu' in descripcion.lower(),
+        'estados unidos' in descripcion.lower(),
+        '-eeuu' in str(numero).lower(),
+        'dolar estadounidense' in moneda.lower(),
+        'dolar_estadounidense' in moneda.lower(),
+        'usd' in moneda.lower()
+    ])
+
+def obtener_estado_cuenta_eeuu(token_portador, id_cliente=None):
     """
-    Versión asíncrona para obtener el portafolio de un cliente específico
+    Obtiene el estado de cuenta de Estados Unidos
+    Filtra las cuentas que corresponden a EEUU del estado de cuenta general, derivándolo
+    de la misma instantánea que usa obtener_estado_cuenta (sin volver a descargarlo)
     
     Args:
         token_portador (str): Token de autenticación
-        id_cliente (str): ID del cliente
-        pais (str): País del portafolio (default: 'Argentina')
+        id_cliente (str, optional): ID del cliente. Si es None, usa el estado de cuenta del usuario
         
     Returns:
-        dict: Portafolio del cliente o None en caso de error
+        dict: Estado de cuenta filtrado solo para cuentas de EEUU o None en caso de error
     """
-    url_portafolio = f'https://api.invertironline.com/api/v2/Asesores/Portafolio/{id_cliente}/{pais}'
-    encabezados = obtener_encabezado_autorizacion(token_portador)
-    
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url_portafolio, headers=encabezados, timeout=aiohttp.ClientTimeout(total=15)) as response:
-                if response.status == 200:
-                    return await response.json()
-                elif response.status == 401:
-                    st.error("Error de autenticación al obtener portafolio")
-                    return None
-                else:
-                    st.error(f"Error HTTP {response.status} al obtener portafolio")
-                    return None
-    except asyncio.TimeoutError:
-        st.error("Timeout al obtener portafolio")
+        try:
+            data = obtener_estado_cuenta_crudo(token_portador, id_cliente)
+        except ValueError as e:
+            st.error(f"❌ Error al procesar JSON: {str(e)}")
+            return None
+        
+        # Filtrar solo las cuentas de EEUU usando la misma lógica que la vista consolidada
+        cuentas_eeuu = [cuenta for cuenta in data.get('cuentas', []) if es_cuenta_eeuu(cuenta)]
+        
+        # Crear respuesta filtrada solo para EEUU
+        data_eeuu = {
+            'cuentas': cuentas_eeuu,
+            'totalEnPesos': sum(cuenta.get('total', 0) for cuenta in cuentas_eeuu),
+            'filtrado': True,
+            'total_cuentas_eeuu': len(cuentas_eeuu)
+        }
+        
+        if cuentas_eeuu:
+            st.success(f"✅ Estado de cuenta EEUU filtrado: {len(cuentas_eeuu)} cuentas de EEUU")
+        else:
+            st.info("ℹ️ No se encontraron cuentas específicas de EEUU")
+        
+        return data_eeuu
+    except requests.HTTPError as e:
+        status_code = e.response.status_code
+        if status_code == 401:
+            st.error("❌ Error 401: Token de autenticación inválido o expirado")
+            st.info("💡 Intente refrescar el token o inicie sesión nuevamente")
+            return None
+        elif status_code == 403:
+            st.error("❌ Error 403: Acceso denegado al estado de cuenta")
+            return None
+        elif status_code == 404:
+            st.warning("⚠️ No se encontró estado de cuenta")
+            return None
+        else:
+            st.error(f"❌ Error HTTP {status_code} al obtener estado de cuenta")
+            return None
+    except requests.exceptions.Timeout:
+        st.error("⏱️ Timeout al obtener estado de cuenta")
+        return None
+    except requests.exceptions.ConnectionError:
+        st.error("🔌 Error de conexión al obtener estado de cuenta")
         return None
     except Exception as e:
-        st.error(f'Error al obtener portafolio: {str(e)}')
+        st.error(f'❌ Error inesperado al obtener estado de cuenta: {str(e)}')
         return None
 
-async def obtener_portafolio_eeuu_async(token_portador, id_cliente):
+# --- Cartera completa del asesor ---
+# Clientes cargados a la vez; la concurrencia real la regula el limitador de 'portafolio'
+MAX_CLIENTES_EN_VUELO = 8
+
+# Campos de valuación de un activo del portafolio, en orden de preferencia
+CAMPOS_VALUACION_ACTIVO = ('valorizado', 'valuacionEnMonedaOriginal', 'valuacionActual', 'valuacion')
+
+def valuacion_activo(activo):
+    """Valuación de un activo del portafolio; si la API no la informa, cantidad x último precio"""
+    for campo in CAMPOS_VALUACION_ACTIVO:
+        try:
+            valor = float(activo.get(campo) or 0)
+        except (TypeError, ValueError):
+            continue
+        if valor > 0:
+            return valor
+    try:
+        return float(activo.get('cantidad') or 0) * float(activo.get('ultimoPrecio') or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+def cargar_datos_cartera_cliente(token_portador, id_cliente):
     """
-    Versión asíncrona para obtener el portafolio de Estados Unidos de un cliente específico
+    Descarga los portafolios (Argentina y EEUU) y el estado de cuenta de un cliente.
+    Cada parte puede fallar sin afectar al resto; los errores se informan por nombre.
     
-    Args:
-        token_portador (str): Token de autenticación
-        id_cliente (str): ID del cliente
-        
     Returns:
-        dict: Portafolio de EEUU del cliente o None en caso de error
+        dict: {'Argentina', 'estados_Unidos', 'estado_cuenta', 'errores'}
     """
-    # Intentar primero con el endpoint de Asesores
-    url_portafolio_asesores = f'https://api.invertironline.com/api/v2/Asesores/Portafolio/{id_cliente}/estados_Unidos'
-    encabezados = obtener_encabezado_autorizacion(token_portador)
-    
+    datos = {'Argentina': None, 'estados_Unidos': None, 'estado_cuenta': None, 'errores': []}
+    for pais in ('Argentina', 'estados_Unidos'):
+        try:
+            datos[pais] = obtener_portafolio_crudo(token_portador, id_cliente, pais)
+        except requests.HTTPError as e:
+            # Un cliente sin cuenta en EEUU responde 404: no es un error de carga
+            if e.response.status_code != 404:
+                datos['errores'].append(f"portafolio {pais}: HTTP {e.response.status_code}")
+        except Exception as e:
+            datos['errores'].append(f"portafolio {pais}: {str(e)}")
     try:
-        async with aiohttp.ClientSession() as session:
-            # Primer intento: endpoint de Asesores
-            async with session.get(url_portafolio_asesores, headers=encabezados, timeout=aiohttp.ClientTimeout(total=30)) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return data
-                elif response.status == 404:
-                    st.info("ℹ️ No se encontró portafolio EEUU vía Asesores, intentando endpoint directo...")
-                    
-                    # Segundo intento: endpoint directo
-                    url_portafolio_directo = f'https://api.invertironline.com/api/v2/portafolio/estados_Unidos'
-                    async with session.get(url_portafolio_directo, headers=encabezados, timeout=aiohttp.ClientTimeout(total=30)) as response_directo:
-                        if response_directo.status == 200:
-                            data_directo = await response_directo.json()
-                            st.success(f"✅ Portafolio EEUU obtenido vía endpoint directo: {len(data_directo.get('activos', []))} activos")
-                            return data_directo
-                        elif response_directo.status == 401:
-                            st.error("❌ Error 401: Token de autenticación inválido o expirado")
-                            st.info("💡 Intente refrescar el token o inicie sesión nuevamente")
-                            return None
-                        elif response_directo.status == 403:
-                            st.error("❌ Error 403: Acceso denegado al portafolio de EEUU")
-                            st.info("💡 Verifique que su cuenta tenga permisos para acceder a portafolios de EEUU")
-                            return None
-                        else:
-                            st.error(f"❌ Error HTTP {response_directo.status} en endpoint directo")
-                            return None
-                            
-                elif response.status == 401:
-                    st.error("❌ Error 401: Token de autenticación inválido o expirado")
-                    st.info("💡 Intente refrescar el token o inicie sesión nuevamente")
-                    return None
-                elif response.status == 403:
-                    st.error("❌ Error 403: Acceso denegado al portafolio de EEUU")
-                    st.info("💡 Verifique que su cuenta tenga permisos para acceder a portafolios de EEUU")
-                    return None
-                else:
-                    st.error(f"❌ Error HTTP {response.status} en endpoint de Asesores")
-                    return None
-                    
-    except asyncio.TimeoutError:
-        st.error("⏱️ Timeout al obtener portafolio de EEUU")
-        return None
-    except aiohttp.ClientConnectionError:
-        st.error("🔌 Error de conexión al obtener portafolio de EEUU")
-        return None
+        datos['estado_cuenta'] = obtener_estado_cuenta_crudo(token_portador, id_cliente)
     except Exception as e:
-        st.error(f'❌ Error inesperado al obtener portafolio de EEUU: {str(e)}')
-        return None
+        datos['errores'].append(f"estado de cuenta: {str(e)}")
+    return datos
 
-async def obtener_estado_cuenta_async(token_portador, id_cliente=None):
+def cargar_cartera_asesor(token_portador, ids_clientes, max_en_vuelo=MAX_CLIENTES_EN_VUELO):
     """
-    Versión asíncrona para obtener el estado de cuenta del cliente o del usuario autenticado
+    Carga a la vez los portafolios y estados de cuenta de varios clientes del asesor
+    y los consolida en tablas columnares (una fila por cliente x activo y por cuenta).
     
-    Args:
-        token_portador (str): Token de autenticación
-        id_cliente (str, optional): ID del cliente. Si es None, obtiene el estado de cuenta del usuario
-        
-    Returns:
-        dict: Estado de cuenta o None en caso de error
-    """
-    if id_cliente:
-        url_estado_cuenta = f'https://api.invertironline.com/api/v2/Asesores/EstadoDeCuenta/{id_cliente}'
-    else:
-        url_estado_cuenta = 'https://api.invertironline.com/api/v2/estadocuenta'
-    
-    encabezados = obtener_encabezado_autorizacion(token_portador)
-    
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url_estado_cuenta, headers=encabezados, timeout=aiohttp.ClientTimeout(total=30)) as response:
-                if response.status == 200:
-                    return await response.json()
-                elif response.status == 401:
-                    st.error("Error de autenticación al obtener estado de cuenta")
-                    return None
-                else:
-                    st.error(f"Error HTTP {response.status} al obtener estado de cuenta")
-                    return None
-    except asyncio.TimeoutError:
-        st.error("Timeout al obtener estado de cuenta")
-        return None
-    except Exception as e:
-        st.error(f'Error al obtener estado de cuenta: {str(e)}')
-        return None
-
-async def obtener_estado_cuenta_eeuu_async(token_portador):
-    """
-    Versión asíncrona para obtener el estado de cuenta de Estados Unidos del usuario autenticado
-    Filtra las cuentas que corresponden a EEUU del estado de cuenta general
+    Las columnas de texto se guardan como categorías: los símbolos, tipos y monedas se
+    repiten entre clientes y las agregaciones por grupo resultan mucho más rápidas.
     
     Args:
         token_portador (str): Token de autenticación
+        ids_clientes (list): IDs de los clientes a cargar
+        max_en_vuelo (int): Clientes descargándose a la vez
         
     Returns:
-        dict: Estado de cuenta filtrado solo para cuentas de EEUU o None en caso de error
+        tuple: (DataFrame de tenencias, DataFrame de saldos, dict id_cliente -> errores)
     """
-    url_estado_cuenta = 'https://api.invertironline.com/api/v2/estadocuenta'
-    encabezados = obtener_encabezado_autorizacion(token_portador)
+    ids_clientes = list(dict.fromkeys(str(id_cliente) for id_cliente in ids_clientes))
+    resultados = descargar_en_paralelo(
+        lambda id_cliente: cargar_datos_cartera_cliente(token_portador, id_cliente),
+        ids_clientes, max_en_vuelo=max_en_vuelo
+    )
     
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url_estado_cuenta, headers=encabezados, timeout=aiohttp.ClientTimeout(total=30)) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    
-                    # Filtrar solo cuentas de EEUU
-                    if 'cuentas' in data:
-                        cuentas_eeuu = []
-                        for cuenta in data['cuentas']:
-                            if es_cuenta_eeuu(cuenta):
-                                cuentas_eeuu.append(cuenta)
-                        
-                        # Crear nuevo estado de cuenta solo con cuentas de EEUU
-                        estado_eeuu = data.copy()
-                        estado_eeuu['cuentas'] = cuentas_eeuu
-                        
-                        # Recalcular totales
-                        total_eeuu = sum(cuenta.get('total', 0) for cuenta in cuentas_eeuu)
-                        estado_eeuu['totalEnPesos'] = total_eeuu
-                        
-                        return estado_eeuu
-                    else:
-                        return data
-                elif response.status == 401:
-                    st.error("❌ Error 401: Token de autenticación inválido o expirado")
-                    return None
-                else:
-                    st.error(f"❌ Error HTTP {response.status} al obtener estado de cuenta de EEUU")
-                    return None
-    except asyncio.TimeoutError:
-        st.error("⏱️ Timeout al obtener estado de cuenta de EEUU")
-        return None
-    except Exception as e:
-        st.error(f'❌ Error inesperado al obtener estado de cuenta de EEUU: {str(e)}')
-        return None
-
-async def obtener_serie_historica_directa_async(simbolo, mercado, fecha_desde, fecha_hasta, ajustada, bearer_token):
-    """
-    Versión asíncrona para obtener serie histórica directamente de la API de IOL
+    tenencias = {'cliente': [], 'pais': [], 'simbolo': [], 'tipo': [], 'moneda': [], 'cantidad': [], 'valuacion': []}
+    saldos = {'cliente': [], 'moneda': [], 'disponible': [], 'total': []}
+    errores = {}
     
-    Args:
-        simbolo (str): Símbolo del activo
-        mercado (str): Mercado (bCBA, nYSE, nASDAQ, rOFEX, mERVAL)
-        fecha_desde (str): Fecha desde en formato YYYY-MM-DD
-        fecha_hasta (str): Fecha hasta en formato YYYY-MM-DD
-        ajustada (str): 'Ajustada' o 'SinAjustar'
-        bearer_token (str): Token de autenticación
+    for id_cliente in ids_clientes:
+        datos = resultados.get(id_cliente)
+        if datos is None:
+            errores[id_cliente] = ["error inesperado en la carga"]
+            continue
+        if datos['errores']:
+            errores[id_cliente] = datos['errores']
         
-    Returns:
-        list: Lista de datos históricos o None en caso de error
-    """
-    url = f"https://api.invertironline.com/api/v2/{mercado}/Titulos/{simbolo}/Cotizacion/seriehistorica/{fecha_desde}/{fecha_hasta}/{ajustada}"
-    headers = {
-        'Accept': 'application/json',
-        'Authorization': f'Bearer {bearer_token}'
-    }
-    
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=15)) as response:
-                if response.status == 200:
-                    return await response.json()
-                else:
-                    return None
-    except Exception as e:
-        return None
+        for pais in ('Argentina', 'estados_Unidos'):
+            for activo in (datos[pais] or {}).get('activos', []):
+                titulo = activo.get('titulo') or {}
+                if not titulo.get('simbolo'):
+                    continue
+                try:
+                    cantidad = float(activo.get('cantidad') or 0)
+                except (TypeError, ValueError):
+                    cantidad = 0.0
+                tenencias['cliente'].append(id_cliente)
+                tenencias['pais'].append(pais)
+                tenencias['simbolo'].append(titulo['simbolo'])
+                tenencias['tipo'].append(titulo.get('tipo') or 'N/A')
+                tenencias['moneda'].append(titulo.get('moneda') or 'N/A')
+                tenencias['cantidad'].append(cantidad)
+                tenencias['valuacion'].append(valuacion_activo(activo))
+        
+        for cuenta in (datos['estado_cuenta'] or {}).get('cuentas', []):
+            try:
+                disponible = float(cuenta.get('disponible') or 0)
+                total = float(cuenta.get('total') or 0)
+            except (TypeError, ValueError):
+                continue
+            saldos['cliente'].append(id_cliente)
+            saldos['moneda'].append(cuenta.get('moneda') or 'N/A')
+            saldos['disponible'].append(disponible)
+            saldos['total'].append(total)
+    
+    df_tenencias = pd.DataFrame(tenencias).astype({
+        'cliente': 'category', 'pais': 'category', 'simbolo': 'category',
+        'tipo': 'category', 'moneda': 'category', 'cantidad': 'float64', 'valuacion': 'float64'
+    })
+    df_saldos = pd.DataFrame(saldos).astype({
+        'cliente': 'category', 'moneda': 'category', 'disponible': 'float64', 'total': 'float64'
+    })
+    return df_tenencias, df_saldos, errores
+
+# --- Instantánea de cotizaciones por panel ---
+TTL_PANELES_COTIZACIONES = 60  # Cache por 1 minuto
+
+def paneles_para_instrumento(mercado=None, tipo=None):
+    """Paneles que corresponden al mercado/tipo del símbolo (lista vacía si no se puede inferir)"""
+    mercado_norm = (mercado or '').lower()
+    tipo_norm = (tipo or '').lower()
+    if mercado_norm in ('nyse', 'nasdaq'):
+        preferidos = [('acciones', 'estados_unidos')]
+    elif mercado_norm == 'fci' or 'fci' in tipo_norm or 'fondo' in tipo_norm:
+        preferidos = [('FCI', 'argentina')]
+    elif 'cedear' in tipo_norm:
+        preferidos = [('cedears', 'argentina')]
+    elif 'opcion' in tipo_norm:
+        preferidos = [('opciones', 'argentina')]
+    elif any(t in tipo_norm for t in ('bono', 'titulospublicos', 'letra', 'obligacion')):
+        preferidos = [('bonos', 'argentina')]
+    elif 'accion' in tipo_norm:
+        preferidos = [('acciones', 'argentina')]
+    else:
+        preferidos = []
+    return preferidos
 
-async def obtener_historico_mep_async(token_acceso, fecha_desde, fecha_hasta):
+class InstantaneaCotizaciones:
     """
-    Versión asíncrona para obtener el histórico del dólar MEP calculado como AL30/AL30D
-    Usa el método estándar que funciona correctamente para las métricas del portafolio
-    
-    Args:
-        token_acceso (str): Token de acceso para la autenticación
-        fecha_desde (str): Fecha desde en formato YYYY-MM-DD
-        fecha_hasta (str): Fecha hasta en formato YYYY-MM-DD
-    
-    Returns:
-        dict: Diccionario con datos históricos del MEP calculado
+    Instantánea de cotizaciones de los paneles completos de IOL con un índice
+    símbolo -> cotización por panel. Cada panel se descarga como máximo una vez por
+    TTL, de modo que valuar N tenencias cuesta un request por panel y no N.
     """
-    try:
-        # Usar el método estándar que funciona correctamente
-        tickers_especificos = ['AL30', 'AL30D']
-        datos_series = {}
-        
-        # Obtener datos para cada ticker usando el método estándar
-        for simbolo in tickers_especificos:
-            # Usar el método que funciona correctamente para las métricas del portafolio
-            serie = obtener_serie_historica_activo(simbolo, token_acceso, fecha_desde, fecha_hasta)
-            
-            if serie is not None and not serie.empty and len(serie) > 0:
-                # Convertir serie a listas
-                precios = serie.values.tolist()
-                fechas = serie.index.tolist()
-                
-                datos_series[simbolo] = {
-                    'precios': precios,
-                    'fechas': fechas
-                }
-        
-        # Verificar que tenemos datos para ambos tickers
-        if 'AL30' not in datos_series or 'AL30D' not in datos_series:
-            st.error("❌ No se pudieron obtener datos para AL30 o AL30D")
-            return None
-        
-        # Crear DataFrames y calcular MEP
-        df_al30 = pd.DataFrame({
-            'fecha': datos_series['AL30']['fechas'],
-            'precio_al30': datos_series['AL30']['precios']
-        })
-        
-        df_al30d = pd.DataFrame({
-            'fecha': datos_series['AL30D']['fechas'],
-            'precio_al30d': datos_series['AL30D']['precios']
-        })
-        
-        # Convertir fechas a datetime (sin zona horaria para evitar problemas de comparación)
-        df_al30['fecha'] = pd.to_datetime(df_al30['fecha']).dt.tz_localize(None)
-        df_al30d['fecha'] = pd.to_datetime(df_al30d['fecha']).dt.tz_localize(None)
-        
-        # Hacer merge por fecha
-        df_merged = pd.merge(df_al30, df_al30d, on='fecha', how='inner')
-        
-        # Calcular MEP
-        df_merged['mep'] = df_merged['precio_al30'] / df_merged['precio_al30d']
-        
-        # Ordenar por fecha
-        df_merged = df_merged.sort_values('fecha')
-        
-        
-        # Convertir a formato esperado por la interfaz
-        datos_mep = []
-        for _, row in df_merged.iterrows():
-            datos_mep.append({
-                'fecha': row['fecha'].strftime('%Y-%m-%d'),
-                'fechaHora': row['fecha'].strftime('%Y-%m-%dT%H:%M:%S'),
-                'mep': row['mep'],
-                'al30_pesos': row['precio_al30'],
-                'al30d_dolares': row['precio_al30d'],
-                'ultimoPrecio': row['mep'],
-                'variacion': 0,  # Se calculará si es necesario
-                'moneda': 'peso_Argentino'
-            })
-        
-        return {
-            'datos': datos_mep,
-            'dataframe': df_merged,
-            'resumen': {
-                'total_registros': len(datos_mep),
-                'fecha_inicio': df_merged['fecha'].min().strftime('%Y-%m-%d'),
-                'fecha_fin': df_merged['fecha'].max().strftime('%Y-%m-%d'),
-                'mep_promedio': df_merged['mep'].mean(),
-                'mep_min': df_merged['mep'].min(),
-                'mep_max': df_merged['mep'].max()
-            }
+    def __init__(self, ttl=TTL_PANELES_COTIZACIONES):
+        self.ttl = ttl
+        self._paneles = {}  # (instrumento, pais) -> (momento, titulos, indice)
+        self._fallidos = {}  # (instrumento, pais) -> momento del último error al descargarlo
+        self._lock = threading.Lock()
+        self.en_curso = SolicitudesEnCurso()
+
+    def _descargar_panel(self, instrumento, pais, bearer_token):
+        if instrumento == 'FCI':
+            url = 'https://api.invertironline.com/api/v2/Titulos/FCI'
+        else:
+            url = f"https://api.invertironline.com/api/v2/Cotizaciones/{instrumento}/{pais}/Todos"
+        headers = {
+            'Accept': 'application/json',
+            'Authorization': f'Bearer {bearer_token}'
         }
-        
-    except Exception as e:
-        st.error(f"❌ Error calculando histórico MEP: {str(e)}")
-        return None
+        response = obtener_cliente_iol().get(url, headers=headers, timeout=30)
+        if response.status_code != 200:
+            raise requests.HTTPError(f"{response.status_code} - {response.text[:200]}")
+        datos = response.json()
+        titulos = datos if isinstance(datos, list) else (datos or {}).get('titulos') or []
+        if instrumento == 'FCI':
+            # Los fondos informan el valor de la cuotaparte en lugar de ultimoPrecio
+            titulos = [{**t, 'ultimoPrecio': t.get('ultimoPrecio', t.get('ultimoValorCuotaParte'))} for t in titulos]
+        indice = {str(t['simbolo']).upper(): t for t in titulos if t.get('simbolo')}
+        with self._lock:
+            self._paneles[(instrumento, pais)] = (time.monotonic(), titulos, indice)
+            self._fallidos.pop((instrumento, pais), None)
+        return titulos, indice
+
+    def _panel(self, instrumento, pais, bearer_token):
+        with self._lock:
+            entrada = self._paneles.get((instrumento, pais))
+        if entrada is not None and time.monotonic() - entrada[0] < self.ttl:
+            return entrada[1], entrada[2]
+        return self.en_curso.ejecutar((instrumento, pais), self._descargar_panel, instrumento, pais, bearer_token)
+
+    def titulos(self, instrumento, pais, bearer_token):
+        """Devuelve los títulos del panel (lanza requests.HTTPError si la API responde con error)"""
+        return self._panel(instrumento, pais, bearer_token)[0]
+
+    def cotizacion(self, bearer_token, simbolo, mercado=None, tipo=None):
+        """
+        Busca la cotización de un símbolo. Sólo se descargan los paneles que corresponden
+        a su mercado/tipo; los demás se consultan únicamente si ya están en la instantánea.
 
-# --- FUNCIONES WRAPPER PARA USAR ASYNC EN STREAMLIT ---
-def ejecutar_async(func_async, *args, **kwargs):
-    """
-    Ejecuta una función asíncrona en el contexto de Streamlit
-    
-    Args:
-        func_async: Función asíncrona a ejecutar
-        *args: Argumentos posicionales
-        **kwargs: Argumentos con nombre
-        
-    Returns:
-        Resultado de la función asíncrona
-    """
-    try:
-        # Crear un nuevo loop de eventos si no existe uno
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            return loop.run_until_complete(func_async(*args, **kwargs))
-        finally:
-            loop.close()
-    except Exception as e:
-        st.error(f"Error ejecutando función asíncrona: {str(e)}")
+        Returns:
+            dict: Cotización del símbolo tal como la informa el panel, o None si no figura
+        """
+        clave = str(simbolo).upper()
+        preferidos = paneles_para_instrumento(mercado, tipo)
+        for instrumento, pais in preferidos:
+            with self._lock:
+                fallo = self._fallidos.get((instrumento, pais))
+            if fallo is not None and time.monotonic() - fallo < self.ttl:
+                # Panel que falló hace poco: no reintentarlo por cada símbolo
+                continue
+            try:
+                _, indice = self._panel(instrumento, pais, bearer_token)
+            except (requests.RequestException, ValueError) as e:
+                print(f"No se pudo obtener el panel {instrumento}/{pais}: {str(e)}")
+                with self._lock:
+                    self._fallidos[(instrumento, pais)] = time.monotonic()
+                continue
+            if clave in indice:
+                return indice[clave]
+        ahora = time.monotonic()
+        with self._lock:
+            vigentes = [
+                entrada[2] for panel, entrada in self._paneles.items()
+                if panel not in preferidos and ahora - entrada[0] < self.ttl
+            ]
+        for indice in vigentes:
+            if clave in indice:
+                return indice[clave]
         return None
 
-def obtener_portafolio_async_wrapper(token_portador, id_cliente, pais='Argentina'):
-    """
-    Wrapper síncrono para obtener_portafolio_async
-    """
-    return ejecutar_async(obtener_portafolio_async, token_portador, id_cliente, pais)
-
-def obtener_portafolio_eeuu_async_wrapper(token_portador, id_cliente):
+@st.cache_resource
+def obtener_instantanea_cotizaciones():
     """
-    Wrapper síncrono para obtener_portafolio_eeuu_async
+    Devuelve la instantánea de cotizaciones del proceso (compartida entre sesiones)
     """
-    return ejecutar_async(obtener_portafolio_eeuu_async, token_portador, id_cliente)
+    return InstantaneaCotizaciones()
 
-def obtener_estado_cuenta_async_wrapper(token_portador, id_cliente=None):
-    """
-    Wrapper síncrono para obtener_estado_cuenta_async
-    """
-    return ejecutar_async(obtener_estado_cuenta_async, token_portador, id_cliente)
-
-def obtener_estado_cuenta_eeuu_async_wrapper(token_portador):
-    """
-    Wrapper síncrono para obtener_estado_cuenta_eeuu_async
-    """
-    return ejecutar_async(obtener_estado_cuenta_eeuu_async, token_portador)
-
-def obtener_historico_mep_async_wrapper(token_acceso, fecha_desde, fecha_hasta):
-    """
-    Wrapper síncrono para obtener_historico_mep_async
-    """
-    return ejecutar_async(obtener_historico_mep_async, token_acceso, fecha_desde, fecha_hasta)
+def _extraer_ultimo_precio(data):
+    """Extrae el último precio de una cotización de IOL (número o diccionario)"""
+    if isinstance(data, (int, float)):
+        return float(data)
+    elif isinstance(data, dict):
+        # La API suele devolver 'ultimoPrecio'
+        for k in [
+            'ultimoPrecio', 'ultimo_precio', 'ultimoPrecioComprador', 'ultimoPrecioVendedor',
+            'precio', 'precioActual', 'valor'
+        ]:
+            if k in data and data[k] is not None:
+                try:
+                    return float(data[k])
+                except ValueError:
+                    continue
+    return None
 
-def obtener_estado_cuenta_eeuu(token_portador):
+def obtener_precio_actual(token_portador, mercado, simbolo, tipo=None):
     """
-    Obtiene el estado de cuenta de Estados Unidos del usuario autenticado
-    Filtra las cuentas que corresponden a EEUU del estado de cuenta general
-    
-    Args:
-        token_portador (str): Token de autenticación
-        
-    Returns:
-        dict: Estado de cuenta filtrado solo para cuentas de EEUU o None en caso de error
+    Obtiene el último precio de un título puntual.
+    Se resuelve desde la instantánea de cotizaciones por panel; si el símbolo no figura
+    en el panel de su tipo ni en los ya descargados, se consulta su endpoint estándar de IOL.
     """
-    # Usar el mismo endpoint que el estado de cuenta general
-    url_estado_cuenta = 'https://api.invertironline.com/api/v2/estadocuenta'
-    encabezados = obtener_encabezado_autorizacion(token_portador)
+    cotizacion = obtener_instantanea_cotizaciones().cotizacion(token_portador, simbolo, mercado, tipo)
+    if cotizacion is not None:
+        return _extraer_ultimo_precio(cotizacion)
     
-    try:
-        respuesta = requests.get(url_estado_cuenta, headers=encabezados, timeout=30)
-        
-        if respuesta.status_code == 200:
-            try:
-                data = respuesta.json()
-                
-                # Filtrar solo las cuentas de EEUU usando la misma lógica que la vista consolidada
-                cuentas_eeuu = []
-                for cuenta in data.get('cuentas', []):
-                    numero = cuenta.get('numero', 'N/A')
-                    descripcion = cuenta.get('descripcion', 'N/A')
-                    moneda = cuenta.get('moneda', 'N/A')
-                    
-                    # Determinar si es cuenta de EEUU (misma lógica que vista consolidada)
-                    es_cuenta_eeuu = any([
-                        'eeuu' in descripcion.lower(),
-                        'estados unidos' in descripcion.lower(),
-                        '-eeuu' in str(numero).lower(),
-                        'dolar estadounidense' in moneda.lower(),
-                        'dolar_estadounidense' in moneda.lower(),
-                        'usd' in moneda.lower()
-                    ])
-                    
-                    if es_cuenta_eeuu:
-                        cuentas_eeuu.append(cuenta)
-                
-                # Crear respuesta filtrada solo para EEUU
-                data_eeuu = {
-                    'cuentas': cuentas_eeuu,
-                    'totalEnPesos': sum(cuenta.get('total', 0) for cuenta in cuentas_eeuu),
-                    'filtrado': True,
-                    'total_cuentas_eeuu': len(cuentas_eeuu)
-                }
-                
-                if cuentas_eeuu:
-                    st.success(f"✅ Estado de cuenta EEUU filtrado: {len(cuentas_eeuu)} cuentas de EEUU")
-                else:
-                    st.info("ℹ️ No se encontraron cuentas específicas de EEUU")
-                
-                return data_eeuu
-                
-            except ValueError as e:
-                st.error(f"❌ Error al procesar JSON: {str(e)}")
-                return None
-        elif respuesta.status_code == 401:
-            st.error("❌ Error 401: Token de autenticación inválido o expirado")
-            st.info("💡 Intente refrescar el token o inicie sesión nuevamente")
-            return None
-        elif respuesta.status_code == 403:
-            st.error("❌ Error 403: Acceso denegado al estado de cuenta")
-            return None
-        elif respuesta.status_code == 404:
-            st.warning("⚠️ No se encontró estado de cuenta")
-            return None
-        else:
-            st.error(f"❌ Error HTTP {respuesta.status_code} al obtener estado de cuenta")
-            return None
-    except requests.exceptions.Timeout:
-        st.error("⏱️ Timeout al obtener estado de cuenta")
-        return None
-    except requests.exceptions.ConnectionError:
-        st.error("🔌 Error de conexión al obtener estado de cuenta")
-        return None
-    except Exception as e:
-        st.error(f'❌ Error inesperado al obtener estado de cuenta: {str(e)}')
-        return None
-
-def obtener_precio_actual(token_portador, mercado, simbolo):
-    """Obtiene el último precio de un título puntual (endpoint estándar de IOL)."""
     url = f"https://api.invertironline.com/api/v2/{mercado}/Titulos/{simbolo}/Cotizacion"
     headers = obtener_encabezado_autorizacion(token_portador)
     try:
-        r = requests.get(url, headers=headers, timeout=10)
+        r = obtener_cliente_iol().get(url, headers=headers, timeout=10)
         if r.status_code == 200:
-            data = r.json()
-            if isinstance(data, (int, float)):
-                return float(data)
-            elif isinstance(data, dict):
-                # La API suele devolver 'ultimoPrecio'
-                for k in [
-                    'ultimoPrecio', 'ultimo_precio', 'ultimoPrecioComprador', 'ultimoPrecioVendedor',
-                    'precio', 'precioActual', 'valor'
-                ]:
-                    if k in data and data[k] is not None:
-                        try:
-                            return float(data[k])
-                        except ValueError:
-                            continue
+            return _extraer_ultimo_precio(r.json())
         return None
     except Exception:
         return None
@@ -1291,7 +1646,7 @@ def obtener_cotizacion_mep(token_portador, simbolo, id_plazo_compra, id_plazo_ve
         "idPlazoOperatoriaVenta": id_plazo_venta
     }
     try:
-        respuesta = requests.post(url_cotizacion_mep, headers=encabezados, json=datos)
+        respuesta = obtener_cliente_iol().post(url_cotizacion_mep, headers=encabezados, json=datos)
         if respuesta.status_code == 200:
             resultado = respuesta.json()
             # Asegurarse de que siempre devolvemos un diccionario
@@ -1373,6 +1728,56 @@ def parse_datetime_flexible(date_str: str):
         st.warning(f"Error parsing date '{date_str}': {str(e)}")
         return None
 
+# --- Parser columnar de series históricas ---
+CAMPOS_PRECIO_SERIE = ('ultimoPrecio', 'cierreAnterior', 'precioPromedio', 'apertura')
+CAMPOS_FECHA_SERIE = ('fechaHora', 'fecha')
+
+def _primer_valor_columnas(df, campos, validos):
+    """Primer valor válido por fila entre las columnas `campos`, en orden (vectorizado con combine_first)"""
+    resultado = pd.Series(np.nan, index=df.index, dtype=object)
+    for campo in campos:
+        if campo in df.columns:
+            resultado = resultado.combine_first(validos(df[campo]))
+    return resultado
+
+def parsear_serie_historica(items, campos_precio=CAMPOS_PRECIO_SERIE, campos_fecha=CAMPOS_FECHA_SERIE):
+    """
+    Convierte la lista JSON de una respuesta /seriehistorica en un DataFrame de una sola pasada.
+
+    El precio se toma del primer campo de `campos_precio` distinto de cero/nulo, todas
+    las fechas se parsean con una única llamada a to_datetime y se eliminan duplicados
+    (conservando el último) y se ordena una sola vez.
+
+    Returns:
+        pd.DataFrame: Columnas 'fecha' (UTC) y 'precio' (float), o None si no hay datos válidos
+    """
+    if not isinstance(items, list) or not items:
+        return None
+    df = pd.DataFrame.from_records([item for item in items if isinstance(item, dict)])
+    if df.empty:
+        return None
+    
+    precios = _primer_valor_columnas(
+        df, campos_precio, lambda col: pd.to_numeric(col, errors='coerce').replace(0, np.nan)
+    )
+    fechas = _primer_valor_columnas(
+        df, campos_fecha, lambda col: col.where(col.astype(bool) & col.notna())
+    )
+    
+    resultado = pd.DataFrame({
+        'fecha': pd.to_datetime(fechas, format='ISO8601', utc=True, errors='coerce'),
+        'precio': pd.to_numeric(precios, errors='coerce').astype(float),
+    })
+    resultado = resultado[resultado['fecha'].notna() & (resultado['precio'] > 0)]
+    if resultado.empty:
+        return None
+    resultado = resultado.drop_duplicates(subset=['fecha'], keep='last')
+    return resultado.sort_values('fecha', kind='stable').reset_index(drop=True)
+
+def serie_de_precios(df, nombre=None):
+    """Convierte el DataFrame de parsear_serie_historica en una pd.Series indexada por fecha"""
+    return pd.Series(df['precio'].to_numpy(), index=pd.DatetimeIndex(df['fecha']).rename(None), name=nombre)
+
 def procesar_respuesta_historico(data, tipo_activo):
     """
     Procesa la respuesta de la API según el tipo de activo
@@ -1383,33 +1788,10 @@ def procesar_respuesta_historico(data, tipo_activo):
     try:
         # Para series históricas estándar
         if isinstance(data, list):
-            precios = []
-            fechas = []
-            
-            for item in data:
-                try:
-                    # Manejar diferentes estructuras de respuesta
-                    if isinstance(item, dict):
-                        precio = item.get('ultimoPrecio') or item.get('precio') or item.get('valor')
-                        if not precio or precio == 0:
-                            precio = item.get('cierreAnterior') or item.get('precioPromedio') or item.get('apertura')
-                        
-                        fecha_str = item.get('fechaHora') or item.get('fecha')
-                        
-                        if precio is not None and precio > 0 and fecha_str:
-                            fecha_parsed = parse_datetime_flexible(fecha_str)
-                            if pd.notna(fecha_parsed):
-                                precios.append(float(precio))
-                                fechas.append(fecha_parsed)
-                except (ValueError, AttributeError) as e:
-                    continue
-            
-            if precios and fechas:
-                df = pd.DataFrame({'fecha': fechas, 'precio': precios})
-                # Eliminar duplicados manteniendo el último
-                df = df.drop_duplicates(subset=['fecha'], keep='last')
-                df = df.sort_values('fecha')
-                return df
+            # Manejar diferentes estructuras de respuesta
+            return parsear_serie_historica(
+                data, campos_precio=('ultimoPrecio', 'precio', 'valor') + CAMPOS_PRECIO_SERIE[1:]
+            )
         
         # Para respuestas que son un solo valor (ej: MEP)
         elif isinstance(data, (int, float)):
@@ -1432,115 +1814,658 @@ def obtener_fondos_comunes(token_portador):
     }
     
     try:
-        response = requests.get(url, headers=headers, timeout=30)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        st.error(f"Error al obtener fondos comunes: {str(e)}")
-        return []
-
-
+        response = obtener_cliente_iol().get(url, headers=headers, timeout=30)
+        response.raise_for_status()
+        return response.json()
+    except requests.exceptions.RequestException as e:
+        st.error(f"Error al obtener fondos comunes: {str(e)}")
+        return []
+
+
+
+# --- Almacén local de series históricas ---
+def _a_fecha(valor):
+    """Convierte 'YYYY-MM-DD', date o datetime a date"""
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    return date.fromisoformat(str(valor)[:10])
+
+# --- Descarga de series por tramos ---
+# Los rangos largos se piden en tramos de hasta un año: una sola llamada de varios
+# años sobre un bono poco líquido suele vencer el timeout y perder todo el activo
+DIAS_POR_TRAMO = 366
+MAX_TRAMOS_SIMULTANEOS = 4
+# Reintentos de los tramos fallidos; en cada uno se parten a la mitad (hasta DIAS_MINIMOS_TRAMO)
+MAX_REINTENTOS_TRAMO = 2
+DIAS_MINIMOS_TRAMO = 31
+
+def dividir_rango_fechas(desde, hasta, dias=DIAS_POR_TRAMO):
+    """Parte [desde, hasta] en tramos contiguos de a lo sumo `dias` días"""
+    tramos = []
+    inicio = desde
+    while inicio <= hasta:
+        fin = min(inicio + timedelta(days=dias - 1), hasta)
+        tramos.append((inicio, fin))
+        inicio = fin + timedelta(days=1)
+    return tramos
+
+class SerieRechazada(Exception):
+    """La API rechazó la serie del par (símbolo, mercado): reintentar no sirve"""
+
+def _clave_fecha_item(item):
+    return (item.get('fechaHora') or item.get('fecha')) if isinstance(item, dict) else None
+
+def descargar_por_tramos(descargar, fecha_desde, fecha_hasta, dias=DIAS_POR_TRAMO, max_en_vuelo=MAX_TRAMOS_SIMULTANEOS):
+    """
+    Descarga un rango de fechas en tramos concurrentes y une los resultados.
+    Sólo se reintentan los tramos que fallaron, partidos a la mitad en cada reintento.
+    
+    Args:
+        descargar (callable): descargar(desde_str, hasta_str) -> lista de ítems o None si falla;
+            puede lanzar SerieRechazada, en cuyo caso la serie se abandona sin reintentos
+        
+    Returns:
+        list: Ítems del rango sin fechas repetidas, o None si algún tramo no se pudo descargar
+    """
+    pendientes = dividir_rango_fechas(_a_fecha(fecha_desde), _a_fecha(fecha_hasta), dias)
+    obtenidos = {}
+    rechazados = []
+    
+    def _descargar_tramo(tramo):
+        try:
+            return descargar(tramo[0].isoformat(), tramo[1].isoformat())
+        except SerieRechazada:
+            rechazados.append(tramo)
+            return None
+    
+    for intento in range(MAX_REINTENTOS_TRAMO + 1):
+        if intento:
+            # Tramos más cortos responden antes: partir los que fallaron
+            pendientes = [
+                parte for tramo in pendientes
+                for parte in (
+                    dividir_rango_fechas(*tramo, dias=((tramo[1] - tramo[0]).days + 2) // 2)
+                    if (tramo[1] - tramo[0]).days + 1 >= 2 * DIAS_MINIMOS_TRAMO else [tramo]
+                )
+            ]
+        if len(pendientes) == 1:
+            resultados = {pendientes[0]: _descargar_tramo(pendientes[0])}
+        else:
+            resultados = descargar_en_paralelo(_descargar_tramo, pendientes, max_en_vuelo=max_en_vuelo)
+        obtenidos.update({tramo: items for tramo, items in resultados.items() if items is not None})
+        pendientes = [tramo for tramo in pendientes if resultados.get(tramo) is None]
+        if rechazados:
+            return None
+        if not pendientes:
+            break
+    else:
+        print(f"Tramos sin descargar tras {MAX_REINTENTOS_TRAMO} reintentos: {pendientes}")
+        return None
+    
+    # Unir en orden cronológico; los bordes de tramos vecinos pueden repetir el mismo día
+    items_unidos = []
+    vistos = set()
+    for tramo in sorted(obtenidos):
+        for item in obtenidos[tramo]:
+            clave = _clave_fecha_item(item)
+            if clave is not None:
+                if clave in vistos:
+                    continue
+                vistos.add(clave)
+            items_unidos.append(item)
+    return items_unidos
+
+class AlmacenSeriesHistoricas:
+    """
+    Almacén persistente (SQLite) de respuestas de /seriehistorica por (mercado, símbolo, ajuste).
+
+    Guarda los ítems crudos de la API junto con el rango de fechas ya cubierto, de modo
+    que un cambio de fecha_desde/fecha_hasta sólo descarga los tramos faltantes al
+    principio o al final del rango y el resto se sirve localmente.
+    Los ítems se guardan uno por día: el día en curso nunca se da por cubierto porque
+    su cotización sigue cambiando, y cada nueva descarga reemplaza su fila.
+    Las series ajustadas se vuelven a descargar completas cuando vence TTL_AJUSTADA,
+    porque dividendos y splits reescriben los precios pasados.
+    """
+    TTL_AJUSTADA = 24 * 3600  # 1 día
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self.en_curso = SolicitudesEnCurso()  # Descargas de series en curso
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with self._conectar() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS items (
+                    mercado TEXT, simbolo TEXT, ajustada TEXT, fecha TEXT, item TEXT,
+                    PRIMARY KEY (mercado, simbolo, ajustada, fecha)
+                )""")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cobertura (
+                    mercado TEXT, simbolo TEXT, ajustada TEXT, desde TEXT, hasta TEXT, actualizado REAL,
+                    PRIMARY KEY (mercado, simbolo, ajustada)
+                )""")
+            columnas = {fila[1] for fila in conn.execute('PRAGMA table_info(cobertura)')}
+            if 'actualizado' not in columnas:
+                conn.execute('ALTER TABLE cobertura ADD COLUMN actualizado REAL')
+            # Filas de versiones anteriores, guardadas por fechaHora completa: conservar la
+            # última cotización de cada día y pasarla a la clave diaria
+            conn.execute("""
+                DELETE FROM items WHERE length(fecha) > 10 AND EXISTS (
+                    SELECT 1 FROM items otro
+                    WHERE otro.mercado = items.mercado AND otro.simbolo = items.simbolo
+                      AND otro.ajustada = items.ajustada
+                      AND substr(otro.fecha, 1, 10) = substr(items.fecha, 1, 10)
+                      AND otro.fecha > items.fecha
+                )""")
+            conn.execute('UPDATE OR REPLACE items SET fecha = substr(fecha, 1, 10) WHERE length(fecha) > 10')
+
+    def _conectar(self):
+        return sqlite3.connect(self.ruta, timeout=30)
+
+    def _ajustada_vencida(self, mercado, simbolo, ajustada):
+        """True si la serie es ajustada y su descarga más vieja superó TTL_AJUSTADA"""
+        ajustada = ajustada.lower()
+        if ajustada == 'sinajustar':
+            return False
+        with self._conectar() as conn:
+            fila = conn.execute(
+                'SELECT actualizado FROM cobertura WHERE mercado=? AND simbolo=? AND ajustada=?',
+                (mercado, simbolo, ajustada)
+            ).fetchone()
+        return fila is not None and (fila[0] is None or time.time() - fila[0] > self.TTL_AJUSTADA)
+
+    def descartar(self, mercado, simbolo, ajustada):
+        """Elimina los ítems y la cobertura almacenados de la clave"""
+        ajustada = ajustada.lower()
+        with self._lock, self._conectar() as conn:
+            conn.execute('DELETE FROM items WHERE mercado=? AND simbolo=? AND ajustada=?', (mercado, simbolo, ajustada))
+            conn.execute('DELETE FROM cobertura WHERE mercado=? AND simbolo=? AND ajustada=?', (mercado, simbolo, ajustada))
+
+    def cobertura(self, mercado, simbolo, ajustada):
+        """Devuelve (desde, hasta) cubierto para la clave o None"""
+        with self._conectar() as conn:
+            fila = conn.execute(
+                'SELECT desde, hasta FROM cobertura WHERE mercado=? AND simbolo=? AND ajustada=?',
+                (mercado, simbolo, ajustada.lower())
+            ).fetchone()
+        return (_a_fecha(fila[0]), _a_fecha(fila[1])) if fila else None
+
+    def tramos_faltantes(self, mercado, simbolo, ajustada, desde, hasta):
+        """Lista de (desde, hasta) que hay que pedir a la API para cubrir el rango"""
+        cubierto = self.cobertura(mercado, simbolo, ajustada)
+        if cubierto is None:
+            return [(desde, hasta)]
+        # Los tramos siempre son contiguos a lo cubierto para no dejar huecos
+        tramos = []
+        if desde < cubierto[0]:
+            tramos.append((desde, cubierto[0] - timedelta(days=1)))
+        if hasta > cubierto[1]:
+            tramos.append((cubierto[1] + timedelta(days=1), hasta))
+        return tramos
+
+    def guardar(self, mercado, simbolo, ajustada, desde, hasta, items):
+        """Persiste los ítems descargados y extiende el rango cubierto"""
+        ajustada = ajustada.lower()
+        # Una fila por día: de varias cotizaciones del mismo día queda la más reciente
+        por_dia = {}
+        for item in items:
+            fecha = _clave_fecha_item(item)
+            if fecha:
+                fecha = str(fecha)
+                if fecha[:10] not in por_dia or fecha > por_dia[fecha[:10]][0]:
+                    por_dia[fecha[:10]] = (fecha, item)
+        filas = [(mercado, simbolo, ajustada, dia, json.dumps(item)) for dia, (_, item) in por_dia.items()]
+        hasta_cubierto = min(hasta, date.today() - timedelta(days=1))
+        with self._lock, self._conectar() as conn:
+            conn.executemany('INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?)', filas)
+            if desde > hasta_cubierto:
+                return
+            fila = conn.execute(
+                'SELECT desde, hasta, actualizado FROM cobertura WHERE mercado=? AND simbolo=? AND ajustada=?',
+                (mercado, simbolo, ajustada)
+            ).fetchone()
+            nuevo = (desde, hasta_cubierto)
+            actualizado = time.time()
+            if fila:
+                previo = (_a_fecha(fila[0]), _a_fecha(fila[1]))
+                # Unir sólo si los rangos se tocan; si no, conservar el nuevo
+                if nuevo[0] <= previo[1] + timedelta(days=1) and previo[0] <= nuevo[1] + timedelta(days=1):
+                    nuevo = (min(nuevo[0], previo[0]), max(nuevo[1], previo[1]))
+                    # La antigüedad de la cobertura es la de su parte más vieja
+                    actualizado = min(actualizado, fila[2] or 0)
+            conn.execute(
+                'INSERT OR REPLACE INTO cobertura VALUES (?, ?, ?, ?, ?, ?)',
+                (mercado, simbolo, ajustada, nuevo[0].isoformat(), nuevo[1].isoformat(), actualizado)
+            )
+
+    def leer(self, mercado, simbolo, ajustada, desde, hasta):
+        """Devuelve los ítems almacenados del rango, en orden cronológico"""
+        with self._conectar() as conn:
+            filas = conn.execute(
+                """SELECT item FROM items
+                   WHERE mercado=? AND simbolo=? AND ajustada=? AND substr(fecha, 1, 10) BETWEEN ? AND ?
+                   ORDER BY fecha""",
+                (mercado, simbolo, ajustada.lower(), desde.isoformat(), hasta.isoformat())
+            ).fetchall()
+        return [json.loads(fila[0]) for fila in filas]
+
+    def obtener(self, mercado, simbolo, ajustada, fecha_desde, fecha_hasta, descargar):
+        """
+        Devuelve los ítems del rango descargando sólo los tramos faltantes.
+
+        Args:
+            descargar (callable): descargar(desde_str, hasta_str) -> lista de ítems o None si falla
+
+        Returns:
+            list: Ítems del rango, o None si falló la descarga de algún tramo
+        """
+        desde, hasta = _a_fecha(fecha_desde), _a_fecha(fecha_hasta)
+        if self._ajustada_vencida(mercado, simbolo, ajustada):
+            self.descartar(mercado, simbolo, ajustada)
+        for tramo_desde, tramo_hasta in self.tramos_faltantes(mercado, simbolo, ajustada, desde, hasta):
+            # Los tramos de más de un año se piden en partes concurrentes
+            items = descargar_por_tramos(descargar, tramo_desde, tramo_hasta)
+            if items is None:
+                return None
+            self.guardar(mercado, simbolo, ajustada, tramo_desde, tramo_hasta, items)
+        return self.leer(mercado, simbolo, ajustada, desde, hasta)
+
+def directorio_cache_local():
+    """Directorio de los almacenes locales (configurable con IOL_CACHE_DIR)"""
+    return os.environ.get('IOL_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'iol_portfolio'))
+
+@st.cache_resource
+def obtener_almacen_series():
+    """
+    Devuelve el almacén local de series del proceso
+    """
+    return AlmacenSeriesHistoricas(os.path.join(directorio_cache_local(), 'series_historicas.sqlite'))
+
+# --- Índice persistente de instrumentos ---
+class IndiceInstrumentos:
+    """
+    Índice persistente símbolo -> mercado (más tipo de instrumento y moneda) aprendido
+    de las respuestas de la API. También recuerda los símbolos que no existen en ninguno
+    de los mercados sondeados, para no volver a sondear esos mismos mercados hasta que
+    venza su TTL, y los pares
+    (símbolo, mercado) cuya serie histórica la API rechaza.
+    """
+    TTL_POSITIVO = 7 * 24 * 3600  # 7 días
+    TTL_NEGATIVO = 6 * 3600       # 6 horas
+    # Pares sin serie: espera inicial que se duplica con cada fallo consecutivo, hasta un día
+    TTL_SIN_DATOS = 3600
+    TTL_SIN_DATOS_MAXIMO = 24 * 3600
+    # Dispersión aleatoria de la espera, para que los pares no se reintenten todos juntos
+    JITTER_SIN_DATOS = 0.2
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with self._conectar() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS instrumentos (
+                    simbolo TEXT PRIMARY KEY, mercado TEXT, tipo TEXT, moneda TEXT, actualizado REAL
+                )""")
+            columnas = {fila[1] for fila in conn.execute('PRAGMA table_info(instrumentos)')}
+            if 'sondeados' not in columnas:
+                # Mercados sondeados de una entrada negativa; las anteriores no lo guardaban
+                conn.execute('DELETE FROM instrumentos WHERE mercado IS NULL')
+                conn.execute('ALTER TABLE instrumentos ADD COLUMN sondeados TEXT')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sin_datos (
+                    simbolo TEXT, mercado TEXT, fallos INTEGER, reintentar_desde REAL,
+                    PRIMARY KEY (simbolo, mercado)
+                )""")
+
+    def _conectar(self):
+        return sqlite3.connect(self.ruta, timeout=30)
+
+    def buscar(self, simbolo, mercados=()):
+        """
+        Devuelve la entrada vigente del símbolo como dict {'mercado', 'tipo', 'moneda'},
+        con mercado None si se sabe que no existe en ninguno de `mercados`, o None si no
+        hay entrada vigente (una entrada negativa sólo vale si sondeó todos esos mercados).
+        """
+        with self._conectar() as conn:
+            fila = conn.execute(
+                'SELECT mercado, tipo, moneda, actualizado, sondeados FROM instrumentos WHERE simbolo=?',
+                (simbolo,)
+            ).fetchone()
+        if fila is None:
+            return None
+        mercado, tipo, moneda, actualizado, sondeados = fila
+        ttl = self.TTL_POSITIVO if mercado else self.TTL_NEGATIVO
+        if time.time() - actualizado > ttl:
+            return None
+        if mercado is None and not set(mercados) <= set((sondeados or '').split(',')):
+            return None
+        return {'mercado': mercado, 'tipo': tipo, 'moneda': moneda}
+
+    def registrar(self, simbolo, mercado, tipo=None, moneda=None, sondeados=None):
+        """Registra (o renueva) el mercado donde cotiza el símbolo"""
+        with self._conectar() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO instrumentos (simbolo, mercado, tipo, moneda, actualizado, sondeados) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (simbolo, mercado, tipo, moneda, time.time(), sondeados)
+            )
+
+    def registrar_inexistente(self, simbolo, mercados):
+        """Registra que el símbolo no cotiza en ninguno de los mercados sondeados"""
+        self.registrar(simbolo, None, sondeados=','.join(sorted(mercados)))
+
+    def sin_datos(self, simbolo, mercado):
+        """True si la serie del par fue rechazada y todavía no corresponde reintentarla"""
+        with self._conectar() as conn:
+            fila = conn.execute(
+                'SELECT reintentar_desde FROM sin_datos WHERE simbolo=? AND mercado=?', (simbolo, mercado)
+            ).fetchone()
+        return fila is not None and time.time() < fila[0]
+
+    def registrar_sin_datos(self, simbolo, mercado):
+        """
+        Registra que la API rechazó la serie del par. La espera hasta el próximo intento
+        crece con los fallos consecutivos y lleva un jitter aleatorio.
+        """
+        with self._conectar() as conn:
+            fila = conn.execute(
+                'SELECT fallos FROM sin_datos WHERE simbolo=? AND mercado=?', (simbolo, mercado)
+            ).fetchone()
+            fallos = (fila[0] if fila else 0) + 1
+            espera = min(self.TTL_SIN_DATOS * 2 ** (fallos - 1), self.TTL_SIN_DATOS_MAXIMO)
+            espera *= random.uniform(1 - self.JITTER_SIN_DATOS, 1 + self.JITTER_SIN_DATOS)
+            conn.execute(
+                'INSERT OR REPLACE INTO sin_datos VALUES (?, ?, ?, ?)',
+                (simbolo, mercado, fallos, time.time() + espera)
+            )
+
+    def registrar_con_datos(self, simbolo, mercado):
+        """Olvida los fallos del par cuando la API vuelve a devolver su serie"""
+        with self._conectar() as conn:
+            conn.execute('DELETE FROM sin_datos WHERE simbolo=? AND mercado=?', (simbolo, mercado))
+
+@st.cache_resource
+def obtener_indice_instrumentos():
+    """
+    Devuelve el índice de instrumentos del proceso
+    """
+    return IndiceInstrumentos(os.path.join(directorio_cache_local(), 'instrumentos.sqlite'))
+
+def url_cotizacion(mercado, simbolo):
+    """Construye la URL de la cotización (o ficha, para fondos) según el tipo de instrumento"""
+    if mercado == "FCI":
+        return f"https://api.invertironline.com/api/v2/Titulos/FCI/{simbolo}"
+    return f"https://api.invertironline.com/api/v2/{mercado}/Titulos/{simbolo}/Cotizacion"
+
+def sondear_mercado_simbolo(simbolo, bearer_token, mercados, timeout=5):
+    """
+    Sondea /Cotizacion del símbolo en todos los mercados candidatos a la vez.
+    
+    Gana el primer éxito respetando el orden de prioridad de `mercados` (se espera sólo
+    a los mercados de mayor prioridad que todavía no respondieron) y los sondeos
+    pendientes se cancelan.
+    
+    Returns:
+        tuple: (mercado, datos_cotizacion) si se encontró; (None, True) si todos los
+        mercados respondieron que no existe; (None, False) si hubo errores de red/servidor
+    """
+    cliente = obtener_cliente_iol()
+    headers = {
+        'Accept': 'application/json',
+        'Authorization': f'Bearer {bearer_token}'
+    }
+    
+    def sondear(mercado):
+        url = url_cotizacion(mercado, simbolo)
+        try:
+            response = cliente.get(url, headers=headers, timeout=timeout)
+        except Exception:
+            return 'error', None
+        if response.status_code == 200:
+            try:
+                return 'ok', response.json()
+            except ValueError:
+                return 'ok', None
+        if response.status_code in (400, 404):
+            return 'inexistente', None
+        return 'error', None
+    
+    resultados = {}
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(mercados), thread_name_prefix='iol-sondeo')
+    try:
+        futuros = {executor.submit(sondear, mercado): mercado for mercado in mercados}
+        for futuro in concurrent.futures.as_completed(futuros):
+            resultados[futuros[futuro]] = futuro.result()
+            # Decidir en orden de prioridad apenas sea posible
+            for mercado in mercados:
+                if mercado not in resultados:
+                    break
+                estado, datos = resultados[mercado]
+                if estado == 'ok':
+                    return mercado, datos
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    return None, all(estado == 'inexistente' for estado, _ in resultados.values())
+
+def resolver_mercado_simbolo(simbolo, bearer_token, mercados):
+    """
+    Resuelve el mercado de un símbolo usando el índice persistente de instrumentos.
+    Un símbolo ya visto (o ya descartado) no cuesta ningún request; si no se conoce,
+    se sondean los mercados candidatos a la vez y se aprende el resultado.
+    
+    Returns:
+        str: Mercado donde cotiza el símbolo, o None si no se encontró
+    """
+    try:
+        indice = obtener_indice_instrumentos()
+        entrada = indice.buscar(simbolo, mercados)
+    except (sqlite3.Error, OSError) as e:
+        print(f"Índice de instrumentos no disponible: {e}")
+        indice, entrada = None, None
+    if entrada is not None:
+        return entrada['mercado']
+    
+    mercado, datos = sondear_mercado_simbolo(simbolo, bearer_token, mercados)
+    
+    if indice is not None:
+        try:
+            if mercado:
+                datos = datos if isinstance(datos, dict) else {}
+                indice.registrar(simbolo, mercado, datos.get('tipo'), datos.get('moneda'))
+            elif datos:
+                # Todos los mercados respondieron que el símbolo no existe
+                indice.registrar_inexistente(simbolo, mercados)
+        except (sqlite3.Error, OSError) as e:
+            print(f"No se pudo actualizar el índice de instrumentos: {e}")
+    return mercado
+
+def url_serie_historica(mercado, simbolo, fecha_desde, fecha_hasta, ajustada="SinAjustar"):
+    """Construye la URL de /seriehistorica según el tipo de instrumento"""
+    if mercado == "Opciones":
+        return f"https://api.invertironline.com/api/v2/Opciones/Titulos/{simbolo}/Cotizacion/seriehistorica/{fecha_desde}/{fecha_hasta}/{ajustada}"
+    elif mercado == "FCI":
+        return f"https://api.invertironline.com/api/v2/Titulos/FCI/{simbolo}/Cotizacion/seriehistorica/{fecha_desde}/{fecha_hasta}/{ajustada}"
+    # Para mercados tradicionales usar el formato estándar
+    return f"https://api.invertironline.com/api/v2/{mercado}/Titulos/{simbolo}/Cotizacion/seriehistorica/{fecha_desde}/{fecha_hasta}/{ajustada}"
+
+# Respuestas de /seriehistorica que indican que el par (símbolo, mercado) no tiene serie.
+# Un 400 son parámetros inválidos (por ejemplo, el rango de fechas): no se reintenta ese
+# pedido, pero tampoco dice nada del par y no entra en la cache negativa
+ESTADOS_SIN_SERIE = (404,)
+ESTADOS_RECHAZADOS = (400,) + ESTADOS_SIN_SERIE
+
+def descargar_serie_historica_json(token_portador, mercado, simbolo, fecha_desde, fecha_hasta, ajustada="SinAjustar", timeout=15, estados=None):
+    """
+    Descarga la respuesta cruda de /seriehistorica.
+    Devuelve la lista de ítems ([] si no hay datos) o None ante error HTTP o de red.
+    Si se pasa la lista `estados`, se le agrega el código HTTP recibido (None si no hubo respuesta).
+    """
+    url = url_serie_historica(mercado, simbolo, fecha_desde, fecha_hasta, ajustada)
+    headers = {
+        'Accept': 'application/json',
+        'Authorization': f'Bearer {token_portador}'
+    }
+    estado = None
+    try:
+        response = obtener_cliente_iol().get(url, headers=headers, timeout=timeout)
+        estado = response.status_code
+        if response.status_code == 200:
+            return response.json() or []
+        return None
+    except Exception:
+        return None
+    finally:
+        if estados is not None:
+            estados.append(estado)
+
+def actualizar_cache_negativa(simbolo, mercado, estados):
+    """
+    Registra el resultado de las descargas de un par en el índice de instrumentos:
+    si todas respondieron 404 el par entra en la cache negativa; si alguna devolvió
+    datos, se olvidan sus fallos. Los 400 y los errores de red o del servidor no cuentan.
+    """
+    if not estados:
+        return
+    try:
+        indice = obtener_indice_instrumentos()
+        if all(estado in ESTADOS_SIN_SERIE for estado in estados):
+            indice.registrar_sin_datos(simbolo, mercado)
+        elif 200 in estados:
+            indice.registrar_con_datos(simbolo, mercado)
+    except (sqlite3.Error, OSError) as e:
+        print(f"No se pudo actualizar la cache negativa de {simbolo}/{mercado}: {e}")
+
+def obtener_serie_historica_json(token_portador, mercado, simbolo, fecha_desde, fecha_hasta, ajustada="SinAjustar", timeout=15):
+    """
+    Devuelve los ítems crudos de la serie histórica sirviéndolos desde el almacén local
+    y pidiendo a IOL sólo los tramos de fechas que todavía no están cubiertos.
+    
+    Returns:
+        list: Ítems de la serie ([] si no hay datos) o None si falló la descarga
+    """
+    try:
+        # Par rechazado hace poco por la API: no repetir el 404 hasta que venza su espera
+        if obtener_indice_instrumentos().sin_datos(simbolo, mercado):
+            return None
+    except (sqlite3.Error, OSError) as e:
+        print(f"Índice de instrumentos no disponible: {e}")
+    
+    estados = []
+    
+    def descargar(desde, hasta):
+        estado = []
+        items = descargar_serie_historica_json(token_portador, mercado, simbolo, desde, hasta, ajustada, timeout, estado)
+        estados.extend(estado)
+        if estado and estado[0] in ESTADOS_RECHAZADOS:
+            raise SerieRechazada(f"{mercado}/{simbolo}: HTTP {estado[0]}")
+        return items
+    
+    try:
+        # Los datos de mercado no dependen del usuario: sesiones distintas que piden
+        # la misma serie a la vez comparten una sola descarga
+        almacen = obtener_almacen_series()
+        clave = (mercado, simbolo, str(fecha_desde), str(fecha_hasta), ajustada)
+        return almacen.en_curso.ejecutar(
+            clave, almacen.obtener, mercado, simbolo, ajustada, fecha_desde, fecha_hasta, descargar
+        )
+    except (sqlite3.Error, OSError) as e:
+        # Sin almacén local (disco de sólo lectura, base corrupta...) se descarga el rango completo
+        print(f"Almacén local de series no disponible: {str(e)}")
+        return descargar_por_tramos(descargar, fecha_desde, fecha_hasta)
+    finally:
+        actualizar_cache_negativa(simbolo, mercado, estados)
+
+# --- Cache de datos de mercado ---
+# Cotizaciones, series y paneles son públicos: el token sólo autentica la descarga.
+# Los parámetros con guión bajo quedan fuera de la clave de st.cache_data, de modo
+# que todos los usuarios comparten la misma entrada. Lo que depende del usuario
+# (portafolio, estado de cuenta, operaciones) sigue cacheado por token.
+
+class DescargaMercadoFallida(Exception):
+    """La descarga falló (token inválido, red, API): st.cache_data no cachea excepciones"""
+
+@st.cache_data(ttl=600)  # Cache por 10 minutos, compartido entre usuarios
+def _serie_historica_iol_cacheada(mercado, simbolo, fecha_desde, fecha_hasta, ajustada, _token_portador):
+    """
+    Serie histórica de precios parseada, con clave independiente del token.
+    Una descarga fallida se propaga como excepción para no cachear el fallo de un usuario.
+    """
+    data = obtener_serie_historica_json(_token_portador, mercado, simbolo, fecha_desde, fecha_hasta, ajustada)
+    if data is None:
+        raise DescargaMercadoFallida(f"{mercado}/{simbolo}")
+    if not data:
+        # Símbolo sin datos en el rango: es una respuesta válida y se cachea
+        return None
+    
+    # Usar ultimoPrecio como precio principal según la documentación;
+    # si es 0 o nulo se usan cierreAnterior, precioPromedio y apertura
+    df = parsear_serie_historica(data)
+    if df is None:
+        return None
+    
+    return serie_de_precios(df)
 
-@st.cache_data(ttl=600)  # Cache por 10 minutos para mejor rendimiento
 def obtener_serie_historica_iol(token_portador, mercado, simbolo, fecha_desde, fecha_hasta, ajustada="SinAjustar"):
     """
     Obtiene la serie histórica de precios de un título desde la API de IOL.
     Actualizada para manejar correctamente la estructura de respuesta de la API.
+    Los datos se sirven desde el almacén local y sólo se descargan los tramos faltantes.
     """
-    # Determinar endpoint según tipo de instrumento según la documentación de IOL
-    if mercado == "Opciones":
-        url = f"https://api.invertironline.com/api/v2/Opciones/Titulos/{simbolo}/Cotizacion/seriehistorica/{fecha_desde}/{fecha_hasta}/{ajustada}"
-    elif mercado == "FCI":
-        url = f"https://api.invertironline.com/api/v2/Titulos/FCI/{simbolo}/Cotizacion/seriehistorica/{fecha_desde}/{fecha_hasta}/{ajustada}"
-    else:
-        # Para mercados tradicionales usar el formato estándar
-        url = f"https://api.invertironline.com/api/v2/{mercado}/Titulos/{simbolo}/Cotizacion/seriehistorica/{fecha_desde}/{fecha_hasta}/{ajustada}"
-    
-    headers = {
-        'Accept': 'application/json',
-        'Authorization': f'Bearer {token_portador}',
-        'Content-Type': 'application/json'
-    }
-    
     try:
-        response = requests.get(url, headers=headers, timeout=15)  # Reducido de 30 a 15 segundos
-        
-        if response.status_code == 200:
-            data = response.json()
-            if not data:
-                return None
-            
-            precios = []
-            fechas = []
-            
-            for item in data:
-                try:
-                    # Usar ultimoPrecio como precio principal según la documentación
-                    precio = item.get('ultimoPrecio')
-                    
-                    # Si ultimoPrecio es 0 o None, intentar otros campos
-                    if not precio or precio == 0:
-                        precio = item.get('cierreAnterior') or item.get('precioPromedio') or item.get('apertura')
-                    
-                    fecha_str = item.get('fechaHora') or item.get('fecha')
-                    
-                    if precio is not None and precio > 0 and fecha_str:
-                        fecha_parsed = parse_datetime_flexible(fecha_str)
-                        if fecha_parsed is not None:
-                            precios.append(precio)
-                            fechas.append(fecha_parsed)
-                            
-                except Exception as e:
-                    # Log individual item errors but continue processing
-                    continue
-            
-            if precios and fechas:
-                # Crear serie ordenada por fecha
-                serie = pd.Series(precios, index=fechas)
-                serie = serie.sort_index()  # Asegurar orden cronológico
-                
-                # Eliminar duplicados manteniendo el último valor
-                serie = serie[~serie.index.duplicated(keep='last')]
-                
-                return serie
-            else:
-                return None
-                
-        elif response.status_code == 401:
-            # Token expirado o inválido - silencioso para no interrumpir
-            return None
-            
-        elif response.status_code == 404:
-            # Símbolo no encontrado en este mercado - silencioso
-            return None
-            
-        elif response.status_code == 400:
-            # Parámetros inválidos - silencioso
-            return None
-            
-        elif response.status_code == 500:
-            # Error del servidor - silencioso para no interrumpir el flujo
-            return None
-            
-        else:
-            # Otros errores HTTP - silencioso
-            return None
-            
-    except requests.exceptions.Timeout:
-        # Timeout - silencioso
-        return None
-    except requests.exceptions.ConnectionError:
-        # Error de conexión - silencioso
-        return None
+        return _serie_historica_iol_cacheada(mercado, simbolo, fecha_desde, fecha_hasta, ajustada, token_portador)
     except Exception as e:
-        # Error general - silencioso para no interrumpir el análisis
+        # Sin datos, símbolo no encontrado, token inválido o error de red - silencioso
         return None
 
 # Función removida - usando solo API de IOL
 
+@st.cache_data(ttl=300)  # Cache por 5 minutos: compartido por todos los consumidores de la misma corrida
+def obtener_operaciones_por_simbolo(token_portador, fecha_desde, fecha_hasta, id_cliente=None):
+    """
+    Descarga una sola vez las operaciones terminadas del período y las agrupa por símbolo.
+    
+    Args:
+        token_portador (str): Token de autorización
+        fecha_desde (str): Fecha desde (YYYY-MM-DD)
+        fecha_hasta (str): Fecha hasta (YYYY-MM-DD)
+        id_cliente (str): ID del cliente para filtrar operaciones
+        
+    Returns:
+        dict: Símbolo -> lista de operaciones del activo
+        
+    Raises:
+        requests.HTTPError: Si la API responde con error (los errores no se cachean)
+    """
+    params = {
+        'filtro.estado': 'terminadas',
+        'filtro.fechaDesde': fecha_desde,
+        'filtro.fechaHasta': fecha_hasta,
+        'filtro.pais': 'argentina'
+    }
+    if id_cliente:
+        params['filtro.cuentaComitente'] = id_cliente
+    
+    url = "https://api.invertironline.com/api/v2/operaciones"
+    response = obtener_cliente_iol().get(url, headers=obtener_encabezado_autorizacion(token_portador), params=params)
+    if response.status_code != 200:
+        raise requests.HTTPError(f"{response.status_code} - {response.text}")
+    
+    # Agrupar en una sola pasada
+    operaciones_por_simbolo = {}
+    for operacion in response.json() or []:
+        operaciones_por_simbolo.setdefault(operacion.get('simbolo'), []).append(operacion)
+    return operaciones_por_simbolo
+
 def obtener_operaciones_activo(token_portador, simbolo, fecha_desde=None, fecha_hasta=None, id_cliente=None):
     """
     Obtiene todas las operaciones de un activo específico desde la API de IOL.
+    La descarga del período se comparte entre símbolos vía obtener_operaciones_por_simbolo.
     
     Args:
         token_portador (str): Token de autorización
@@ -1557,37 +2482,12 @@ def obtener_operaciones_activo(token_portador, simbolo, fecha_desde=None, fecha_
     if fecha_hasta is None:
         fecha_hasta = datetime.now().strftime('%Y-%m-%d')
     
-    headers = {
-        'Authorization': f'Bearer {token_portador}',
-        'Content-Type': 'application/json'
-    }
-    
-    # Parámetros para filtrar operaciones
-    params = {
-        'filtro.estado': 'terminadas',
-        'filtro.fechaDesde': fecha_desde,
-        'filtro.fechaHasta': fecha_hasta,
-        'filtro.pais': 'argentina'
-    }
-    if id_cliente:
-        params['filtro.cuentaComitente'] = id_cliente
-    
     try:
-        url = "https://api.invertironline.com/api/v2/operaciones"
-        response = requests.get(url, headers=headers, params=params)
-        
-        if response.status_code == 200:
-            operaciones = response.json()
-            # Filtrar solo las operaciones del símbolo específico
-            operaciones_activo = [
-                op for op in operaciones 
-                if op.get('simbolo') == simbolo
-            ]
-            return operaciones_activo
-        else:
-            print(f"Error al obtener operaciones: {response.status_code} - {response.text}")
-            return []
-            
+        operaciones_por_simbolo = obtener_operaciones_por_simbolo(token_portador, fecha_desde, fecha_hasta, id_cliente)
+        return operaciones_por_simbolo.get(simbolo, [])
+    except requests.HTTPError as e:
+        print(f"Error al obtener operaciones: {str(e)}")
+        return []
     except Exception as e:
         print(f"Error al obtener operaciones para {simbolo}: {str(e)}")
         return []
@@ -1623,14 +2523,19 @@ def reconstruir_composicion_portafolio(token_portador, portafolio_actual, fecha_
         # Si ya es un diccionario por símbolo
         portafolio_dict = portafolio_actual
     
-    # Obtener todas las operaciones de todos los activos
+    # Obtener todas las operaciones del período en una sola descarga
+    try:
+        operaciones_por_simbolo = obtener_operaciones_por_simbolo(token_portador, fecha_desde, fecha_hasta, id_cliente)
+    except Exception as e:
+        print(f"Error al obtener operaciones: {str(e)}")
+        operaciones_por_simbolo = {}
+    
     todas_operaciones = []
     
     for simbolo in portafolio_dict.keys():
-        operaciones = obtener_operaciones_activo(token_portador, simbolo, fecha_desde, fecha_hasta, id_cliente)
-        for op in operaciones:
-            op['simbolo_original'] = simbolo
-            todas_operaciones.append(op)
+        for operacion in operaciones_por_simbolo.get(simbolo, []):
+            operacion['simbolo_original'] = simbolo
+            todas_operaciones.append(operacion)
     
     # Ordenar operaciones por fecha
     todas_operaciones.sort(key=lambda x: x.get('fechaOperada', x.get('fechaOrden', '1900-01-01')))
@@ -1715,13 +2620,6 @@ def reconstruir_composicion_portafolio(token_portador, portafolio_actual, fecha_
     
     return composicion_por_fecha, posiciones_actuales
 
-def es_cuenta_eeuu(cuenta):
-    """
-    Determina si una cuenta es de EEUU basándose en su moneda
-    """
-    moneda = cuenta.get('moneda', '').lower()
-    return 'dolar' in moneda or 'usd' in moneda or 'dollar' in moneda
-
 def obtener_composicion_historica_portafolio(token_acceso, activos, fecha_desde, fecha_hasta):
     """
     Alias para reconstruir_composicion_portafolio para mantener compatibilidad
@@ -1995,6 +2893,12 @@ def obtener_datos_paralelo(simbolo, token_portador, fecha_desde_str, fecha_hasta
         else:
             mercados = ['nYSE', 'nASDAQ', 'bCBA', 'FCI', 'rOFEX', 'Opciones']
         
+        # Probar primero el mercado del índice de instrumentos; si no se resolvió,
+        # se recorren las series de todos los mercados como antes
+        mercado_resuelto = resolver_mercado_simbolo(simbolo, token_portador, mercados)
+        if mercado_resuelto is not None:
+            mercados = [mercado_resuelto] + [m for m in mercados if m != mercado_resuelto]
+        
         for mercado in mercados:
             try:
                 serie = obtener_serie_historica_iol(
@@ -2025,7 +2929,7 @@ def obtener_tokens_directo(username, password):
         'Content-Type': 'application/x-www-form-urlencoded'
     }
     try:
-        response = requests.post(token_url, data=payload, headers=headers, timeout=15)
+        response = obtener_cliente_iol().post(token_url, data=payload, headers=headers, timeout=15)
         if response.status_code == 200:
             tokens = response.json()
             return tokens['access_token'], tokens['refresh_token']
@@ -2047,7 +2951,7 @@ def refrescar_token_directo(refresh_token):
         'Content-Type': 'application/x-www-form-urlencoded'
     }
     try:
-        response = requests.post(token_url, data=payload, headers=headers, timeout=15)
+        response = obtener_cliente_iol().post(token_url, data=payload, headers=headers, timeout=15)
         if response.status_code == 200:
             tokens = response.json()
             return tokens['access_token'], tokens['refresh_token']
@@ -2065,7 +2969,24 @@ def obtener_encabezado_autorizacion(token_portador):
         'Content-Type': 'application/json'
     }
 
-@st.cache_data(ttl=1800)  # Cache por 30 minutos
+@st.cache_data(ttl=1800)  # Cache por 30 minutos, compartido entre usuarios
+def _tickers_panel_cacheados(panel, pais, _token_portador):
+    """
+    Símbolos operables de un panel, con clave independiente del token.
+    Cada panel se cachea por separado: un panel fallido no invalida a los demás.
+    """
+    url = f'https://api.invertironline.com/api/v2/cotizaciones-orleans/{panel}/{pais}/Operables'
+    params = {
+        'cotizacionInstrumentoModel.instrumento': panel,
+        'cotizacionInstrumentoModel.pais': pais.lower()
+    }
+    encabezados = obtener_encabezado_autorizacion(_token_portador)
+    respuesta = obtener_cliente_iol().get(url, headers=encabezados, params=params, timeout=15)
+    if respuesta.status_code != 200:
+        raise DescargaMercadoFallida(f"{panel}/{pais}: HTTP {respuesta.status_code}")
+    datos = respuesta.json()
+    return [titulo['simbolo'] for titulo in datos.get('titulos', [])]
+
 def obtener_tickers_por_panel(token_portador, paneles, pais):
     """
     Obtiene tickers disponibles por panel de cotizaciones
@@ -2074,22 +2995,11 @@ def obtener_tickers_por_panel(token_portador, paneles, pais):
     tickers_df = pd.DataFrame(columns=['panel', 'simbolo'])
     
     for panel in paneles:
-        url = f'https://api.invertironline.com/api/v2/cotizaciones-orleans/{panel}/{pais}/Operables'
-        params = {
-            'cotizacionInstrumentoModel.instrumento': panel,
-            'cotizacionInstrumentoModel.pais': pais.lower()
-        }
-        encabezados = obtener_encabezado_autorizacion(token_portador)
         try:
-            respuesta = requests.get(url, headers=encabezados, params=params, timeout=15)
-            if respuesta.status_code == 200:
-                datos = respuesta.json()
-                tickers = [titulo['simbolo'] for titulo in datos.get('titulos', [])]
-                tickers_por_panel[panel] = tickers
-                panel_df = pd.DataFrame({'panel': panel, 'simbolo': tickers})
-                tickers_df = pd.concat([tickers_df, panel_df], ignore_index=True)
-            else:
-                continue
+            tickers = _tickers_panel_cacheados(panel, pais, token_portador)
+            tickers_por_panel[panel] = tickers
+            panel_df = pd.DataFrame({'panel': panel, 'simbolo': tickers})
+            tickers_df = pd.concat([tickers_df, panel_df], ignore_index=True)
         except Exception as e:
             continue
     return tickers_por_panel, tickers_df
@@ -2155,11 +3065,20 @@ def calcular_indicadores_tecnicos_avanzados(precios, periodo=14):
     
     return indicadores
 
-@st.cache_data(ttl=600)  # Cache por 10 minutos
 def obtener_serie_historica_directa(simbolo, mercado, fecha_desde, fecha_hasta, ajustada, bearer_token):
     """
     Obtiene serie histórica directamente usando el mismo método que funciona en las métricas
     """
+    try:
+        return _serie_historica_directa_cacheada(simbolo, mercado, fecha_desde, fecha_hasta, ajustada, bearer_token)
+    except DescargaMercadoFallida:
+        return None
+
+@st.cache_data(ttl=600)  # Cache por 10 minutos, compartido entre usuarios
+def _serie_historica_directa_cacheada(simbolo, mercado, fecha_desde, fecha_hasta, ajustada, _bearer_token):
+    """
+    Respuesta cruda de seriehistorica con clave independiente del token
+    """
     # Mapear nombres de mercados a los correctos de IOL (igual que en obtener_serie_historica)
     mercados_mapping = {
         'BCBA': 'bCBA',
@@ -2172,24 +3091,124 @@ def obtener_serie_historica_directa(simbolo, mercado, fecha_desde, fecha_hasta,
     
     mercado_correcto = mercados_mapping.get(mercado, mercado)
     
-    url = f"https://api.invertironline.com/api/v2/{mercado_correcto}/Titulos/{simbolo}/Cotizacion/seriehistorica/{fecha_desde}/{fecha_hasta}/{ajustada}"
-    headers = {
-        'Accept': 'application/json',
-        'Authorization': f'Bearer {bearer_token}'
-    }
-    try:
-        response = requests.get(url, headers=headers, timeout=15)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return None
-    except Exception as e:
-        return None
+    # Servido desde el almacén local; sólo se descargan los tramos faltantes
+    data = obtener_serie_historica_json(_bearer_token, mercado_correcto, simbolo, fecha_desde, fecha_hasta, ajustada)
+    if data is None:
+        raise DescargaMercadoFallida(f"{mercado_correcto}/{simbolo}")
+    return data
+
+# --- Precarga de históricos en segundo plano ---
+# Una precarga ya encolada no se repite durante este tiempo (igual que la cache de series)
+TTL_PRECARGA = 600
+# Hilos de precarga: pocos, para dejar lugar a las descargas que pide la pantalla
+MAX_PRECARGAS_SIMULTANEAS = 4
+# Tickers del dólar MEP (AL30/AL30D) usados en la pestaña de mercado
+TICKERS_MEP = ('AL30', 'AL30D')
+# Selectores de benchmark cuyo valor es un símbolo que se puede descargar de IOL
+CLAVES_BENCHMARK_SESION = ('benchmark_avanzada', 'benchmark_cobertura', 'benchmark_optimizacion_aleatoria')
+
+class PrecargaHistoricos:
+    """
+    Cola de descargas en segundo plano que calienta el almacén de series y las caches.
+
+    Es única por proceso: los reruns y las sesiones que piden la misma serie no la
+    vuelven a encolar. Las funciones a ejecutar las pasa quien encola, para que usen
+    las definiciones del rerun actual.
+    """
+    
+    def __init__(self, max_hilos=MAX_PRECARGAS_SIMULTANEAS, ttl=TTL_PRECARGA):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_hilos, thread_name_prefix='iol-precarga')
+        self.ttl = ttl
+        self.encoladas = {}  # clave -> instante en que se encoló
+        self.lock = threading.Lock()
+    
+    def encolar(self, clave, funcion, *args):
+        """Encola funcion(*args) salvo que la misma clave se haya encolado hace menos de ttl"""
+        ahora = time.monotonic()
+        with self.lock:
+            encolada = self.encoladas.get(clave)
+            if encolada is not None and ahora - encolada < self.ttl:
+                return False
+            self.encoladas = {c: t for c, t in self.encoladas.items() if ahora - t < self.ttl}
+            self.encoladas[clave] = ahora
+        
+        def _ejecutar():
+            try:
+                funcion(*args)
+            except Exception as e:
+                print(f"Precarga de {clave} fallida: {str(e)}")
+                # Permitir que un rerun posterior vuelva a intentarlo
+                with self.lock:
+                    self.encoladas.pop(clave, None)
+        
+        self.executor.submit(_ejecutar)
+        return True
+
+@st.cache_resource
+def obtener_precarga_historicos():
+    """Devuelve la cola de precarga única del proceso"""
+    return PrecargaHistoricos()
+
+def precargar_serie_simbolo(token_portador, simbolo, fecha_desde, fecha_hasta):
+    """
+    Descarga la serie de un símbolo por el mismo camino que usan las pestañas
+    (mercado detectado, SinAjustar), dejándola en el almacén local y en cache.
+    """
+    mercado = detectar_mercado_simbolo(simbolo, token_portador)
+    if not mercado:
+        return
+    if mercado == 'FCI':
+        data = obtener_serie_historica_json(token_portador, 'FCI', simbolo, fecha_desde, fecha_hasta, 'SinAjustar', timeout=30)
+        if data is None:
+            raise DescargaMercadoFallida(f"FCI/{simbolo}")
+    else:
+        # Lanza DescargaMercadoFallida si la descarga falla
+        _serie_historica_iol_cacheada(mercado, simbolo, fecha_desde, fecha_hasta, 'SinAjustar', token_portador)
+
+def precargar_historicos_cliente(token_portador, portafolios, fecha_desde, fecha_hasta):
+    """
+    Encola en segundo plano las series históricas que van a pedir las pestañas de
+    análisis: los activos de los portafolios, el par MEP y los benchmarks elegidos.
+    No bloquea: si el usuario abre una pestaña antes de que termine, la descarga
+    en curso se comparte en lugar de repetirse.
+    
+    Returns:
+        int: Cantidad de series encoladas (las ya encoladas recientemente no cuentan)
+    """
+    desde = fecha_desde.strftime('%Y-%m-%d') if hasattr(fecha_desde, 'strftime') else str(fecha_desde)
+    hasta = fecha_hasta.strftime('%Y-%m-%d') if hasattr(fecha_hasta, 'strftime') else str(fecha_hasta)
+    
+    simbolos = []
+    for portafolio in portafolios:
+        for activo in (portafolio or {}).get('activos', []):
+            simbolo = (activo.get('titulo') or {}).get('simbolo')
+            if simbolo:
+                simbolos.append(simbolo)
+    for clave in CLAVES_BENCHMARK_SESION:
+        benchmark = st.session_state.get(clave)
+        # Índices (^SPX), cripto (BTC-USD) y benchmarks sintéticos (Tasa_...) no son de IOL
+        if benchmark and not re.search(r'[\^_\-]', benchmark):
+            simbolos.append(benchmark)
+    
+    precarga = obtener_precarga_historicos()
+    encoladas = 0
+    for simbolo in dict.fromkeys(simbolos):
+        encoladas += precarga.encolar(
+            ('serie', simbolo, desde, hasta), precargar_serie_simbolo, token_portador, simbolo, desde, hasta
+        )
+    for simbolo in TICKERS_MEP:
+        # El histórico MEP pide ambos tickers en bCBA con la descarga directa
+        encoladas += precarga.encolar(
+            ('mep', simbolo, desde, hasta), _serie_historica_directa_cacheada,
+            simbolo, 'bCBA', desde, hasta, 'SinAjustar', token_portador
+        )
+    return encoladas
 
-def get_historical_data_for_optimization(token_portador, simbolos, fecha_desde, fecha_hasta):
+def get_historical_data_for_optimization(token_portador, simbolos, fecha_desde, fecha_hasta, max_en_vuelo=MAX_DESCARGAS_SIMULTANEAS):
     """
     Obtiene datos históricos para optimización usando el método directo mejorado.
     Utiliza el enfoque directo proporcionado por el usuario para mejor rendimiento.
+    Los símbolos se descargan en paralelo con hasta max_en_vuelo requests simultáneos.
     """
     try:
         df_precios = pd.DataFrame()
@@ -2234,33 +3253,18 @@ def get_historical_data_for_optimization(token_portador, simbolos, fecha_desde,
         
         # Crear barra de progreso
         progress_bar = st.progress(0)
-        total_simbolos = len(simbolos)
         
         st.info(f"🔍 Buscando datos históricos desde {fecha_desde_str} hasta {fecha_hasta_str}")
         
-        # Procesar cada símbolo
-        series_data = {}  # Almacenar todas las series primero
-        
-        for idx, simbolo in enumerate(simbolos):
-            progress_bar.progress((idx + 1) / total_simbolos, text=f"Procesando {simbolo}...")
-            
-            serie_encontrada = False
-            mercado_encontrado = None
-            
+        def obtener_serie_simbolo(simbolo):
+            """Descarga la serie de un símbolo; devuelve (serie, mercado) o (None, None)"""
             # Usar el mismo método que funciona en las métricas del portafolio
             try:
                 # Usar el método estándar que funciona correctamente
                 serie = obtener_serie_historica_estandar(simbolo, token_portador, fecha_desde_str, fecha_hasta_str)
                 
                 if serie is not None and not serie.empty and len(serie) > 10 and serie.nunique() > 1:
-                    series_data[simbolo] = serie
-                    simbolos_exitosos.append(simbolo)
-                    serie_encontrada = True
-                    mercado_encontrado = "detectado_automáticamente"
-                    
-                    # Mostrar información del símbolo exitoso
-                    if len(simbolos_exitosos) <= 10:
-                        st.success(f"✅ {simbolo} (auto-detectado): {len(serie)} puntos de datos")
+                    return serie, "auto-detectado"
                         
             except Exception as e:
                 # Si falla, intentar con el método directo como fallback
@@ -2283,48 +3287,44 @@ def get_historical_data_for_optimization(token_portador, simbolos, fecha_desde,
                         
                         if serie_historica and len(serie_historica) > 0:
                             # Procesar los datos
-                            precios = []
-                            fechas = []
-                            
-                            for item in serie_historica:
-                                try:
-                                    precio = item.get('ultimoPrecio')
-                                    if not precio or precio == 0:
-                                        precio = item.get('cierreAnterior') or item.get('precioPromedio') or item.get('apertura')
-                                    
-                                    fecha_str = item.get('fechaHora') or item.get('fecha')
-                                    
-                                    if precio is not None and precio > 0 and fecha_str:
-                                        fecha_parsed = parse_datetime_flexible(fecha_str)
-                                        if fecha_parsed is not None:
-                                            precios.append(precio)
-                                            fechas.append(fecha_parsed)
-                                            
-                                except Exception as e:
-                                    continue
+                            df_serie = parsear_serie_historica(serie_historica)
                             
-                            if len(precios) > 10:  # Mínimo de datos válidos
+                            if df_serie is not None and len(df_serie) > 10:  # Mínimo de datos válidos
                                 # Crear serie de pandas
-                                serie = pd.Series(precios, index=fechas, name=simbolo)
-                                serie = serie.sort_index()
+                                serie = serie_de_precios(df_serie, nombre=simbolo)
                                 
                                 # Verificar que la serie tenga variación
                                 if serie.nunique() > 1:
-                                    series_data[simbolo] = serie
-                                    simbolos_exitosos.append(simbolo)
-                                    serie_encontrada = True
-                                    mercado_encontrado = mercado
-                                    
-                                    # Mostrar información del símbolo exitoso
-                                    if len(simbolos_exitosos) <= 10:
-                                        st.success(f"✅ {simbolo} ({mercado}): {len(serie)} puntos de datos")
-                                    break
+                                    return serie, mercado
                             
                     except Exception as e:
                         continue
             
-            # Si no se encontró en ningún mercado, marcar como fallido
-            if not serie_encontrada:
+            return None, None
+        
+        def actualizar_progreso(simbolo, resultado, completados, total):
+            progress_bar.progress(completados / total, text=f"Procesado {simbolo} ({completados}/{total})")
+        
+        # Descargar todos los símbolos en paralelo con concurrencia acotada
+        resultados = descargar_en_paralelo(
+            obtener_serie_simbolo, simbolos, max_en_vuelo=max_en_vuelo, al_completar=actualizar_progreso
+        )
+        
+        # Procesar resultados en el orden original de los símbolos
+        series_data = {}  # Almacenar todas las series primero
+        
+        for simbolo in dict.fromkeys(simbolos):
+            serie, mercado_encontrado = resultados.get(simbolo) or (None, None)
+            
+            if serie is not None:
+                series_data[simbolo] = serie
+                simbolos_exitosos.append(simbolo)
+                
+                # Mostrar información del símbolo exitoso
+                if len(simbolos_exitosos) <= 10:
+                    st.success(f"✅ {simbolo} ({mercado_encontrado}): {len(serie)} puntos de datos")
+            else:
+                # Si no se encontró en ningún mercado, marcar como fallido
                 simbolos_fallidos.append(simbolo)
                 mercado_sugerido = simbolo_mercado_map.get(simbolo, "desconocido")
                 detalles_errores[simbolo] = f"No encontrado en ningún mercado (sugerido: {mercado_sugerido})"
@@ -2490,20 +3490,8 @@ def obtener_serie_historica(simbolo, mercado, fecha_desde, fecha_hasta, ajustada
     
     mercado_correcto = mercados_mapping.get(mercado, mercado)
     
-    url = f"https://api.invertironline.com/api/v2/{mercado_correcto}/Titulos/{simbolo}/Cotizacion/seriehistorica/{fecha_desde}/{fecha_hasta}/{ajustada}"
-    headers = {
-        'Accept': 'application/json',
-        'Authorization': f'Bearer {bearer_token}'
-    }
-    
-    try:
-        response = requests.get(url, headers=headers, timeout=30)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return None
-    except Exception:
-        return None
+    # Servido desde el almacén local; sólo se descargan los tramos faltantes
+    return obtener_serie_historica_json(bearer_token, mercado_correcto, simbolo, fecha_desde, fecha_hasta, ajustada, timeout=30)
 
 def detectar_mercado_simbolo(simbolo, bearer_token):
     """
@@ -2524,21 +3512,8 @@ def detectar_mercado_simbolo(simbolo, bearer_token):
     elif simbolo in ['AL30', 'GD30', 'GD35', 'GD38', 'GD41', 'GD46', 'GD47', 'GD48', 'GD49', 'GD50']:
         return 'Bonos'  # Bonos argentinos conocidos
     else:
-        # Intentar detectar consultando la API
-        mercados_test = ['bCBA', 'FCI', 'nYSE', 'nASDAQ', 'Bonos']
-        for mercado in mercados_test:
-            try:
-                url = f"https://api.invertironline.com/api/v2/{mercado}/Titulos/{simbolo}/Cotizacion"
-                headers = {
-                    'Accept': 'application/json',
-                    'Authorization': f'Bearer {bearer_token}'
-                }
-                response = requests.get(url, headers=headers, timeout=5)
-                if response.status_code == 200:
-                    return mercado
-            except Exception:
-                continue
-        return None
+        # Índice persistente y, si no se conoce, sondeo concurrente de la API
+        return resolver_mercado_simbolo(simbolo, bearer_token, ['bCBA', 'FCI', 'nYSE', 'nASDAQ', 'Bonos'])
 
 def obtener_clase_d(simbolo, mercado, bearer_token):
     """
@@ -2562,7 +3537,7 @@ def obtener_clase_d(simbolo, mercado, bearer_token):
         'Authorization': f'Bearer {bearer_token}'
     }
     try:
-        response = requests.get(url, headers=headers, timeout=10)
+        response = obtener_cliente_iol().get(url, headers=headers, timeout=10)
         if response.status_code == 200:
             clases = response.json()
             for clase in clases:
@@ -2592,69 +3567,32 @@ def obtener_serie_historica_fci(token_portador, simbolo, fecha_desde, fecha_hast
         pd.DataFrame: DataFrame con columnas 'fecha' y 'precio', o None si hay error
     """
     try:
-        # Primero intentar obtener directamente la serie histórica
-        url_serie = f"https://api.invertironline.com/api/v2/Titulos/FCI/{simbolo}/Cotizacion/seriehistorica/{fecha_desde}/{fecha_hasta}/SinAjustar"
+        # Primero intentar obtener la serie histórica (almacén local + tramos faltantes)
         headers = {
             'Authorization': f'Bearer {token_portador}',
             'Accept': 'application/json'
         }
         
-        response = requests.get(url_serie, headers=headers, timeout=30)
+        data = obtener_serie_historica_json(token_portador, 'FCI', simbolo, fecha_desde, fecha_hasta, 'SinAjustar', timeout=30)
         
-        # Manejo específico para errores de servidor
-        if response.status_code == 500:
-            print(f"Error de conexión al obtener datos del FCI {simbolo}: 500 Server Error: Internal Server Error for url: {url_serie}")
-            return None
-        elif response.status_code == 404:
-            print(f"FCI {simbolo} no encontrado en la API")
-            return None
-        elif response.status_code != 200:
-            print(f"Error {response.status_code} al obtener datos del FCI {simbolo}")
-            return None
-            
-        try:
-            data = response.json()
-        except ValueError as e:
-            print(f"Error al parsear respuesta JSON para FCI {simbolo}: {e}")
+        if data is None:
+            print(f"Error al obtener datos del FCI {simbolo} (no encontrado o error del servidor)")
             return None
         
         # Procesar la respuesta según el formato esperado
         if isinstance(data, list):
-            fechas = []
-            precios = []
-            
-            for item in data:
-                try:
-                    # Manejar diferentes formatos de fecha
-                    fecha_str = item.get('fecha') or item.get('fechaHora')
-                    if not fecha_str:
-                        continue
-                        
-                    # Obtener el valor de la cuota (puede venir en diferentes campos)
-                    precio = item.get('valorCuota') or item.get('precio') or item.get('ultimoPrecio')
-                    if not precio:
-                        continue
-                        
-                    # Convertir fecha
-                    fecha = parse_datetime_flexible(fecha_str)
-                    if not pd.isna(fecha):
-                        fechas.append(fecha)
-                        precios.append(float(precio))
-                        
-                except (ValueError, TypeError, AttributeError) as e:
-                    continue
-            
-            if fechas and precios:
-                df = pd.DataFrame({'fecha': fechas, 'precio': precios})
-                df = df.drop_duplicates(subset=['fecha'], keep='last')
-                df = df.sort_values('fecha')
+            # El valor de la cuota puede venir en diferentes campos
+            df = parsear_serie_historica(
+                data, campos_precio=('valorCuota', 'precio', 'ultimoPrecio'), campos_fecha=('fecha', 'fechaHora')
+            )
+            if df is not None:
                 return df
         
         # Si no se pudo obtener la serie histórica, intentar obtener el último valor
         try:
             # Obtener información del FCI
             url_fci = "https://api.invertironline.com/api/v2/Titulos/FCI"
-            response = requests.get(url_fci, headers=headers, timeout=30)
+            response = obtener_cliente_iol().get(url_fci, headers=headers, timeout=30)
             response.raise_for_status()
             fc_data = response.json()
             
@@ -2719,7 +3657,7 @@ def _deprecated_serie_historica_iol(*args, **kwargs):
             'Authorization': f'Bearer {token_portador}'
         }
         
-        response = requests.get(url, headers=headers)
+        response = obtener_cliente_iol().get(url, headers=headers)
         response.raise_for_status()
         
         data = response.json()
@@ -2750,6 +3688,153 @@ def portfolio_variance(x, mtx_var_covar):
     variance = np.matmul(np.transpose(x), np.matmul(mtx_var_covar, x))
     return variance
 
+# --- Funciones objetivo con gradiente analítico ---
+# Objetivos que devuelven (valor, gradiente) para optimize.minimize(..., jac=True) y
+# restricciones con su Jacobiano, así SLSQP no estima derivadas por diferencias finitas
+# (n+1 evaluaciones por gradiente). Todas operan sobre ndarrays ya calculados.
+
+def varianza_y_gradiente(pesos, covarianza):
+    """wᵀΣw y su gradiente 2Σw"""
+    sigma_w = covarianza @ pesos
+    return float(pesos @ sigma_w), 2 * sigma_w
+
+def sharpe_negativo_y_gradiente(pesos, media, covarianza, tasa_libre_riesgo=0.0, valor_sin_volatilidad=1e6):
+    """
+    -Sharpe y su gradiente: ∇S = μ/σ - (μᵀw - rf)·Σw/σ³.
+
+    valor_sin_volatilidad es lo que devuelve cuando σ es 0 o no finita (cada
+    optimizador conserva su propia penalización).
+    """
+    sigma_w = covarianza @ pesos
+    volatilidad = np.sqrt(pesos @ sigma_w)
+    if volatilidad == 0 or not np.isfinite(volatilidad):
+        return valor_sin_volatilidad, np.zeros_like(pesos)
+    exceso = media @ pesos - tasa_libre_riesgo
+    gradiente = media / volatilidad - exceso * sigma_w / volatilidad ** 3
+    return float(-exceso / volatilidad), -gradiente
+
+def penalizacion_l2_y_gradiente(pesos, factor):
+    """factor·Σw² y su gradiente 2·factor·w"""
+    return float(factor * (pesos @ pesos)), 2 * factor * pesos
+
+def restriccion_presupuesto():
+    """Σw = 1"""
+    return {'type': 'eq', 'fun': lambda x: np.sum(x) - 1, 'jac': lambda x: np.ones_like(x)}
+
+def restriccion_retorno_objetivo(media, objetivo):
+    """μᵀw = objetivo"""
+    return {'type': 'eq', 'fun': lambda x: media @ x - objetivo, 'jac': lambda x: media}
+
+def restriccion_l1(limite=1.0):
+    """Σ|w| <= limite"""
+    return {'type': 'ineq', 'fun': lambda x: limite - np.sum(np.abs(x)), 'jac': lambda x: -np.sign(x)}
+
+def restriccion_l2(limite=1.0):
+    """Σw² <= limite"""
+    return {'type': 'ineq', 'fun': lambda x: limite - np.sum(x**2), 'jac': lambda x: -2 * x}
+
+def restriccion_beta(betas, beta_objetivo):
+    """βᵀw = beta_objetivo"""
+    return {'type': 'eq', 'fun': lambda x: betas @ x - beta_objetivo, 'jac': lambda x: betas}
+
+# --- Solver QP de conjunto activo ---
+def resolver_qp(Q, A, b, lb, ub, libres, x0, c=None, max_iter=None):
+    """
+    Resuelve min ½xᵀQx + cᵀx  s.a.  A·x = b,  lb <= x <= ub  con un método primal
+    de conjunto activo.
+
+    Las cotas fijas forman el conjunto de trabajo; en cada iteración se resuelve el
+    sistema KKT reducido a las variables libres (restricciones de igualdad incluidas
+    de forma exacta) y se agrega la cota que bloquea el paso o se libera la de
+    multiplicador negativo. Arrancar desde un soporte chico (pocas variables libres)
+    hace que las iteraciones escalen con la cantidad de activos en la solución y no
+    con el universo.
+
+    Args:
+        Q (ndarray): Matriz n×n simétrica definida positiva
+        A (ndarray): Restricciones de igualdad m×n
+        b (ndarray): Lado derecho de las igualdades
+        lb, ub (ndarray): Cotas por variable (ub puede ser np.inf)
+        libres (array-like): Índices que arrancan fuera del conjunto de trabajo
+        x0 (ndarray): Punto factible; las variables no libres deben estar en una cota
+        c (ndarray, optional): Término lineal
+        max_iter (int, optional): Tope de iteraciones (por defecto 5n + 100)
+
+    Returns:
+        ndarray: Solución óptima
+
+    Raises:
+        RuntimeError: Si no converge dentro del tope de iteraciones
+    """
+    n = Q.shape[0]
+    m = A.shape[0]
+    c = np.zeros(n) if c is None else c
+    x = np.array(x0, dtype=float)
+    libre = np.zeros(n, dtype=bool)
+    libre[np.asarray(libres, dtype=int)] = True
+    # Variables fijas exactamente sobre la cota más cercana
+    en_superior = ~libre & (np.abs(x - ub) < np.abs(x - lb))
+    x[~libre] = np.where(en_superior[~libre], ub[~libre], lb[~libre])
+
+    escala = max(1.0, float(np.max(np.abs(np.diag(Q)))))
+    tolerancia = 1e-10 * escala
+    max_iter = max_iter or 5 * n + 100
+
+    for _ in range(max_iter):
+        F = np.flatnonzero(libre)
+        g = Q @ x + c
+        k = len(F)
+        A_F = A[:, F]
+        kkt = np.zeros((k + m, k + m))
+        kkt[:k, :k] = Q[np.ix_(F, F)]
+        kkt[:k, k:] = A_F.T
+        kkt[k:, :k] = A_F
+        rhs = np.concatenate([-g[F], np.zeros(m)])
+        try:
+            solucion = np.linalg.solve(kkt, rhs)
+        except np.linalg.LinAlgError:
+            solucion = np.linalg.lstsq(kkt, rhs, rcond=None)[0]
+        p = solucion[:k]
+        nu = solucion[k:]
+
+        if np.max(np.abs(p), initial=0.0) <= 1e-12 * max(1.0, float(np.max(np.abs(x)))):
+            # Punto estacionario en la cara actual: revisar multiplicadores de las cotas
+            fijas = np.flatnonzero(~libre)
+            if len(fijas) == 0:
+                return x
+            multiplicadores = g[fijas] + A[:, fijas].T @ nu
+            multiplicadores = np.where(en_superior[fijas], -multiplicadores, multiplicadores)
+            peor = int(np.argmin(multiplicadores))
+            if multiplicadores[peor] >= -tolerancia:
+                return x
+            libre[fijas[peor]] = True
+            en_superior[fijas[peor]] = False
+            continue
+
+        # Paso más largo que respeta las cotas de las variables libres
+        alfa = 1.0
+        bloqueante = -1
+        x_F = x[F]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            hacia_abajo = p < -1e-15
+            hacia_arriba = p > 1e-15
+            limites = np.full(k, np.inf)
+            limites[hacia_abajo] = (lb[F][hacia_abajo] - x_F[hacia_abajo]) / p[hacia_abajo]
+            limites[hacia_arriba] = (ub[F][hacia_arriba] - x_F[hacia_arriba]) / p[hacia_arriba]
+        if k:
+            j = int(np.argmin(limites))
+            if limites[j] < alfa:
+                alfa = max(float(limites[j]), 0.0)
+                bloqueante = j
+        x[F] = x_F + alfa * p
+        if bloqueante >= 0:
+            i = F[bloqueante]
+            libre[i] = False
+            en_superior[i] = p[bloqueante] > 0
+            x[i] = ub[i] if en_superior[i] else lb[i]
+
+    raise RuntimeError("El solver QP no convergió")
+
 # --- Enhanced Portfolio Management Classes ---
 class manager:
     def __init__(self, rics, notional, data):
@@ -2798,26 +3883,37 @@ class manager:
         
         return self.cov_matrix, self.mean_returns
 
-    def compute_portfolio(self, portfolio_type=None, target_return=None):
+    def compute_portfolio(self, portfolio_type=None, target_return=None, solver='qp'):
+        """
+        Optimiza el portafolio según portfolio_type.
+
+        solver='qp' resuelve los problemas de varianza (long-only, L1, Markowitz con
+        retorno objetivo y máximo Sharpe) con resolver_qp sobre las matrices ya
+        calculadas; solver='slsqp' fuerza scipy. Si el QP no aplica o falla se usa SLSQP.
+        """
         if self.cov_matrix is None:
             self.compute_covariance()
+
+        if solver == 'qp':
+            try:
+                weights = self._resolver_qp(portfolio_type, target_return)
+            except (RuntimeError, ValueError, np.linalg.LinAlgError):
+                weights = None
+            if weights is not None:
+                return self._create_output(weights)
             
         n_assets = len(self.rics)
         bounds = tuple((0, 1) for _ in range(n_assets))
+        cov = self.cov_matrix.to_numpy(dtype=float)
+        mu = self.mean_returns.to_numpy(dtype=float)
         
         if portfolio_type == 'min-variance-l1':
             # Minimizar varianza con restricción L1
-            constraints = [
-                {'type': 'eq', 'fun': lambda x: np.sum(x) - 1},
-                {'type': 'ineq', 'fun': lambda x: 1 - np.sum(np.abs(x))}
-            ]
+            constraints = [restriccion_presupuesto(), restriccion_l1()]
             
         elif portfolio_type == 'min-variance-l2':
             # Minimizar varianza con restricción L2
-            constraints = [
-                {'type': 'eq', 'fun': lambda x: np.sum(x) - 1},
-                {'type': 'ineq', 'fun': lambda x: 1 - np.sum(x**2)}
-            ]
+            constraints = [restriccion_presupuesto(), restriccion_l2()]
             
         elif portfolio_type == 'equi-weight':
             # Pesos iguales
@@ -2826,38 +3922,31 @@ class manager:
             
         elif portfolio_type == 'long-only':
             # Optimización long-only estándar
-            constraints = [{'type': 'eq', 'fun': lambda x: np.sum(x) - 1}]
+            constraints = [restriccion_presupuesto()]
             
         elif portfolio_type == 'markowitz':
             if target_return is not None:
                 # Optimización con retorno objetivo
-                constraints = [
-                    {'type': 'eq', 'fun': lambda x: np.sum(x) - 1},
-                    {'type': 'eq', 'fun': lambda x: np.sum(self.mean_returns * x) - target_return}
-                ]
+                constraints = [restriccion_presupuesto(), restriccion_retorno_objetivo(mu, target_return)]
             else:
                 # Maximizar Sharpe Ratio
-                constraints = [{'type': 'eq', 'fun': lambda x: np.sum(x) - 1}]
-                def neg_sharpe_ratio(weights):
-                    port_ret = np.sum(self.mean_returns * weights)
-                    port_vol = np.sqrt(portfolio_variance(weights, self.cov_matrix))
-                    if port_vol == 0:
-                        return np.inf
-                    return -(port_ret - self.risk_free_rate) / port_vol
-                
                 result = optimize.minimize(
-                    neg_sharpe_ratio, 
+                    sharpe_negativo_y_gradiente,
                     x0=np.ones(n_assets)/n_assets,
+                    args=(mu, cov, self.risk_free_rate, np.inf),
+                    jac=True,
                     method='SLSQP',
                     bounds=bounds,
-                    constraints=constraints
+                    constraints=[restriccion_presupuesto()]
                 )
                 return self._create_output(result.x)
         
         # Optimización general de varianza mínima
         result = optimize.minimize(
-            lambda x: portfolio_variance(x, self.cov_matrix),
+            varianza_y_gradiente,
             x0=np.ones(n_assets)/n_assets,
+            args=(cov,),
+            jac=True,
             method='SLSQP',
             bounds=bounds,
             constraints=constraints
@@ -2865,6 +3954,107 @@ class manager:
         
         return self._create_output(result.x)
 
+    def _resolver_qp(self, portfolio_type, target_return):
+        """Resuelve con resolver_qp los tipos que son QP convexos; None si no aplica"""
+        if portfolio_type not in ('min-variance-l1', 'long-only', 'markowitz'):
+            return None
+
+        Q, mu, varianzas = self._matrices_qp()
+        n = len(mu)
+        ceros = np.zeros(n)
+        unos = np.ones(n)
+
+        if portfolio_type == 'markowitz' and target_return is None:
+            # Máximo Sharpe long-only como QP: min yᵀΣy s.a. (μ - rf)ᵀy = 1, y >= 0;
+            # los pesos son y normalizado. Requiere algún activo por encima de rf.
+            exceso = mu - self.risk_free_rate
+            if exceso.max() <= 0:
+                return None
+            sharpe_individual = np.where(exceso > 0, exceso / np.sqrt(np.maximum(varianzas, 1e-18)), -np.inf)
+            k = int(np.argmax(sharpe_individual))
+            x0 = np.zeros(n)
+            x0[k] = 1 / exceso[k]
+            y = resolver_qp(Q, exceso[None, :], np.array([1.0]), ceros, np.full(n, np.inf), [k], x0)
+            return y / y.sum()
+
+        if portfolio_type == 'markowitz':
+            # Retorno objetivo: arrancar de la combinación de dos activos de menor
+            # varianza que encierran el objetivo (punto factible de soporte mínimo)
+            debajo = np.flatnonzero(mu <= target_return)
+            encima = np.flatnonzero(mu >= target_return)
+            if len(debajo) == 0 or len(encima) == 0:
+                raise ValueError("Retorno objetivo fuera del rango de los activos")
+            a = debajo[np.argmin(varianzas[debajo])]
+            c = encima[np.argmin(varianzas[encima])]
+            t = (target_return - mu[a]) / (mu[c] - mu[a]) if mu[c] != mu[a] else 0.0
+            x0 = np.zeros(n)
+            x0[a] += 1 - t
+            x0[c] += t
+            libres = [a, c] if a != c else [a] + [int(i) for i in np.argsort(varianzas) if i != a][:1]
+            A = np.vstack([unos, mu])
+            return resolver_qp(Q, A, np.array([1.0, target_return]), ceros, unos, libres, x0)
+
+        # Varianza mínima long-only (la restricción L1 es redundante con pesos en [0, 1])
+        k = int(np.argmin(varianzas))
+        x0 = np.zeros(n)
+        x0[k] = 1.0
+        return resolver_qp(Q, unos[None, :], np.array([1.0]), ceros, unos, [k], x0)
+
+    def _matrices_qp(self):
+        """Devuelve (Q, mu, varianzas) como arrays para resolver_qp"""
+        cov = self.cov_matrix.to_numpy(dtype=float)
+        mu = self.mean_returns.to_numpy(dtype=float)
+        varianzas = np.diag(cov)
+        # Regularización mínima: con más activos que observaciones Σ es singular
+        Q = cov + 1e-10 * max(float(varianzas.mean()), 1e-12) * np.eye(len(mu))
+        return Q, mu, varianzas
+
+    def compute_frontier_weights(self, target_returns):
+        """
+        Pesos de Markowitz para cada retorno objetivo (fila NaN si no hay solución).
+
+        Recorre los objetivos en orden creciente y arranca cada QP desde la solución
+        anterior desplazada hacia el activo de mayor retorno: el punto sigue siendo
+        factible y el conjunto activo cambia poco entre objetivos vecinos, así que
+        cada punto extra cuesta unas pocas iteraciones en lugar de una resolución en frío.
+        """
+        if self.cov_matrix is None:
+            self.compute_covariance()
+
+        Q, mu, _ = self._matrices_qp()
+        n = len(mu)
+        objetivos = np.asarray(target_returns, dtype=float)
+        pesos = np.full((len(objetivos), n), np.nan)
+        A = np.vstack([np.ones(n), mu])
+        ceros = np.zeros(n)
+        unos = np.ones(n)
+        mejor = int(np.argmax(mu))
+        previo = None
+        retorno_previo = None
+
+        for i in np.argsort(objetivos):
+            objetivo = objetivos[i]
+            x = None
+            if previo is not None and retorno_previo <= objetivo <= mu[mejor] and mu[mejor] > retorno_previo:
+                t = (objetivo - retorno_previo) / (mu[mejor] - retorno_previo)
+                x0 = (1 - t) * previo
+                x0[mejor] += t
+                libres = np.union1d(np.flatnonzero(previo > 0), [mejor])
+                try:
+                    x = resolver_qp(Q, A, np.array([1.0, objetivo]), ceros, unos, libres, x0)
+                except (RuntimeError, np.linalg.LinAlgError):
+                    x = None
+            if x is None:
+                try:
+                    x = self._resolver_qp('markowitz', objetivo)
+                except (RuntimeError, ValueError, np.linalg.LinAlgError):
+                    previo = None
+                    continue
+            pesos[i] = x
+            previo, retorno_previo = x, objetivo
+
+        return pesos
+
     def _create_output(self, weights):
         """Crea un objeto output con los pesos optimizados"""
         port_ret = np.sum(self.mean_returns * weights)
@@ -2969,8 +4159,8 @@ class output:
         
         return fig
 
-def compute_efficient_frontier(rics, notional, target_return, include_min_variance, data):
-    """Computa la frontera eficiente y portafolios especiales"""
+def compute_efficient_frontier(rics, notional, target_return, include_min_variance, data, num_puntos=50):
+    """Computa la frontera eficiente (num_puntos objetivos) y portafolios especiales"""
     # special portfolios    
     label1 = 'min-variance-l1'
     label2 = 'min-variance-l2'
@@ -2986,28 +4176,33 @@ def compute_efficient_frontier(rics, notional, target_return, include_min_varian
     # compute vectors of returns and volatilities for Markowitz portfolios
     min_returns = np.min(port_mgr.mean_returns)
     max_returns = np.max(port_mgr.mean_returns)
-    returns = min_returns + np.linspace(0.05, 0.95, 50) * (max_returns - min_returns)
-    volatilities = []
-    valid_returns = []
+    returns = min_returns + np.linspace(0.05, 0.95, num_puntos) * (max_returns - min_returns)
     
-    for ret in returns:
+    # Barrido con arranque en caliente; los puntos sin solución QP se reintentan con SLSQP
+    pesos = port_mgr.compute_frontier_weights(returns)
+    for i in np.flatnonzero(np.isnan(pesos).any(axis=1)):
         try:
-            port = port_mgr.compute_portfolio('markowitz', ret)
-            volatilities.append(port.volatility_annual)
-            valid_returns.append(ret)
-        except:
+            pesos[i] = port_mgr.compute_portfolio('markowitz', returns[i], solver='slsqp').weights
+        except Exception:
             continue
+    validos = ~np.isnan(pesos).any(axis=1)
+    
+    # Misma volatilidad que output.volatility_annual, para todos los puntos a la vez
+    # (pandas omite los días con NaN en algún activo, como np.std sobre la Serie)
+    retornos_puntos = port_mgr.returns.dot(pesos[validos].T)
+    volatilities = list(retornos_puntos.std(ddof=0).to_numpy() * np.sqrt(252))
+    valid_returns = list(returns[validos])
     
     # compute special portfolios
     portfolios = {}
     try:
         portfolios[label1] = port_mgr.compute_portfolio(label1)
-    except:
+    except Exception:
         portfolios[label1] = None
         
     try:
         portfolios[label2] = port_mgr.compute_portfolio(label2)
-    except:
+    except Exception:
         portfolios[label2] = None
         
     portfolios[label3] = port_mgr.compute_portfolio(label3)
@@ -3016,7 +4211,7 @@ def compute_efficient_frontier(rics, notional, target_return, include_min_varian
     
     try:
         portfolios[label6] = port_mgr.compute_portfolio('markowitz', target_return)
-    except:
+    except Exception:
         portfolios[label6] = None
     
     return portfolios, valid_returns, volatilities
@@ -3069,6 +4264,35 @@ def calculate_portfolio_metrics(returns, weights):
         st.error(f"❌ Error en cálculo de métricas: {str(e)}")
         return 0.0, 0.0, 0.0
 
+class MomentosRetornos:
+    """
+    Media y covarianza anualizadas de una matriz de retornos diarios, calculadas una
+    sola vez como ndarrays para que las funciones objetivo no toquen el DataFrame.
+    """
+
+    def __init__(self, returns, periodos=252):
+        self.activos = list(returns.columns)
+        self.media = returns.mean().to_numpy(dtype=float) * periodos
+        self.covarianza = returns.cov().to_numpy(dtype=float) * periodos
+
+    def retorno(self, pesos):
+        return float(self.media @ pesos)
+
+    def volatilidad(self, pesos):
+        return float(np.sqrt(pesos @ self.covarianza @ pesos))
+
+    def sharpe(self, pesos, tasa_libre_riesgo=0.0):
+        volatilidad = self.volatilidad(pesos)
+        if volatilidad == 0 or not np.isfinite(volatilidad):
+            return -np.inf
+        return (self.retorno(pesos) - tasa_libre_riesgo) / volatilidad
+
+    def sharpe_negativo(self, pesos, tasa_libre_riesgo=0.0):
+        """
+        -Sharpe y su gradiente analítico, para optimize.minimize(..., jac=True)
+        """
+        return sharpe_negativo_y_gradiente(pesos, self.media, self.covarianza, tasa_libre_riesgo)
+
 def optimize_portfolio(returns, risk_free_rate=0.0, target_return=None):
     """
     Optimiza un portafolio usando teoría moderna de portafolio con validaciones mejoradas
@@ -3092,61 +4316,49 @@ def optimize_portfolio(returns, risk_free_rate=0.0, target_return=None):
                 st.error("❌ No quedan datos válidos después de limpiar")
                 return None
         
-        # Función objetivo para maximizar el ratio de Sharpe
-        def negative_sharpe(weights):
-            try:
-                portfolio_return = np.sum(returns.mean() * weights) * 252
-                cov_matrix = returns.cov() * 252
-                portfolio_std = np.sqrt(np.dot(weights.T, np.dot(cov_matrix, weights)))
-                
-                if portfolio_std == 0 or np.isnan(portfolio_std) or np.isinf(portfolio_std):
-                    return 1e6  # Penalización alta
-                
-                sharpe_ratio = (portfolio_return - risk_free_rate) / portfolio_std
-                return -sharpe_ratio
-            except Exception:
-                return 1e6  # Penalización alta en caso de error
+        # Media y covarianza una sola vez; el objetivo devuelve también su gradiente
+        momentos = MomentosRetornos(returns)
         
         # Restricciones
-        constraints = ({'type': 'eq', 'fun': lambda x: np.sum(x) - 1})
+        constraints = restriccion_presupuesto()
         bounds = tuple((0, 1) for _ in range(n_assets))
         
-        # Pesos iniciales igualmente distribuidos
-        initial_guess = n_assets * [1. / n_assets]
-        
-        # Optimización con múltiples intentos
-        best_result = None
-        best_sharpe = -np.inf
+        # Pesos iniciales: igualmente distribuidos y dos arranques aleatorios
+        puntos_iniciales = [np.full(n_assets, 1. / n_assets)]
+        puntos_iniciales += [np.random.dirichlet(np.ones(n_assets)) for _ in range(2)]
         
-        for attempt in range(3):  # Intentar 3 veces con diferentes puntos iniciales
+        def intentar(attempt, initial_guess):
             try:
-                if attempt > 0:
-                    # Usar pesos aleatorios para intentos adicionales
-                    random_weights = np.random.dirichlet(np.ones(n_assets))
-                    initial_guess = random_weights
-                
-                result = optimize.minimize(negative_sharpe, initial_guess, method='SLSQP',
-                                         bounds=bounds, constraints=constraints,
-                                         options={'maxiter': 1000})
-                
-                if result.success:
-                    # Validar resultado
-                    weights = result.x
-                    if np.all(weights >= 0) and abs(np.sum(weights) - 1.0) < 0.01:
-                        # Calcular Sharpe del resultado
-                        portfolio_return = np.sum(returns.mean() * weights) * 252
-                        cov_matrix = returns.cov() * 252
-                        portfolio_std = np.sqrt(np.dot(weights.T, np.dot(cov_matrix, weights)))
-                        
-                        if portfolio_std > 0:
-                            sharpe = (portfolio_return - risk_free_rate) / portfolio_std
-                            if sharpe > best_sharpe:
-                                best_result = weights
-                                best_sharpe = sharpe
-                
+                result = optimize.minimize(momentos.sharpe_negativo, initial_guess, args=(risk_free_rate,),
+                                           jac=True, method='SLSQP', bounds=bounds,
+                                           constraints=constraints, options={'maxiter': 1000})
             except Exception as e:
                 st.warning(f"⚠️ Intento {attempt + 1} falló: {str(e)}")
+                return None
+            if not result.success:
+                return None
+            # Validar resultado
+            weights = result.x
+            if np.all(weights >= 0) and abs(np.sum(weights) - 1.0) < 0.01:
+                return weights
+            return None
+        
+        # Optimización con múltiples intentos en paralelo
+        resultados, _ = ejecutar_concurrentemente({
+            attempt: (lambda attempt=attempt, x0=x0: intentar(attempt, x0))
+            for attempt, x0 in enumerate(puntos_iniciales)
+        })
+        
+        best_result = None
+        best_sharpe = -np.inf
+        for attempt in range(len(puntos_iniciales)):
+            weights = resultados[attempt]
+            if weights is None:
                 continue
+            sharpe = momentos.sharpe(weights, risk_free_rate)
+            if sharpe > best_sharpe:
+                best_result = weights
+                best_sharpe = sharpe
         
         if best_result is not None:
             return best_result
@@ -3926,7 +5138,10 @@ class Coberturista:
     
     def calcular_pesos_cobertura(self, regularizacion=0.1):
         """
-        Calcula pesos óptimos de cobertura usando optimización
+        Calcula pesos óptimos de cobertura: min wᵀ(Σ + λI)w  s.a.  βᵀw = -β_posición, Σw = 1.
+
+        Sin cotas activas el óptimo sale de resolver el sistema KKT; solo si algún peso
+        queda fuera de ±2 se recurre a SLSQP con gradiente, arrancando de esa solución.
         """
         if not self.betas_cobertura or len(self.betas_cobertura) != len(self.hedge_securities):
             st.error("Debe calcular betas antes de calcular pesos de cobertura")
@@ -3934,45 +5149,56 @@ class Coberturista:
         
         try:
             n_hedge = len(self.hedge_securities)
+            limite = 2  # Permitir posiciones cortas
+            
+            # Covarianza de los activos de cobertura; los que no tienen datos no aportan varianza
+            cov_cobertura = (self.cov_matrix
+                             .reindex(index=self.hedge_securities, columns=self.hedge_securities)
+                             .fillna(0.0)
+                             .to_numpy(dtype=float))
+            betas = np.asarray(self.betas_cobertura, dtype=float)
+            
+            # Restricciones: beta de cobertura = -beta de posición y suma de pesos = 1
+            A = np.vstack([betas, np.ones(n_hedge)])
+            b = np.array([-self.beta_posicion_ars, 1.0])
+            
+            # Solución cerrada: [2(Σ + λI)  Aᵀ; A  0]·[w; ν] = [0; b]
+            kkt = np.zeros((n_hedge + 2, n_hedge + 2))
+            kkt[:n_hedge, :n_hedge] = 2 * (cov_cobertura + regularizacion * np.eye(n_hedge))
+            kkt[:n_hedge, n_hedge:] = A.T
+            kkt[n_hedge:, :n_hedge] = A
+            try:
+                pesos = np.linalg.solve(kkt, np.concatenate([np.zeros(n_hedge), b]))[:n_hedge]
+            except np.linalg.LinAlgError:
+                pesos = None
             
-            # Función objetivo: minimizar varianza de la cobertura
+            if (pesos is not None and np.all(np.isfinite(pesos))
+                    and np.all(np.abs(pesos) <= limite) and np.allclose(A @ pesos, b)):
+                self.pesos_cobertura = pesos
+                self._calcular_metricas_cobertura()
+                return True
+            
+            # Cotas activas (o sistema singular): SLSQP con gradiente analítico
             def objective(weights):
-                # Varianza del portafolio de cobertura
-                hedge_variance = 0
-                for i in range(n_hedge):
-                    for j in range(n_hedge):
-                        if (self.hedge_securities[i] in self.returns.columns and 
-                            self.hedge_securities[j] in self.returns.columns):
-                            hedge_variance += (weights[i] * weights[j] * 
-                                            self.cov_matrix.loc[self.hedge_securities[i], 
-                                                              self.hedge_securities[j]])
-                
-                # Penalización por regularización
-                regularization_penalty = regularizacion * np.sum(weights**2)
-                
-                return hedge_variance + regularization_penalty
-            
-            # Restricciones: beta de cobertura = -beta de posición
-            def constraint_beta(weights):
-                hedge_beta = np.sum(np.array(weights) * np.array(self.betas_cobertura))
-                return hedge_beta + self.beta_posicion_ars
-            
-            # Restricción: suma de pesos = 1
-            def constraint_sum(weights):
-                return np.sum(weights) - 1
-            
-            # Optimización
-            initial_weights = np.ones(n_hedge) / n_hedge
-            bounds = [(-2, 2) for _ in range(n_hedge)]  # Permitir posiciones cortas
+                varianza, gradiente_varianza = varianza_y_gradiente(weights, cov_cobertura)
+                penalizacion, gradiente_penalizacion = penalizacion_l2_y_gradiente(weights, regularizacion)
+                return varianza + penalizacion, gradiente_varianza + gradiente_penalizacion
+            
+            if pesos is not None and np.all(np.isfinite(pesos)):
+                initial_weights = np.clip(pesos, -limite, limite)
+            else:
+                initial_weights = np.ones(n_hedge) / n_hedge
+            bounds = [(-limite, limite) for _ in range(n_hedge)]
             
             constraints = [
-                {'type': 'eq', 'fun': constraint_beta},
-                {'type': 'eq', 'fun': constraint_sum}
+                restriccion_beta(betas, -self.beta_posicion_ars),
+                restriccion_presupuesto()
             ]
             
             result = optimize.minimize(
                 objective, 
                 initial_weights,
+                jac=True,
                 method='SLSQP',
                 bounds=bounds,
                 constraints=constraints
@@ -4723,7 +5949,7 @@ def mostrar_resumen_portafolio(portafolio, token_portador, portfolio_id="", id_c
             if valuacion == 0:
                 ultimo_precio = None
                 if mercado := titulo.get('mercado'):
-                    ultimo_precio = obtener_precio_actual(token_portador, mercado, simbolo)
+                    ultimo_precio = obtener_precio_actual(token_portador, mercado, simbolo, tipo)
                 if ultimo_precio:
                     try:
                         cantidad_num = float(cantidad)
@@ -5168,21 +6394,34 @@ def mostrar_resumen_portafolio(portafolio, token_portador, portfolio_id="", id_c
                 if len(simbolos_validos) > 0:
                     # Crear manager para obtener datos históricos con cache
                     @st.cache_data(ttl=600)  # Cache por 10 minutos
-                    def cargar_datos_historicos_resumen(symbols, token, fecha_desde, fecha_hasta):
-                        """Cachea los datos históricos para el resumen"""
-                        manager_inst = PortfolioManager(symbols, token, fecha_desde, fecha_hasta)
-                        if manager_inst.load_data():
-                            return manager_inst
-                        return None
+                    def cargar_datos_historicos_resumen(symbols, fecha_desde, fecha_hasta, _token):
+                        """
+                        Cachea precios y retornos para el resumen (sin el token en la clave).
+                        Sólo se cachean los DataFrames: el token no debe quedar en la entrada compartida.
+                        """
+                        df_precios, returns, _ = get_historical_data_for_optimization(
+                            _token, symbols, fecha_desde, fecha_hasta
+                        )
+                        if returns is None or returns.empty or df_precios is None:
+                            raise DescargaMercadoFallida("datos históricos del resumen")
+                        return df_precios, returns
                     
                     # Usar fechas de la sesión
                     fecha_desde = st.session_state.get('fecha_desde', date.today() - timedelta(days=365))
                     fecha_hasta = st.session_state.get('fecha_hasta', date.today())
                     
                     with st.spinner("📊 Cargando datos históricos..."):
-                        manager_inst = cargar_datos_historicos_resumen(
-                            simbolos_validos, token_portador, fecha_desde, fecha_hasta
-                        )
+                        try:
+                            df_precios, returns = cargar_datos_historicos_resumen(
+                                simbolos_validos, fecha_desde, fecha_hasta, token_portador
+                            )
+                            manager_inst = PortfolioManager(simbolos_validos, token_portador, fecha_desde, fecha_hasta)
+                            manager_inst.set_data(df_precios, returns)
+                        except DescargaMercadoFallida:
+                            manager_inst = None
+                        except Exception as e:
+                            st.error(f"Error cargando datos: {str(e)}")
+                            manager_inst = None
                     
                     if manager_inst and manager_inst.returns is not None:
                         st.success(f"✅ Datos históricos cargados para {len(simbolos_validos)} activos")
@@ -5465,7 +6704,7 @@ def obtener_parametros_operatoria_mep(token_acceso):
     
     try:
         st.info(f"🔗 Consultando parámetros MEP desde: {url}")
-        response = requests.get(url, headers=headers)
+        response = obtener_cliente_iol().get(url, headers=headers)
         
         if response.status_code == 200:
             datos = response.json()
@@ -5543,7 +6782,7 @@ def obtener_estimacion_compra_mep(token_acceso, monto):
     }
     
     try:
-        response = requests.get(url, headers=headers)
+        response = obtener_cliente_iol().get(url, headers=headers)
         
         if response.status_code == 200:
             return response.json()
@@ -5574,7 +6813,7 @@ def obtener_estimacion_venta_mep(token_acceso, monto):
     }
     
     try:
-        response = requests.get(url, headers=headers)
+        response = obtener_cliente_iol().get(url, headers=headers)
         
         if response.status_code == 200:
             return response.json()
@@ -5613,7 +6852,7 @@ def ejecutar_compra_mep(token_acceso, monto):
     }
     
     try:
-        response = requests.post(url, headers=headers, json=data)
+        response = obtener_cliente_iol().post(url, headers=headers, json=data)
         
         if response.status_code == 200:
             return response.json()
@@ -5653,7 +6892,7 @@ def ejecutar_venta_mep(token_acceso, monto):
     }
     
     try:
-        response = requests.post(url, headers=headers, json=data)
+        response = obtener_cliente_iol().post(url, headers=headers, json=data)
         
         if response.status_code == 200:
             return response.json()
@@ -5698,34 +6937,10 @@ def obtener_historico_mep(token_acceso, fecha_desde, fecha_hasta):
             
             if serie_historica and len(serie_historica) > 0:
                 # Procesar los datos de la serie histórica
-                precios = []
-                fechas = []
-                
-                for item in serie_historica:
-                    try:
-                        precio = item.get('ultimoPrecio')
-                        if not precio or precio == 0:
-                            precio = item.get('cierreAnterior') or item.get('precioPromedio') or item.get('apertura')
-                        
-                        fecha_str = item.get('fechaHora') or item.get('fecha')
-                        
-                        if precio is not None and precio > 0 and fecha_str:
-                            fecha_parsed = parse_datetime_flexible(fecha_str)
-                            if fecha_parsed is not None:
-                                precios.append(precio)
-                                fechas.append(fecha_parsed)
-                                
-                    except Exception as e:
-                        continue
+                df = parsear_serie_historica(serie_historica)
                 
-                if len(precios) > 0:
-                    # Crear DataFrame con los datos
-                    df = pd.DataFrame({
-                        'fecha': fechas,
-                        'precio': precios
-                    })
-                    df['fecha'] = pd.to_datetime(df['fecha']).dt.tz_localize(None)
-                    df = df.sort_values('fecha')
+                if df is not None:
+                    df['fecha'] = df['fecha'].dt.tz_localize(None)
                     datos_series[simbolo] = df
                     st.success(f"✅ {simbolo}: {len(df)} puntos de datos")
                 else:
@@ -6295,15 +7510,7 @@ class PortfolioManager:
             )
             
             if returns is not None and not returns.empty and df_precios is not None:
-                self.returns = returns
-                self.prices = df_precios
-                self.mean_returns = returns.mean() * 252  # Anualizar
-                self.cov_matrix = returns.cov() * 252     # Anualizar
-                self.data_loaded = True
-                
-                # Crear manager para optimización avanzada
-                self.manager = manager(list(df_precios.columns), self.notional, df_precios.to_dict('series'))
-                
+                self.set_data(df_precios, returns)
                 return True
             else:
                 return False
@@ -6312,6 +7519,19 @@ class PortfolioManager:
             st.error(f"Error cargando datos: {str(e)}")
             return False
     
+    def set_data(self, df_precios, returns):
+        """
+        Usa precios y retornos ya descargados (por ejemplo, desde la cache compartida)
+        """
+        self.returns = returns
+        self.prices = df_precios
+        self.mean_returns = returns.mean() * 252  # Anualizar
+        self.cov_matrix = returns.cov() * 252     # Anualizar
+        self.data_loaded = True
+        
+        # Crear manager para optimización avanzada
+        self.manager = manager(list(df_precios.columns), self.notional, df_precios.to_dict('series'))
+    
     def load_data_with_real_metrics(self, portafolio):
         """
         Carga datos usando métricas reales basadas en operaciones del portafolio
@@ -6491,25 +7711,17 @@ class PortfolioManager:
         """
         try:
             # Calcular matriz de covarianza
-            cov_matrix = self.returns.cov()
-            
-            # Función objetivo: minimizar varianza del portafolio
-            def objective(weights):
-                return np.dot(weights.T, np.dot(cov_matrix, weights))
+            cov_matrix = self.returns.cov().to_numpy(dtype=float)
             
-            # Restricciones: pesos suman 1
-            def constraint(weights):
-                return np.sum(weights) - 1.0
-            
-            # Optimización
+            # Optimización: varianza del portafolio con pesos que suman 1
             n_assets = len(self.returns.columns)
             initial_weights = np.array([1/n_assets] * n_assets)
             
-            constraints = {'type': 'eq', 'fun': constraint}
+            constraints = restriccion_presupuesto()
             bounds = [(0, 1) for _ in range(n_assets)]
             
-            result = optimize.minimize(objective, initial_weights, 
-                                    constraints=constraints, bounds=bounds)
+            result = optimize.minimize(varianza_y_gradiente, initial_weights, args=(cov_matrix,),
+                                    jac=True, constraints=constraints, bounds=bounds)
             
             if result.success:
                 return result.x
@@ -6527,36 +7739,22 @@ class PortfolioManager:
         """
         try:
             # Calcular retornos esperados y matriz de covarianza
-            expected_returns = self.returns.mean()
-            cov_matrix = self.returns.cov()
+            expected_returns = self.returns.mean().to_numpy(dtype=float)
+            cov_matrix = self.returns.cov().to_numpy(dtype=float)
             
             # Usar la tasa libre de riesgo configurada en la instancia
             risk_free_rate = self.risk_free_rate
             
-            # Función objetivo: maximizar ratio de Sharpe (minimizar negativo)
-            def objective(weights):
-                portfolio_return = np.sum(expected_returns * weights)
-                portfolio_volatility = np.sqrt(np.dot(weights.T, np.dot(cov_matrix, weights)))
-                
-                if portfolio_volatility == 0:
-                    return 0
-                
-                sharpe_ratio = (portfolio_return - risk_free_rate) / portfolio_volatility
-                return -sharpe_ratio  # Minimizar negativo = maximizar positivo
-            
-            # Restricciones: pesos suman 1
-            def constraint(weights):
-                return np.sum(weights) - 1.0
-            
-            # Optimización
+            # Optimización: maximizar ratio de Sharpe (minimizar negativo) con pesos que suman 1
             n_assets = len(self.returns.columns)
             initial_weights = np.array([1/n_assets] * n_assets)
             
-            constraints = {'type': 'eq', 'fun': constraint}
+            constraints = restriccion_presupuesto()
             bounds = [(0, 1) for _ in range(n_assets)]
             
-            result = optimize.minimize(objective, initial_weights, 
-                                    constraints=constraints, bounds=bounds)
+            result = optimize.minimize(sharpe_negativo_y_gradiente, initial_weights,
+                                    args=(expected_returns, cov_matrix, risk_free_rate, 0),
+                                    jac=True, constraints=constraints, bounds=bounds)
             
             if result.success:
                 return result.x
@@ -6568,7 +7766,7 @@ class PortfolioManager:
             st.error(f"Error en optimización de Sharpe ratio: {str(e)}")
             return np.array([1/len(self.returns.columns)] * len(self.returns.columns))
 
-    def compute_efficient_frontier(self, target_return=0.08, include_min_variance=True):
+    def compute_efficient_frontier(self, target_return=0.08, include_min_variance=True, num_puntos=50):
         """
         Computa la frontera eficiente
         """
@@ -6578,7 +7776,7 @@ class PortfolioManager:
         try:
             portfolios, returns, volatilities = compute_efficient_frontier(
                 self.symbols, self.notional, target_return, include_min_variance, 
-                self.prices.to_dict('series')
+                self.prices.to_dict('series'), num_puntos=num_puntos
             )
             return portfolios, returns, volatilities
         except Exception as e:
@@ -7969,25 +9167,18 @@ def obtener_cotizaciones_generico(instrumento, pais, bearer_token):
     Obtiene cotizaciones de cualquier instrumento usando la API de InvertirOnline
     """
     try:
-        url = f"https://api.invertironline.com/api/v2/Cotizaciones/{instrumento}/{pais}/Todos"
-        headers = {
-            'Accept': 'application/json',
-            'Authorization': f'Bearer {bearer_token}'
-        }
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            cotizaciones = response.json()
-            if cotizaciones and 'titulos' in cotizaciones:
-                # Convertir los datos a un DataFrame de pandas
-                df = pd.DataFrame(cotizaciones['titulos'])
-                return df
-            else:
-                st.warning(f"⚠️ No se encontraron datos de {instrumento} en la respuesta")
-                return None
+        # El panel completo se sirve desde la instantánea compartida de cotizaciones
+        titulos = obtener_instantanea_cotizaciones().titulos(instrumento, pais, bearer_token)
+        if titulos:
+            # Convertir los datos a un DataFrame de pandas
+            df = pd.DataFrame(titulos)
+            return df
         else:
-            st.error(f"❌ Error en la solicitud de {instrumento}: {response.status_code}")
-            st.error(response.text)
+            st.warning(f"⚠️ No se encontraron datos de {instrumento} en la respuesta")
             return None
+    except requests.HTTPError as e:
+        st.error(f"❌ Error en la solicitud de {instrumento}: {str(e)}")
+        return None
     except Exception as e:
         st.error(f"❌ Error obteniendo cotizaciones de {instrumento}: {str(e)}")
         return None
@@ -8838,7 +10029,7 @@ def calcular_frontera_interactiva(manager_inst, calcular_todos=True, incluir_act
     try:
         # Calcular frontera eficiente
         portfolios, returns, volatilities = manager_inst.compute_efficient_frontier(
-            target_return=target_return, include_min_variance=True
+            target_return=target_return, include_min_variance=True, num_puntos=num_puntos
         )
         
         if not (portfolios and returns and volatilities):
@@ -9097,6 +10288,207 @@ def filtrar_operaciones_relevantes(operaciones, portafolio=None, mostrar_estadis
         
         return operaciones_filtradas
 
+# --- Libro local de operaciones ---
+# Días ya sincronizados que se vuelven a pedir, para captar cambios de estado tardíos
+SOLAPAMIENTO_OPERACIONES_DIAS = 7
+# Segundos durante los cuales una sincronización reciente con el mismo token no se repite
+TTL_SINCRONIZACION_OPERACIONES = 60
+
+# Campos con los que la API identifica la cuenta de una operación
+CAMPOS_CUENTA_OPERACION = ('cuentaComitente', 'numeroCliente')
+
+class LibroOperaciones:
+    """
+    Libro persistente (SQLite) de las operaciones de cada cuenta comitente.
+
+    Guarda las operaciones por número junto con el rango de fechas sincronizado y una
+    marca de agua (hasta dónde se sincronizó). Cada consulta sólo pide a la API las
+    operaciones posteriores a la marca, con un solapamiento para los cambios de estado
+    tardíos, más las fechas anteriores al rango si se pide un período más largo.
+    El historial completo se sirve localmente.
+
+    Todo se guarda por (usuario, cuenta, pais): lo que sincronizó un usuario sólo se
+    sirve a sesiones del mismo usuario, y se descartan las operaciones que informan
+    una cuenta distinta de la pedida.
+    """
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self.en_curso = SolicitudesEnCurso()  # Sincronizaciones en curso por cuenta
+        self.verificadas = {}  # (token, usuario, cuenta, pais) -> instante de la última sincronización
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with self._conectar() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            columnas = {fila[1] for fila in conn.execute('PRAGMA table_info(sincronizacion)')}
+            if columnas and 'usuario' not in columnas:
+                # Libros anteriores sin usuario: no se puede saber a quién pertenecen
+                conn.execute('DROP TABLE IF EXISTS operaciones')
+                conn.execute('DROP TABLE sincronizacion')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS operaciones (
+                    usuario TEXT, cuenta TEXT, pais TEXT, clave TEXT, fecha TEXT, item TEXT,
+                    PRIMARY KEY (usuario, cuenta, pais, clave)
+                )""")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sincronizacion (
+                    usuario TEXT, cuenta TEXT, pais TEXT, desde TEXT, marca TEXT,
+                    PRIMARY KEY (usuario, cuenta, pais)
+                )""")
+
+    def _conectar(self):
+        return sqlite3.connect(self.ruta, timeout=30)
+
+    def estado(self, usuario, cuenta, pais):
+        """Devuelve (desde, marca) sincronizado para la cuenta o None"""
+        with self._conectar() as conn:
+            fila = conn.execute(
+                'SELECT desde, marca FROM sincronizacion WHERE usuario=? AND cuenta=? AND pais=?',
+                (usuario, cuenta, pais)
+            ).fetchone()
+        return (_a_fecha(fila[0]), _a_fecha(fila[1])) if fila else None
+
+    def tramos_a_sincronizar(self, usuario, cuenta, pais, desde, hoy):
+        """Lista de (desde, hasta) a pedir a la API: fechas previas al rango y lo posterior a la marca"""
+        estado = self.estado(usuario, cuenta, pais)
+        if estado is None:
+            return [(desde, hoy)]
+        tramos = []
+        if desde < estado[0]:
+            tramos.append((desde, estado[0] - timedelta(days=1)))
+        tramos.append((max(estado[0], estado[1] - timedelta(days=SOLAPAMIENTO_OPERACIONES_DIAS)), hoy))
+        return tramos
+
+    @staticmethod
+    def es_de_cuenta(operacion, cuenta):
+        """False si la operación informa una cuenta distinta de `cuenta`"""
+        for campo in CAMPOS_CUENTA_OPERACION:
+            if operacion.get(campo) is not None:
+                return str(operacion[campo]) == cuenta
+        return True
+
+    def guardar(self, usuario, cuenta, pais, desde, hasta, operaciones):
+        """Inserta o actualiza las operaciones (por número) y extiende el rango sincronizado"""
+        filas = []
+        for operacion in operaciones:
+            if not self.es_de_cuenta(operacion, cuenta):
+                continue
+            fecha = str(operacion.get('fechaOrden') or operacion.get('fechaOperada') or '')
+            if operacion.get('numero') is not None:
+                clave = str(operacion['numero'])
+            else:
+                clave = json.dumps(operacion, sort_keys=True)
+            filas.append((usuario, cuenta, pais, clave, fecha, json.dumps(operacion)))
+        with self._lock, self._conectar() as conn:
+            conn.executemany('INSERT OR REPLACE INTO operaciones VALUES (?, ?, ?, ?, ?, ?)', filas)
+            fila = conn.execute(
+                'SELECT desde, marca FROM sincronizacion WHERE usuario=? AND cuenta=? AND pais=?',
+                (usuario, cuenta, pais)
+            ).fetchone()
+            if fila:
+                desde, hasta = min(desde, _a_fecha(fila[0])), max(hasta, _a_fecha(fila[1]))
+            conn.execute(
+                'INSERT OR REPLACE INTO sincronizacion VALUES (?, ?, ?, ?, ?)',
+                (usuario, cuenta, pais, desde.isoformat(), hasta.isoformat())
+            )
+
+    def leer(self, usuario, cuenta, pais, desde, hasta):
+        """Devuelve las operaciones del rango, de la más reciente a la más antigua (como la API)"""
+        with self._conectar() as conn:
+            filas = conn.execute(
+                """SELECT item FROM operaciones
+                   WHERE usuario=? AND cuenta=? AND pais=? AND substr(fecha, 1, 10) BETWEEN ? AND ?
+                   ORDER BY fecha DESC, clave DESC""",
+                (usuario, cuenta, pais, desde.isoformat(), hasta.isoformat())
+            ).fetchall()
+        operaciones = [json.loads(fila[0]) for fila in filas]
+        return [operacion for operacion in operaciones if self.es_de_cuenta(operacion, cuenta)]
+
+    def sincronizar(self, token, usuario, cuenta, pais, desde, descargar):
+        """
+        Trae de la API lo que falta del rango que empieza en `desde`.
+        Con el mismo token y sin fechas previas que completar, no repite una
+        sincronización de hace menos de TTL_SINCRONIZACION_OPERACIONES segundos.
+
+        Args:
+            descargar (callable): descargar(desde_str, hasta_str) -> lista de operaciones;
+                lanza requests.HTTPError si la API responde con error
+        """
+        hoy = date.today()
+        estado = self.estado(usuario, cuenta, pais)
+        reciente = time.monotonic() - self.verificadas.get((token, usuario, cuenta, pais), float('-inf'))
+        if estado is not None and desde >= estado[0] and reciente < TTL_SINCRONIZACION_OPERACIONES:
+            return
+        for tramo_desde, tramo_hasta in self.tramos_a_sincronizar(usuario, cuenta, pais, desde, hoy):
+            operaciones = descargar(tramo_desde.isoformat(), tramo_hasta.isoformat())
+            self.guardar(usuario, cuenta, pais, tramo_desde, tramo_hasta, operaciones)
+        ahora = time.monotonic()
+        self.verificadas = {
+            clave: instante for clave, instante in self.verificadas.items()
+            if ahora - instante < TTL_SINCRONIZACION_OPERACIONES
+        }
+        self.verificadas[(token, usuario, cuenta, pais)] = ahora
+
+@st.cache_resource
+def obtener_libro_operaciones():
+    """
+    Devuelve el libro local de operaciones del proceso
+    """
+    return LibroOperaciones(os.path.join(directorio_cache_local(), 'operaciones.sqlite'))
+
+def descargar_operaciones(access_token, id_cliente=None, fecha_desde=None, fecha_hasta=None, pais='argentina'):
+    """
+    Descarga de /operaciones las operaciones del período (todas las que informe la API).
+    
+    Raises:
+        requests.HTTPError: Si la API responde con error
+    """
+    params = {
+        'filtro.pais': pais
+    }
+    if fecha_desde:
+        params['filtro.fechaDesde'] = fecha_desde
+    if fecha_hasta:
+        params['filtro.fechaHasta'] = fecha_hasta
+    if id_cliente:
+        params['filtro.cuentaComitente'] = id_cliente
+    
+    headers = {
+        'Accept': 'application/json',
+        'Authorization': f'Bearer {access_token}'
+    }
+    response = obtener_cliente_iol().get('https://api.invertironline.com/api/v2/operaciones', headers=headers, params=params)
+    response.raise_for_status()
+    return response.json() or []
+
+def obtener_operaciones_sincronizadas(access_token, id_cliente, fecha_desde, fecha_hasta=None, pais='argentina'):
+    """
+    Devuelve las operaciones del cliente en el período desde el libro local, trayendo
+    antes de la API sólo lo nuevo desde la última sincronización.
+    Sólo se sirven datos locales después de que la API aceptó el token para la cuenta,
+    y sólo los que sincronizó el mismo usuario; si no se conoce el usuario del token
+    se descarga el período directamente sin pasar por el libro.
+    
+    Raises:
+        requests.HTTPError: Si la API rechaza la sincronización
+    """
+    usuario = obtener_cliente_iol().usuario_de_token(access_token)
+    if not usuario:
+        return descargar_operaciones(access_token, id_cliente, fecha_desde, fecha_hasta, pais)
+    libro = obtener_libro_operaciones()
+    cuenta = str(id_cliente)
+    desde = _a_fecha(fecha_desde)
+    hasta = _a_fecha(fecha_hasta) if fecha_hasta else date.today()
+    
+    def descargar(tramo_desde, tramo_hasta):
+        return descargar_operaciones(access_token, id_cliente, tramo_desde, tramo_hasta, pais)
+    
+    # Una sola sincronización por cuenta aunque varias vistas la pidan a la vez
+    libro.en_curso.ejecutar(
+        (usuario, cuenta, pais, desde.isoformat(), access_token),
+        libro.sincronizar, access_token, usuario, cuenta, pais, desde, descargar
+    )
+    return libro.leer(usuario, cuenta, pais, desde, hasta)
+
 def obtener_movimientos_reales(access_token, id_cliente=None, fecha_desde=None, fecha_hasta=None):
     """
     Obtiene los movimientos/operaciones de la cuenta usando la API de InvertirOnline
@@ -9112,102 +10504,88 @@ def obtener_movimientos_reales(access_token, id_cliente=None, fecha_desde=None,
         list: Lista de operaciones/movimientos de la cuenta
     """
     # Primero intentar con la API
-    url = 'https://api.invertironline.com/api/v2/operaciones'
-    
-    headers = {
-        'Accept': 'application/json',
-        'Authorization': f'Bearer {access_token}'
-    }
-    
-    # Parámetros de consulta para filtrar por fechas (formato correcto de la API)
-    params = {
-        'filtro.pais': 'argentina'  # País por defecto
-    }
-    if fecha_desde:
-        params['filtro.fechaDesde'] = fecha_desde
-    if fecha_hasta:
-        params['filtro.fechaHasta'] = fecha_hasta
-    if id_cliente:
-        params['filtro.cuentaComitente'] = id_cliente
-    
     try:
         st.info(f"🔗 Consultando operaciones desde {fecha_desde or 'inicio'} hasta {fecha_hasta or 'actual'}")
-        st.info(f"🔗 URL: {url}")
-        st.info(f"🔗 Parámetros: {params}")
         
-        response = requests.get(url, headers=headers, params=params)
+        operaciones = None
+        if id_cliente and fecha_desde:
+            # Libro local: sólo se piden a la API las operaciones nuevas desde la última consulta
+            try:
+                operaciones = obtener_operaciones_sincronizadas(access_token, id_cliente, fecha_desde, fecha_hasta)
+            except (sqlite3.Error, OSError) as e:
+                print(f"Libro local de operaciones no disponible: {str(e)}")
+        if operaciones is None:
+            operaciones = descargar_operaciones(access_token, id_cliente, fecha_desde, fecha_hasta)
+        
+        st.success(f"📊 Se obtuvieron {len(operaciones)} operaciones via API")
         
-        if response.status_code == 200:
-            operaciones = response.json()
-            st.success(f"📊 Se obtuvieron {len(operaciones)} operaciones via API")
+        # Validar que las operaciones corresponden al cliente correcto
+        if operaciones and id_cliente:
+            # Verificar campos de cliente en las operaciones
+            campos_cliente = ['cuentaComitente', 'numeroCliente', 'id', 'cliente', 'accountId']
+            operaciones_con_cliente = []
+            operaciones_sin_cliente = []
             
-            # Validar que las operaciones corresponden al cliente correcto
-            if operaciones and id_cliente:
-                # Verificar campos de cliente en las operaciones
-                campos_cliente = ['cuentaComitente', 'numeroCliente', 'id', 'cliente', 'accountId']
-                operaciones_con_cliente = []
-                operaciones_sin_cliente = []
+            for op in operaciones:
+                op_cliente = None
+                for campo in campos_cliente:
+                    if campo in op and op[campo] is not None:
+                        op_cliente = op[campo]
+                        break
                 
-                for op in operaciones:
-                    op_cliente = None
-                    for campo in campos_cliente:
-                        if campo in op and op[campo] is not None:
-                            op_cliente = op[campo]
-                            break
-                    
-                    if op_cliente is not None:
-                        operaciones_con_cliente.append((op, op_cliente))
+                if op_cliente is not None:
+                    operaciones_con_cliente.append((op, op_cliente))
+                else:
+                    operaciones_sin_cliente.append(op)
+            
+            # Si todas las operaciones tienen None como cliente, asumir que son del cliente solicitado
+            # (ya que la API fue llamada con filtro.cuentaComitente)
+            if len(operaciones_con_cliente) == 0 and len(operaciones_sin_cliente) == len(operaciones):
+                st.info(f"ℹ️ Las operaciones no tienen campo de cliente, pero fueron obtenidas con filtro para cliente {id_cliente}")
+                st.info(f"✅ Asumiendo que las {len(operaciones)} operaciones corresponden al cliente {id_cliente}")
+                
+                # Mostrar información de debug
+                simbolos_encontrados = list(set([op.get('simbolo', 'N/A') for op in operaciones]))
+                st.info(f"🔍 Símbolos encontrados: {simbolos_encontrados}")
+                st.info(f"📊 Operaciones obtenidas: {len(operaciones)}")
+                
+                if len(operaciones) > 0:
+                    st.info(f"🔍 Primeras 3 operaciones: {operaciones[:3]}")
+            else:
+                # Filtrar operaciones que tienen cliente válido
+                operaciones_filtradas = []
+                for op, op_cliente in operaciones_con_cliente:
+                    if str(op_cliente) == str(id_cliente):
+                        operaciones_filtradas.append(op)
                     else:
-                        operaciones_sin_cliente.append(op)
+                        st.warning(f"⚠️ Operación con cliente diferente: {op_cliente} (esperado: {id_cliente})")
                 
-                # Si todas las operaciones tienen None como cliente, asumir que son del cliente solicitado
-                # (ya que la API fue llamada con filtro.cuentaComitente)
-                if len(operaciones_con_cliente) == 0 and len(operaciones_sin_cliente) == len(operaciones):
-                    st.info(f"ℹ️ Las operaciones no tienen campo de cliente, pero fueron obtenidas con filtro para cliente {id_cliente}")
-                    st.info(f"✅ Asumiendo que las {len(operaciones)} operaciones corresponden al cliente {id_cliente}")
-                    
-                    # Mostrar información de debug
+                if len(operaciones_filtradas) != len(operaciones_con_cliente):
+                    st.warning(f"⚠️ Filtradas {len(operaciones_con_cliente) - len(operaciones_filtradas)} operaciones de otros clientes")
+                
+                operaciones = operaciones_filtradas
+                
+                # Mostrar información de debug
+                if operaciones:
                     simbolos_encontrados = list(set([op.get('simbolo', 'N/A') for op in operaciones]))
                     st.info(f"🔍 Símbolos encontrados: {simbolos_encontrados}")
-                    st.info(f"📊 Operaciones obtenidas: {len(operaciones)}")
-                    
-                    if len(operaciones) > 0:
-                        st.info(f"🔍 Primeras 3 operaciones: {operaciones[:3]}")
+                    st.info(f"📊 Operaciones válidas para cliente {id_cliente}: {len(operaciones)}")
                 else:
-                    # Filtrar operaciones que tienen cliente válido
-                    operaciones_filtradas = []
-                    for op, op_cliente in operaciones_con_cliente:
-                        if str(op_cliente) == str(id_cliente):
-                            operaciones_filtradas.append(op)
-                        else:
-                            st.warning(f"⚠️ Operación con cliente diferente: {op_cliente} (esperado: {id_cliente})")
-                    
-                    if len(operaciones_filtradas) != len(operaciones_con_cliente):
-                        st.warning(f"⚠️ Filtradas {len(operaciones_con_cliente) - len(operaciones_filtradas)} operaciones de otros clientes")
-                    
-                    operaciones = operaciones_filtradas
-                    
-                    # Mostrar información de debug
-                    if operaciones:
-                        simbolos_encontrados = list(set([op.get('simbolo', 'N/A') for op in operaciones]))
-                        st.info(f"🔍 Símbolos encontrados: {simbolos_encontrados}")
-                        st.info(f"📊 Operaciones válidas para cliente {id_cliente}: {len(operaciones)}")
-                    else:
-                        st.warning("⚠️ No se encontraron operaciones válidas para el cliente especificado")
-            else:
-                st.warning("⚠️ No se encontraron operaciones en el período especificado")
-            
-            return operaciones
+                    st.warning("⚠️ No se encontraron operaciones válidas para el cliente especificado")
         else:
-            st.warning(f"⚠️ API falló con código {response.status_code}, intentando scraping...")
-            # Fallback a scraping básico primero
-            operaciones = obtener_operaciones_via_scraping(access_token, id_cliente, fecha_desde, fecha_hasta)
-            if not operaciones:
-                # Si el scraping básico falla, intentar scraping avanzado
-                st.info("🔍 Scraping básico falló, intentando scraping avanzado...")
-                return obtener_operaciones_via_scraping_avanzado(access_token, id_cliente, fecha_desde, fecha_hasta)
-            return operaciones
-            
+            st.warning("⚠️ No se encontraron operaciones en el período especificado")
+        
+        return operaciones
+        
+    except requests.HTTPError as e:
+        st.warning(f"⚠️ API falló con código {e.response.status_code}, intentando scraping...")
+        # Fallback a scraping básico primero
+        operaciones = obtener_operaciones_via_scraping(access_token, id_cliente, fecha_desde, fecha_hasta)
+        if not operaciones:
+            # Si el scraping básico falla, intentar scraping avanzado
+            st.info("🔍 Scraping básico falló, intentando scraping avanzado...")
+            return obtener_operaciones_via_scraping_avanzado(access_token, id_cliente, fecha_desde, fecha_hasta)
+        return operaciones
     except requests.exceptions.RequestException as e:
         st.warning(f"⚠️ Error en API: {e}, intentando scraping...")
         # Fallback a scraping básico primero
@@ -9796,74 +11174,106 @@ def calcular_evolucion_portafolio_unificada(token_acceso, id_cliente, fecha_desd
         st.error(f"Error calculando evolución unificada: {e}")
         return None
 
+def calcular_posiciones_operaciones(df_ops):
+    """
+    Calcula de forma vectorizada la posición de cada símbolo después de cada operación.
+    
+    Las compras suman y las ventas restan la cantidad operada; una venta nunca deja la
+    posición por debajo de cero. El costo acumulado sólo crece con las compras y el
+    precio promedio se actualiza en cada compra (las ventas lo mantienen).
+    
+    Args:
+        df_ops (DataFrame): Operaciones con fechaOrden, simbolo, tipo, cantidadOperada y precioOperado
+    
+    Returns:
+        DataFrame: fecha (date), simbolo, cantidad y precio_promedio por operación, en el
+        orden en que se aplican (por fecha y, dentro de cada fecha, en el orden recibido)
+    """
+    ops = pd.DataFrame({
+        'dia': df_ops['fechaOrden'].dt.normalize(),
+        'fecha': df_ops['fechaOrden'].dt.date,
+        'simbolo': df_ops['simbolo'],
+        'tipo': df_ops['tipo'],
+        'cantidad_op': pd.to_numeric(df_ops['cantidadOperada'], errors='coerce'),
+        'precio_op': pd.to_numeric(df_ops['precioOperado'], errors='coerce'),
+    }).sort_values('dia', kind='stable').reset_index(drop=True)
+    
+    es_compra = ops['tipo'].eq('Compra')
+    es_venta = ops['tipo'].eq('Venta')
+    delta = pd.Series(
+        np.where(es_compra, ops['cantidad_op'], np.where(es_venta, -ops['cantidad_op'], 0.0)), index=ops.index
+    )
+    por_simbolo = ops['simbolo']
+    
+    # Posición con piso en cero: cada vez que la suma acumulada marca un nuevo mínimo
+    # negativo la posición vuelve a cero y la suma se reinicia desde esa operación
+    acumulado = delta.groupby(por_simbolo).cumsum()
+    minimo_previo = acumulado.groupby(por_simbolo).cummin().groupby(por_simbolo).shift(fill_value=0).clip(upper=0)
+    reinicio = acumulado < minimo_previo
+    tramo = reinicio.astype(int).groupby(por_simbolo).cumsum()
+    cantidad = delta.where(~reinicio, 0.0).groupby([por_simbolo, tramo]).cumsum()
+    # Una cantidad faltante deja la posición indefinida desde ese punto (como NaN + x)
+    sin_dato = delta.isna().groupby(por_simbolo).cummax()
+    ops['cantidad'] = cantidad.mask(sin_dato)
+    
+    # Costo acumulado de las compras y precio promedio vigente tras la última compra
+    costo = pd.Series(np.where(es_compra, ops['cantidad_op'] * ops['precio_op'], 0.0), index=ops.index)
+    costo_sin_dato = costo.isna().groupby(por_simbolo).cummax()
+    costo = costo.groupby(por_simbolo).cumsum().mask(costo_sin_dato)
+    precio_compra = (costo / ops['cantidad']).where(ops['cantidad'] > 0, 0.0)
+    ops['precio_promedio'] = (
+        precio_compra.where(es_compra).groupby(por_simbolo).ffill().fillna(0.0)
+    )
+    return ops[['fecha', 'simbolo', 'cantidad', 'precio_promedio']]
+
 def crear_timeline_composicion(df_ops, portafolio_actual):
     """
-    Crea una línea de tiempo de la composición del portafolio basada en operaciones reales
+    Crea una línea de tiempo de la composición del portafolio basada en operaciones reales.
+    Las posiciones al cierre de cada fecha salen de calcular_posiciones_operaciones, sin
+    recorrer las operaciones fecha por fecha.
     """
     try:
         # Obtener fechas únicas de operaciones
-        fechas_ops = df_ops['fechaOrden'].dt.date.unique()
-        fechas_ops = sorted(fechas_ops)
+        fechas_op = df_ops['fechaOrden'].dt.date
+        fechas_ops = sorted(fechas_op.unique())
         
         # Agregar fecha actual
         fecha_actual = datetime.now().date()
         if fecha_actual not in fechas_ops:
             fechas_ops.append(fecha_actual)
         
-        timeline = []
-        posiciones_actuales = {}
+        # Posición de cada símbolo al cierre de cada fecha (fechas x símbolos)
+        posiciones = calcular_posiciones_operaciones(df_ops)
+        simbolos = list(posiciones['simbolo'].dropna().unique())
+        cierre = posiciones.dropna(subset=['simbolo']).groupby(['fecha', 'simbolo'], sort=False).last()
+        cantidades = (
+            cierre['cantidad'].unstack('simbolo')
+            .reindex(index=fechas_ops, columns=simbolos)
+            .ffill()
+        )
         
-        for fecha in fechas_ops:
-            # Obtener operaciones de esta fecha
-            ops_fecha = df_ops[df_ops['fechaOrden'].dt.date == fecha]
-            
-            # Actualizar posiciones
-            for _, op in ops_fecha.iterrows():
-                simbolo = op['simbolo']
-                cantidad = op['cantidadOperada']
-                precio = op['precioOperado']
-                tipo = op['tipo']
-                
-                if simbolo not in posiciones_actuales:
-                    posiciones_actuales[simbolo] = {
-                        'cantidad': 0,
-                        'precio_promedio': 0,
-                        'valor_total': 0,
-                        'operaciones': []
-                    }
-                
-                if tipo == 'Compra':
-                    # Actualizar cantidad y precio promedio ponderado
-                    cantidad_anterior = posiciones_actuales[simbolo]['cantidad']
-                    valor_anterior = posiciones_actuales[simbolo]['valor_total']
-                    
-                    cantidad_nueva = cantidad_anterior + cantidad
-                    valor_nueva = valor_anterior + (cantidad * precio)
-                    
-                    posiciones_actuales[simbolo]['cantidad'] = cantidad_nueva
-                    posiciones_actuales[simbolo]['valor_total'] = valor_nueva
-                    posiciones_actuales[simbolo]['precio_promedio'] = valor_nueva / cantidad_nueva if cantidad_nueva > 0 else 0
-                    
-                    posiciones_actuales[simbolo]['operaciones'].append({
-                        'fecha': fecha,
-                        'tipo': 'Compra',
-                        'cantidad': cantidad,
-                        'precio': precio
-                    })
-                elif tipo == 'Venta':
-                    # Reducir cantidad manteniendo el precio promedio
-                    posiciones_actuales[simbolo]['cantidad'] -= cantidad
-                    if posiciones_actuales[simbolo]['cantidad'] < 0:
-                        posiciones_actuales[simbolo]['cantidad'] = 0
-                    
-                    posiciones_actuales[simbolo]['operaciones'].append({
-                        'fecha': fecha,
-                        'tipo': 'Venta',
-                        'cantidad': cantidad,
-                        'precio': precio
-                    })
-            
-            # Calcular valor del portafolio en esta fecha
+        # Estado final de cada posición (para la fecha actual si el portafolio no trae valores)
+        finales = posiciones.dropna(subset=['simbolo']).groupby('simbolo', sort=False).last()
+        posiciones_actuales = {
+            simbolo: {'cantidad': finales.at[simbolo, 'cantidad'], 'precio_promedio': finales.at[simbolo, 'precio_promedio']}
+            for simbolo in simbolos
+        }
+        
+        # Valuación histórica: cantidades al cierre por el precio actual de cada símbolo
+        precios = np.array([obtener_precio_actual_simbolo(portafolio_actual, simbolo) or np.nan for simbolo in simbolos], dtype=float)
+        matriz = cantidades.to_numpy(dtype=float)
+        validos = (matriz > 0) & (precios > 0)
+        valores = np.where(validos, matriz * precios, np.nan)
+        # Suma en el orden de los símbolos, igual que la acumulación posición por posición
+        valores_totales = np.nancumsum(valores, axis=1)[:, -1] if simbolos else np.zeros(len(fechas_ops))
+        
+        # Operaciones de cada fecha (los registros se arman una sola vez)
+        indices_fecha = df_ops.groupby(fechas_op, sort=False).indices
+        registros = df_ops.to_dict('records')
+        
+        timeline = []
+        for i, fecha in enumerate(fechas_ops):
+            posiciones_ops = indices_fecha.get(fecha, [])
             valor_total = 0
             composicion = {}
             
@@ -9906,21 +11316,16 @@ def crear_timeline_composicion(df_ops, portafolio_actual):
                                     'peso': 0  # Se calculará después
                                 }
             else:
-                # Para fechas históricas, calcular basado en posiciones acumuladas
-                for simbolo, pos in posiciones_actuales.items():
-                    if pos['cantidad'] > 0:  # Solo posiciones activas
-                        # Obtener precio actual del símbolo desde el portafolio actual
-                        precio_actual = obtener_precio_actual_simbolo(portafolio_actual, simbolo)
-                        if precio_actual and precio_actual > 0:
-                            valor_activo = pos['cantidad'] * precio_actual
-                            valor_total += valor_activo
-                            
-                            composicion[simbolo] = {
-                                'cantidad': pos['cantidad'],
-                                'precio_actual': precio_actual,
-                                'valor': valor_activo,
-                                'peso': 0  # Se calculará después
-                            }
+                # Para fechas históricas, posiciones activas valuadas al precio actual
+                for j in np.flatnonzero(validos[i]):
+                    composicion[simbolos[j]] = {
+                        'cantidad': matriz[i, j],
+                        'precio_actual': precios[j],
+                        'valor': valores[i, j],
+                        'peso': 0  # Se calculará después
+                    }
+                if composicion:
+                    valor_total = valores_totales[i]
                 
                 # Si no hay posiciones activas en esta fecha, usar valor del día anterior
                 if valor_total == 0 and timeline:
@@ -9931,10 +11336,7 @@ def crear_timeline_composicion(df_ops, portafolio_actual):
             # Calcular pesos basados en valores reales
             if valor_total > 0:
                 for simbolo in composicion:
-                    if simbolo in composicion and 'valor' in composicion[simbolo]:
-                        composicion[simbolo]['peso'] = composicion[simbolo]['valor'] / valor_total
-                    else:
-                        composicion[simbolo]['peso'] = 0
+                    composicion[simbolo]['peso'] = composicion[simbolo]['valor'] / valor_total
             else:
                 # Si no hay valor total, distribuir equitativamente
                 num_activos = len(composicion)
@@ -9943,18 +11345,17 @@ def crear_timeline_composicion(df_ops, portafolio_actual):
                     for simbolo in composicion:
                         composicion[simbolo]['peso'] = peso_por_activo
             
-            # Debug: Mostrar información para fechas con operaciones
-            if len(ops_fecha) > 0:
-                st.info(f"📅 {fecha}: {len(ops_fecha)} operaciones, valor total: ${valor_total:,.2f}, {len(composicion)} activos")
-            
             timeline.append({
                 'fecha': fecha,
                 'valor_total': valor_total,
                 'composicion': composicion,
-                'num_operaciones': len(ops_fecha),
-                'operaciones_dia': ops_fecha.to_dict('records') if len(ops_fecha) > 0 else []
+                'num_operaciones': len(posiciones_ops),
+                'operaciones_dia': [registros[k] for k in posiciones_ops]
             })
         
+        fechas_con_operaciones = sum(1 for entrada in timeline if entrada['num_operaciones'] > 0)
+        st.info(f"📅 Timeline: {len(timeline)} fechas, {fechas_con_operaciones} con operaciones, {len(simbolos)} activos")
+        
         return timeline
         
     except Exception as e:
@@ -11043,6 +12444,112 @@ def mostrar_operaciones_reales():
         else:
             st.error("❌ No se pudieron obtener las operaciones")
 
+def mostrar_cartera_asesor():
+    """
+    Vista de la cartera completa del asesor: tenencias de todos los clientes (o de los
+    seleccionados) consolidadas, con exposición por activo y concentración por cliente.
+    """
+    st.title("📚 Cartera del Asesor")
+    
+    token_acceso = st.session_state.token_acceso
+    clientes = st.session_state.clientes or []
+    if not clientes:
+        st.info("👆 No hay clientes cargados en la barra lateral")
+        return
+    
+    nombres = {
+        str(c.get('numeroCliente', c.get('id'))): c.get('apellidoYNombre', c.get('nombre', 'Cliente'))
+        for c in clientes
+    }
+    ids_seleccionados = st.multiselect(
+        "Clientes a incluir:",
+        options=list(nombres),
+        default=list(nombres),
+        format_func=lambda x: nombres.get(x, x),
+        key="clientes_cartera_asesor"
+    )
+    
+    if st.button("📥 Cargar cartera", use_container_width=True):
+        inicio = time.perf_counter()
+        with st.spinner(f"Cargando {len(ids_seleccionados)} clientes..."):
+            st.session_state.cartera_asesor = cargar_cartera_asesor(token_acceso, ids_seleccionados)
+        st.caption(f"⏱️ Cartera cargada en {time.perf_counter() - inicio:.1f}s")
+    
+    if 'cartera_asesor' not in st.session_state:
+        st.info("👆 Seleccione los clientes y cargue la cartera")
+        return
+    
+    df_tenencias, df_saldos, errores = st.session_state.cartera_asesor
+    
+    if errores:
+        st.warning(f"⚠️ {len(errores)} clientes se cargaron con errores")
+        with st.expander("❌ Ver errores de carga"):
+            for id_cliente, mensajes in errores.items():
+                st.text(f"{nombres.get(id_cliente, id_cliente)}: {'; '.join(mensajes)}")
+    
+    if df_tenencias.empty:
+        st.warning("No se encontraron tenencias para los clientes seleccionados")
+        return
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("Clientes", df_tenencias['cliente'].nunique())
+    with col2:
+        st.metric("Posiciones", len(df_tenencias))
+    
+    # Pesos y dólares no se suman entre sí: totales, exposición y concentración por moneda
+    valuacion_por_moneda = df_tenencias.groupby('moneda', observed=True)['valuacion'].sum()
+    disponible_por_moneda = df_saldos.groupby('moneda', observed=True)['disponible'].sum()
+    st.markdown("#### 💰 Totales por Moneda")
+    totales = pd.DataFrame({'Valuación': valuacion_por_moneda, 'Disponible': disponible_por_moneda}).fillna(0)
+    totales.index = totales.index.astype(str)
+    st.dataframe(totales.style.format('${:,.2f}'), use_container_width=True)
+    
+    monedas = [str(m) for m in valuacion_por_moneda.sort_values(ascending=False).index]
+    moneda = st.selectbox("Moneda de las tenencias a analizar:", monedas, key="moneda_cartera_asesor")
+    df_moneda = df_tenencias[df_tenencias['moneda'] == moneda]
+    
+    # Exposición de la cartera por activo y por tipo de instrumento
+    exposicion = df_moneda.groupby('simbolo', observed=True).agg(
+        valuacion=('valuacion', 'sum'), cantidad=('cantidad', 'sum'), clientes=('cliente', 'nunique')
+    ).sort_values('valuacion', ascending=False)
+    exposicion['peso'] = exposicion['valuacion'] / exposicion['valuacion'].sum()
+    
+    st.markdown(f"#### 📊 Exposición por Activo ({moneda})")
+    top = exposicion.head(20)
+    fig = go.Figure(go.Bar(x=top.index.astype(str), y=top['valuacion'], text=[f"{p:.1%}" for p in top['peso']]))
+    fig.update_layout(title=f"Principales 20 activos de la cartera en {moneda}", xaxis_title="Símbolo", yaxis_title="Valuación")
+    st.plotly_chart(fig, use_container_width=True)
+    
+    por_tipo = df_moneda.groupby('tipo', observed=True)['valuacion'].sum()
+    fig_tipo = go.Figure(go.Pie(labels=por_tipo.index.astype(str), values=por_tipo.values, hole=0.4))
+    fig_tipo.update_layout(title=f"Distribución por tipo de instrumento ({moneda})")
+    st.plotly_chart(fig_tipo, use_container_width=True)
+    
+    # Concentración por cliente dentro de la moneda: índice Herfindahl y peso de la mayor posición
+    st.markdown(f"#### ⚖️ Concentración por Cliente ({moneda})")
+    total_cliente = df_moneda.groupby('cliente', observed=True)['valuacion'].transform('sum')
+    pesos = (df_moneda['valuacion'] / total_cliente.where(total_cliente > 0)).fillna(0)
+    concentracion = pd.DataFrame({
+        'cliente': df_moneda['cliente'], 'valuacion': df_moneda['valuacion'],
+        'peso': pesos, 'peso2': pesos ** 2
+    }).groupby('cliente', observed=True).agg(
+        valuacion=('valuacion', 'sum'), posiciones=('peso', 'size'),
+        herfindahl=('peso2', 'sum'), mayor_posicion=('peso', 'max')
+    ).sort_values('herfindahl', ascending=False)
+    concentracion.index = [nombres.get(str(c), str(c)) for c in concentracion.index]
+    st.dataframe(concentracion.style.format({
+        'valuacion': '${:,.2f}', 'herfindahl': '{:.3f}', 'mayor_posicion': '{:.1%}'
+    }), use_container_width=True)
+    
+    with st.expander(f"📋 Tenencias por cliente y activo ({moneda})"):
+        st.dataframe(exposicion.style.format({'valuacion': '${:,.2f}', 'peso': '{:.2%}'}), use_container_width=True)
+        matriz = df_moneda.pivot_table(
+            index='cliente', columns='simbolo', values='valuacion', aggfunc='sum', observed=True, fill_value=0
+        )
+        matriz.index = [nombres.get(str(c), str(c)) for c in matriz.index]
+        st.dataframe(matriz, use_container_width=True)
+
 def mostrar_analisis_portafolio():
     cliente = st.session_state.cliente_seleccionado
     token_acceso = st.session_state.token_acceso
@@ -11059,21 +12566,49 @@ def mostrar_analisis_portafolio():
     # Cargar datos una sola vez y cachearlos
     @st.cache_data(ttl=600)  # Cache por 10 minutos para mejor rendimiento
     def cargar_datos_cliente(token, cliente_id):
-        """Carga y cachea los datos del cliente para evitar llamadas repetitivas"""
-        portafolio_ar = obtener_portafolio(token, cliente_id, 'Argentina')
-        portafolio_eeuu = obtener_portafolio_eeuu(token, cliente_id)
-        estado_cuenta_ar = obtener_estado_cuenta(token, cliente_id)
-        estado_cuenta_eeuu = obtener_estado_cuenta_eeuu(token)
-        return portafolio_ar, portafolio_eeuu, estado_cuenta_ar, estado_cuenta_eeuu
+        """
+        Carga y cachea los datos del cliente para evitar llamadas repetitivas.
+        Las cuatro llamadas son independientes y se hacen a la vez, con un presupuesto
+        común; si alguna falla se devuelven igual las demás, junto con las que vencieron
+        y las que fallaron (error o sin datos).
+        """
+        resultados, vencidos = ejecutar_concurrentemente({
+            'portafolio_ar': lambda: obtener_portafolio(token, cliente_id, 'Argentina'),
+            'portafolio_eeuu': lambda: obtener_portafolio_eeuu(token, cliente_id),
+            'estado_cuenta_ar': lambda: obtener_estado_cuenta(token, cliente_id),
+            'estado_cuenta_eeuu': lambda: obtener_estado_cuenta_eeuu(token, cliente_id),
+        }, timeout=PRESUPUESTO_CARGA_CLIENTE)
+        return (
+            resultados['portafolio_ar'], resultados['portafolio_eeuu'],
+            resultados['estado_cuenta_ar'], resultados['estado_cuenta_eeuu'],
+            sorted(vencidos),
+            sorted(nombre for nombre, valor in resultados.items() if valor is None and nombre not in vencidos)
+        )
     
     # Cargar datos con cache y spinner optimizado
     with st.spinner("🔄 Cargando datos del cliente..."):
         try:
-            portafolio_ar, portafolio_eeuu, estado_cuenta_ar, estado_cuenta_eeuu = cargar_datos_cliente(token_acceso, id_cliente)
+            (portafolio_ar, portafolio_eeuu, estado_cuenta_ar, estado_cuenta_eeuu,
+             vencidos, fallidos) = cargar_datos_cliente(token_acceso, id_cliente)
         except Exception as e:
             st.error(f"Error cargando datos del cliente: {str(e)}")
             return
     
+    if vencidos or fallidos:
+        # No conservar en cache una carga incompleta: se reintenta en el próximo rerun
+        cargar_datos_cliente.clear(token_acceso, id_cliente)
+    if vencidos:
+        st.warning(f"⏱️ Algunos datos del cliente tardaron demasiado y no se cargaron: {', '.join(vencidos)}")
+    
+    # Precargar en segundo plano las series que van a pedir las pestañas de análisis
+    try:
+        precargar_historicos_cliente(
+            token_acceso, [portafolio_ar, portafolio_eeuu],
+            st.session_state.fecha_desde, st.session_state.fecha_hasta
+        )
+    except Exception as e:
+        print(f"No se pudo iniciar la precarga de históricos: {str(e)}")
+    
     # Crear tabs con iconos
     tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs([
         "🇦🇷 Portafolio Argentina", 
@@ -11405,6 +12940,8 @@ def main():
         st.session_state.token_acceso = None
     if 'refresh_token' not in st.session_state:
         st.session_state.refresh_token = None
+    if 'gestor_tokens' not in st.session_state:
+        st.session_state.gestor_tokens = None
     if 'clientes' not in st.session_state:
         st.session_state.clientes = []
     if 'cliente_seleccionado' not in st.session_state:
@@ -11427,11 +12964,12 @@ def main():
                 if st.form_submit_button("🚀 Conectar a IOL", use_container_width=True):
                     if usuario and contraseña:
                         with st.spinner("Conectando..."):
-                            token_acceso, refresh_token = obtener_tokens(usuario, contraseña)
+                            gestor_tokens = obtener_tokens(usuario, contraseña)
                             
-                            if token_acceso:
-                                st.session_state.token_acceso = token_acceso
-                                st.session_state.refresh_token = refresh_token
+                            if gestor_tokens:
+                                st.session_state.gestor_tokens = gestor_tokens
+                                st.session_state.token_acceso = gestor_tokens.token_acceso
+                                st.session_state.refresh_token = gestor_tokens.refresh_token
                                 st.success("✅ Conexión exitosa!")
                                 st.rerun()
                             else:
@@ -11460,23 +12998,23 @@ def main():
             st.session_state.fecha_desde = fecha_desde
             st.session_state.fecha_hasta = fecha_hasta
             
-            # Verificar y refrescar token si es necesario
-            if st.session_state.token_acceso and st.session_state.refresh_token:
-                nuevo_token, nuevo_refresh = verificar_y_refrescar_token(
-                    st.session_state.token_acceso, 
-                    st.session_state.refresh_token
-                )
-                if nuevo_token:
-                    st.session_state.token_acceso = nuevo_token
-                    st.session_state.refresh_token = nuevo_refresh
-                else:
-                    # Token no válido, limpiar sesión
-                    st.session_state.token_acceso = None
-                    st.session_state.refresh_token = None
-                    st.session_state.clientes = []
-                    st.session_state.cliente_seleccionado = None
-                    st.error("❌ Sesión expirada. Por favor, inicie sesión nuevamente.")
-                    st.rerun()
+            # Tomar el token vigente del gestor: sólo hay llamada a la API si ya venció
+            gestor_tokens = st.session_state.gestor_tokens
+            nuevo_token = gestor_tokens.token_vigente() if gestor_tokens else None
+            if nuevo_token:
+                st.session_state.token_acceso = nuevo_token
+                st.session_state.refresh_token = gestor_tokens.refresh_token
+            else:
+                # Token no válido, limpiar sesión
+                if gestor_tokens:
+                    gestor_tokens.cerrar()
+                st.session_state.gestor_tokens = None
+                st.session_state.token_acceso = None
+                st.session_state.refresh_token = None
+                st.session_state.clientes = []
+                st.session_state.cliente_seleccionado = None
+                st.error("❌ Sesión expirada. Por favor, inicie sesión nuevamente.")
+                st.rerun()
             
             # Obtener lista de clientes
             if not st.session_state.clientes and st.session_state.token_acceso:
@@ -11520,10 +13058,11 @@ def main():
                 # Botón para refrescar token manualmente
                 if st.button("🔄 Refrescar Token", use_container_width=True):
                     with st.spinner("Refrescando token..."):
-                        nuevo_token, nuevo_refresh = refrescar_token(st.session_state.refresh_token)
+                        gestor_tokens = st.session_state.gestor_tokens
+                        nuevo_token = gestor_tokens.refrescar() if gestor_tokens else None
                         if nuevo_token:
                             st.session_state.token_acceso = nuevo_token
-                            st.session_state.refresh_token = nuevo_refresh
+                            st.session_state.refresh_token = gestor_tokens.refresh_token
                             st.success("✅ Token refrescado")
                             st.rerun()
                         else:
@@ -11537,7 +13076,7 @@ def main():
             st.sidebar.title("Menú Principal")
             opcion = st.sidebar.radio(
                 "Seleccione una opción:",
-                ("🏠 Inicio", "📊 Análisis de Portafolio"),
+                ("🏠 Inicio", "📊 Análisis de Portafolio", "📚 Cartera del Asesor"),
                 index=0,
             )
 
@@ -11549,6 +13088,8 @@ def main():
                     mostrar_analisis_portafolio()
                 else:
                     st.info("👆 Seleccione un cliente en la barra lateral para comenzar")
+            elif opcion == "📚 Cartera del Asesor":
+                mostrar_cartera_asesor()
         else:
             st.info("👆 Ingrese sus credenciales para comenzar")
             